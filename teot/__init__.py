@@ -0,0 +1,27 @@
+import importlib
+
+# 常用的类可以直接从teot导入，但只在第一次访问时才导入对应的模块，import teot本身不会加载cv2和模型
+_exports = {
+    "Eye": "teot.base",
+    "DetectEye": "teot.detect",
+    "TrackEye": "teot.track",
+    "MultiEye": "teot.multi",
+    "Supervisor": "teot.supervisor",
+    "AsyncPipeline": "teot.aio",
+    "OfflineRunner": "teot.offline",
+    "LazyModel": "teot.utils.model",
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError(f"module 'teot' has no attribute '{name}'")
+    value = getattr(importlib.import_module(_exports[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
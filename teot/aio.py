@@ -0,0 +1,173 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Optional
+from .base import Eye
+
+# 视频结束时发给所有订阅者的结束标记
+END = object()
+
+
+class Subscription:
+    """
+    AsyncPipeline的一个订阅者，用async for逐个取出(frame_no, boxes, timestamp)
+
+    Parameters
+    ----------
+    maxsize : int. 缓冲的结果数
+    policy : str. 缓冲区满时的处理方式
+        * "drop". 丢掉最旧的结果，慢的订阅者不会拖慢流水线和其他订阅者，适合推送给websocket客户端
+        * "block". 流水线等待该订阅者取走结果，所有结果都不会丢
+    """
+
+    def __init__(self, maxsize: int, policy: str):
+        if policy not in ("drop", "block"):
+            raise ValueError(f"不支持的policy: {policy}")
+        self.queue = asyncio.Queue(maxsize)
+        self.policy = policy
+        self.dropped = 0
+
+    async def put(self, item):
+        if self.policy == "block" and item is not END:
+            await self.queue.put(item)
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(item)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self.queue.get()
+        if item is END:
+            raise StopAsyncIteration
+        return item
+
+
+class AsyncPipeline:
+    """
+    Eye的asyncio接口，不占用事件循环：取帧和推理都放在executor里执行，不打开显示窗口。
+    一个流水线可以有多个订阅者，结果会分发给每个订阅者，订阅者不需要各自占一个线程
+
+        pipeline = AsyncPipeline(MultiEye(det_eye, track_eye, video_type=0))
+        async for frame_no, boxes, timestamp in pipeline.stream():
+            ...
+
+    Parameters
+    ----------
+    eye : Eye. DetectEye、TrackEye或者MultiEye，需要有视频源。MultiEye输出的是显示时画在帧上的结果
+    executor : Optional[Executor]. 执行取帧和推理的executor，None则创建一个单线程的ThreadPoolExecutor。
+        Eye不是线程安全的，流水线同一时刻只会提交一个任务，传入多线程的executor也不会并发调用eye
+    queue_size : int, default 8. 每个订阅者默认缓冲的结果数
+    policy : str, default "drop". 订阅者默认的缓冲区满时的处理方式，见Subscription
+    realtime : bool, default True. 是否按eye.fps控制取帧的速度，处理本地视频时设为False则尽快处理
+    """
+
+    def __init__(self, eye: Eye, executor: Optional[Executor] = None, queue_size: int = 8,
+                 policy: str = "drop", realtime: bool = True):
+        self.eye = eye
+        self.own_executor = executor is None
+        self.executor = executor if executor else ThreadPoolExecutor(1, thread_name_prefix="teot")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.realtime = realtime
+        self.subscribers = []
+        self.task = None
+        self.finished = False
+        self.nf = 0
+        self.latest_nf = -1
+
+    def step(self):
+        """在executor里处理一帧，返回(frame_no, boxes, timestamp)，视频结束返回END，这一帧没有输出时返回None"""
+        frame = self.eye.next_frame()
+        if frame is None:
+            return END
+        timestamp = time.time()
+        nf = self.nf
+        self.nf += 1
+        boxes = self.eye.predict(frame)
+        if boxes is not None:
+            self.eye.record(nf, boxes)
+            self.eye.submit_preview(nf, frame, boxes, timestamp)
+            return nf, boxes, timestamp
+        # MultiEye的结果由它自己记录，这里取显示的帧和画在上面的框，sync模式下缓冲期间没有输出
+        nf = getattr(self.eye, "display_nf", -1)
+        if nf <= self.latest_nf:
+            return None
+        self.latest_nf = nf
+        return nf, self.eye.display_boxes, self.eye.display_time
+
+    async def produce(self):
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.eye.fps
+        deadline = loop.time()
+        try:
+            while True:
+                if self.realtime:
+                    delay = deadline - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                item = await loop.run_in_executor(self.executor, self.step)
+                if item is END:
+                    break
+                deadline = max(deadline + interval, loop.time() - interval)
+                if item is None:
+                    continue
+                # 所有订阅者都收到之后才处理下一帧，"block"的订阅者跟不上时流水线随之变慢
+                for sub in list(self.subscribers):
+                    await sub.put(item)
+        finally:
+            self.finished = True
+            for sub in list(self.subscribers):
+                await sub.put(END)
+            await loop.run_in_executor(self.executor, self.eye.close)
+            if self.own_executor:
+                self.executor.shutdown(wait=False)
+
+    def start(self):
+        """在当前事件循环里启动流水线，subscribe/stream时会自动调用"""
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.produce())
+        return self.task
+
+    def subscribe(self, queue_size: Optional[int] = None, policy: Optional[str] = None) -> Subscription:
+        """
+        增加一个订阅者，不再需要时调用unsubscribe，否则"block"的订阅者会让流水线停住
+
+        Parameters
+        ----------
+        queue_size : Optional[int]. 缓冲的结果数，None则使用流水线的默认值
+        policy : Optional[str]. 缓冲区满时的处理方式，None则使用流水线的默认值
+        """
+        sub = Subscription(queue_size or self.queue_size, policy or self.policy)
+        if self.finished:
+            sub.queue.put_nowait(END)
+        else:
+            self.subscribers.append(sub)
+            self.start()
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        if sub in self.subscribers:
+            self.subscribers.remove(sub)
+
+    async def stream(self, queue_size: Optional[int] = None, policy: Optional[str] = None):
+        """逐帧产出(frame_no, boxes, timestamp)，退出async for时自动取消订阅"""
+        sub = self.subscribe(queue_size, policy)
+        try:
+            async for item in sub:
+                yield item
+        finally:
+            self.unsubscribe(sub)
+
+    async def stop(self):
+        """停止流水线，所有订阅者的async for随之结束"""
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
@@ -5,7 +5,9 @@ import cv2
 import colorsys
 import random
 import time
-import numpy as np
+from collections import deque
+from .utils.capture import FrameReader
+from .utils.metrics import NULL_METRICS
 
 
 def get_n_hls_colors(num):
@@ -37,6 +39,18 @@ def ncolors(num):
     return rgb_colors
 
 
+def capture_size(cap, width: int, height: int) -> tuple:
+    """
+    视频源实际的分辨率(width, height)。视频源没有打开，或者取到的值不是正数（有些后端取不到时返回0或-1）时，
+    使用传入的width和height
+    """
+    if not hasattr(cap, "get") or (hasattr(cap, "isOpened") and not cap.isOpened()):
+        return width, height
+    cap_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    cap_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    return (cap_width if cap_width > 0 else width), (cap_height if cap_height > 0 else height)
+
+
 class Eye:
     """
     对视频流做一些工程化操作
@@ -45,9 +59,12 @@ class Eye:
     ----------
     video_type : Optional[Union[str, int]]. 目前支持摄像头、本地视频和单帧图片三种模型
         * int. 摄像头的序号
-        * `other`. 本地视频
+        * str. 本地视频
+        * 实现了read()的对象，例如已经打开的cv2.VideoCapture或teot.bench.synthetic.SyntheticVideo
         * None. 单帧图片（暂不支持）
     display_name : Optional[str]. 显示窗口的名称，如果是None则不显示窗口
+    prefetch : int, default 0. 后台解码线程的队列长度，0表示在主循环里同步解码。
+        摄像头在下游跟不上时丢掉最旧的帧，本地视频则等待下游，不会丢帧
     """
 
     def __init__(self, video_type: Optional[Union[str, int]] = None,
@@ -55,53 +72,173 @@ class Eye:
                  video_width: int = 1920,
                  video_height: int = 1080,
                  fps: int = 30,
+                 prefetch: int = 0,
                  ):
         self.flip = False
         if isinstance(video_type, int) or isinstance(video_type, str):
             self.flip = isinstance(video_type, int)
             self.cap = cv2.VideoCapture(video_type)
+            if not self.cap.isOpened():
+                warnings.warn(f"无法打开视频源{video_type}，帧的shape按设置的分辨率计算")
             self.cap.set(3, video_width)  # 设置分辨率
             self.cap.set(4, video_height)
             print("原视频帧率是", int(self.cap.get(cv2.CAP_PROP_FPS)))
             self.cap.set(cv2.CAP_PROP_FPS, fps)
-            self.fps = fps
             print("现视频帧率是", int(self.cap.get(cv2.CAP_PROP_FPS)))
+            # 以摄像头/视频实际的分辨率为准，取不到时再使用设置的分辨率
+            video_width, video_height = capture_size(self.cap, video_width, video_height)
+        elif video_type is not None and hasattr(video_type, "read"):
+            # 已经打开的VideoCapture或者其他实现了read()的对象，例如teot.bench.synthetic.SyntheticVideo
+            self.cap = video_type
+            video_width, video_height = capture_size(self.cap, video_width, video_height)
         else:
             self.cap = None
+        self.frame_shape = (video_height, video_width, 3)
+        self.reader = None
+        if self.cap is not None and prefetch > 0:
+            policy = "drop" if isinstance(video_type, int) else "block"
+            self.reader = FrameReader(self.cap, prefetch, policy, flip=self.flip)
+        # 最近若干帧各阶段的耗时，单位是秒：解码、等待取帧、predict+show
+        self.timings = {"decode": deque(maxlen=300), "wait": deque(maxlen=300), "process": deque(maxlen=300)}
+        self.fps = fps
+        # 结果的记录器，见set_sink
+        self.sink = None
+        # 流水线各阶段的统计，默认关闭，见set_metrics
+        self.metrics = NULL_METRICS
+        self.reported_drops = 0
+        # 低分辨率的JPEG预览，见set_preview
+        self.preview = None
         self.display_name = display_name
         self.latest_time = time.time()
+        self.running = False
+        self.closed = False
 
     def run(self, ):
         interval = 1 / self.fps
-
-        while True:
-            cur_time = time.time()
-            # 控制播放帧率
-            if cur_time - self.latest_time < interval:
-                continue
+        # 按截止时间调度每一帧，没到时间就sleep而不是空转
+        deadline = time.perf_counter()
+        nf = 0
+        self.running = True
+        while self.running:
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
             frame = self.next_frame()
             if frame is None:
                 print("done")
                 break
-            self.predict(frame)
+            s = time.perf_counter()
+            boxes = self.predict(frame)
+            self.record(nf, boxes)
+            if boxes is not None:
+                self.submit_preview(nf, frame, boxes)
             self.show()
-            self.latest_time = cur_time
+            self.timings["process"].append(time.perf_counter() - s)
+            self.latest_time = time.time()
+            nf += 1
+            deadline += interval
+            # 处理已经落后一帧以上时不再追赶，避免连续突发处理
+            if deadline < time.perf_counter() - interval:
+                deadline = time.perf_counter()
+
+    def stop(self):
+        """让run在处理完当前帧后退出，可以在其他线程里调用"""
+        self.running = False
+
+    def close(self):
+        """停止后台解码线程并释放视频源，可以重复调用"""
+        self.running = False
+        if self.closed:
+            return
+        self.closed = True
+        if self.reader is not None:
+            self.reader.stop()
+            if self.reader.is_alive():
+                self.reader.join(1)
+        if self.cap is not None and hasattr(self.cap, "release"):
+            self.cap.release()
 
     def next_frame(self):
         if self.cap is None:
             return None
+        s = time.perf_counter()
+        if self.reader is not None:
+            if not self.reader.is_alive() and not self.reader.finished:
+                self.reader.start()
+            frame = self.reader.read()
+            self.timings["wait"].append(time.perf_counter() - s)
+            self.metrics.record("capture", time.perf_counter() - s)
+            lost = self.reader.dropped + self.reader.skipped
+            self.metrics.drop("capture", lost - self.reported_drops)
+            self.reported_drops = lost
+            return frame
         ret, frame = self.cap.read()
+        self.timings["decode"].append(time.perf_counter() - s)
+        self.metrics.record("capture", time.perf_counter() - s)
         if ret:
             if self.flip:
-                return np.ascontiguousarray(frame[:, ::-1])
+                return cv2.flip(frame, 1)
             return frame
         return None
 
+    def stage_stats(self) -> dict:
+        """返回最近各阶段的平均耗时，单位是ms，以及后台解码丢掉/跳过的帧数"""
+        decode = self.reader.decode_times if self.reader is not None else self.timings["decode"]
+        stats = {}
+        for name, times in (("decode", decode), ("wait", self.timings["wait"]),
+                            ("process", self.timings["process"])):
+            times = list(times)
+            stats[name] = sum(times) / len(times) * 1000 if times else 0
+        stats["dropped"] = self.reader.dropped if self.reader is not None else 0
+        stats["skipped"] = self.reader.skipped if self.reader is not None else 0
+        return stats
+
+    def set_sink(self, sink):
+        """
+        设置结果的记录器，之后每帧的结果都会写进去
+
+        Parameters
+        ----------
+        sink : any. 需要实现write(frame_no, boxes, timestamp)且不能阻塞，例如teot.utils.record.ResultWriter
+        """
+        self.sink = sink
+
+    def set_metrics(self, metrics):
+        """
+        打开各阶段的统计
+
+        Parameters
+        ----------
+        metrics : teot.utils.metrics.Metrics
+        """
+        self.metrics = metrics
+
+    def set_preview(self, preview):
+        """
+        设置低分辨率的预览输出，没有显示器时可以代替display_name的窗口，此时display_name一般设为None，
+        这样帧循环里不会再画全分辨率的图
+
+        Parameters
+        ----------
+        preview : teot.utils.preview.PreviewSink
+        """
+        self.preview = preview
+
+    def submit_preview(self, nf: int, image, boxes, timestamp: Optional[float] = None):
+        if self.preview is not None:
+            self.preview.submit(image, boxes, nf, timestamp)
+
+    def record(self, nf: int, boxes, timestamp: Optional[float] = None):
+        if self.sink is not None and boxes is not None:
+            self.sink.write(nf, boxes, timestamp)
+
     def show(self):
         frame = self.display_frame
         if frame is not None and self.display_name:
+            s = time.perf_counter()
             cv2.imshow(self.display_name, frame)
             cv2.waitKey(1)
+            self.metrics.record("display", time.perf_counter() - s)
         elif self.display_name:
             warnings.warn("该帧没有内容，是否需要在初始化的时候关闭显示")
 
@@ -0,0 +1,183 @@
+"""
+检测/跟踪流水线的基准测试：用合成视频和假检测器测量DetectEye、各种跟踪器的TrackEye以及MultiEye的
+帧率、端到端延迟和相对真值的IoU，在不同目标数量和分辨率下扫描，只需要CPU，不打开窗口
+
+    python -m teot.bench.pipeline --modes detect track multi --trackers kcf sort --counts 1 10 --sizes 640x360 1280x720 \
+        --backends process thread inline
+"""
+import argparse
+import time
+import numpy as np
+from teot.base import ncolors
+from teot.detect import DetectEye
+from teot.track import TrackEye
+from teot.multi import MultiEye
+from teot.utils.interpolate import BoxInterpolator
+from teot.bench.synthetic import SyntheticVideo, FakeDetector, match_iou
+
+
+def summary(name: str, times: list) -> dict:
+    """times的平均值和p99，单位是ms"""
+    if not times:
+        return {f"{name}_ms": 0, f"{name}_p99_ms": 0}
+    times = np.asarray(times) * 1000
+    return {f"{name}_ms": float(times.mean()), f"{name}_p99_ms": float(np.percentile(times, 99))}
+
+
+def bench_detect(video: SyntheticVideo, latency: float = 20) -> dict:
+    """DetectEye逐帧同步检测"""
+    eye = DetectEye(FakeDetector(video, latency), video_type=video)
+    times, ious = [], []
+    s = time.perf_counter()
+    for nf in range(len(video)):
+        frame = eye.next_frame()
+        if frame is None:
+            break
+        t = time.perf_counter()
+        boxes = eye.predict(frame)
+        times.append(time.perf_counter() - t)
+        ious.append(match_iou(boxes, video.boxes(nf)))
+    elapsed = time.perf_counter() - s
+    return dict(fps=len(times) / elapsed, iou=float(np.mean(ious)) if ious else 0, **summary("latency", times))
+
+
+def bench_track(video: SyntheticVideo, tracker: str = "kcf") -> dict:
+    """TrackEye用第0帧的真值初始化，之后只跟踪，IoU反映跟踪器自身的漂移"""
+    eye = TrackEye(tracker, ncolors(video.num_classes), video_type=video)
+    frame = eye.next_frame()
+    t = time.perf_counter()
+    eye.tracking(frame, video.boxes(0))
+    init_ms = (time.perf_counter() - t) * 1000
+    times, ious = [], []
+    s = time.perf_counter()
+    for nf in range(1, len(video)):
+        frame = eye.next_frame()
+        if frame is None:
+            break
+        t = time.perf_counter()
+        boxes = eye.predict(frame)
+        times.append(time.perf_counter() - t)
+        ious.append(match_iou(boxes, video.boxes(nf)))
+    elapsed = time.perf_counter() - s
+    return dict(fps=len(times) / elapsed, iou=float(np.mean(ious)) if ious else 0, init_ms=init_ms,
+                **summary("latency", times))
+
+
+def bench_multi(video: SyntheticVideo, tracker: str = "kcf", latency: float = 20, fps: int = 30,
+                detect_interval: int = 100, backend: str = "process", **kwargs) -> dict:
+    """
+    MultiEye按fps喂帧，IoU按显示时画出的框和显示帧的真值计算，包含了结果落后带来的误差。
+    第一个结果出来之前的帧不计入IoU
+
+    Parameters
+    ----------
+    fps : int, default 30. 喂帧的速度，0表示不限速
+    backend : str, default "process". 同MultiEye的backend
+    kwargs : 其他传给MultiEye的参数，例如display_mode
+    """
+    det_eye = DetectEye(FakeDetector(video, latency))
+    track_eye = TrackEye(tracker, det_eye.color_boxes) if tracker else None
+    eye = MultiEye(det_eye, track_eye, detect_interval, video_type=video, fps=fps or 30, backend=backend, **kwargs)
+    ious, times = [], []
+    results = 0
+    latest_result = -1
+    interval = 1 / fps if fps else 0
+    try:
+        s = deadline = time.perf_counter()
+        while True:
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            frame = eye.next_frame()
+            if frame is None:
+                break
+            t = time.perf_counter()
+            eye.predict(frame)
+            times.append(time.perf_counter() - t)
+            if eye.results and eye.results[-1].number != latest_result:
+                latest_result = eye.results[-1].number
+                results += 1
+            if eye.results and eye.display_nf >= 0:
+                ious.append(match_iou(eye.display_boxes, video.boxes(eye.display_nf)))
+            deadline = max(deadline + interval, time.perf_counter() - interval)
+        elapsed = time.perf_counter() - s
+    finally:
+        eye.close()
+    latency_ms = eye.latency_stats() or (0, 0)
+    staleness = eye.staleness_stats() or (0, 0, 0, 0)
+    return dict(fps=len(times) / elapsed, result_fps=results / elapsed, iou=float(np.mean(ious)) if ious else 0,
+                result_latency_ms=latency_ms[0], result_latency_max_ms=latency_ms[1],
+                stale_frames=staleness[0], **summary("main_loop", times))
+
+
+def sweep(modes=("detect", "track", "multi"), trackers=("kcf", "sort"), counts=(1, 10), sizes=((640, 360),),
+          n_frames: int = 150, latency: float = 20, fps: int = 30, seed: int = 0,
+          backends=("process", "thread", "inline"), display_mode: str = "latest", flow: bool = False) -> list:
+    """
+    Parameters
+    ----------
+    display_mode : str, default "latest". multi模式的display_mode
+    flow : bool, default False. display_mode为"low_latency"时是否用光流修正插值
+
+    Returns
+    -------
+    list. 每个(模式, 跟踪器, 后端, 目标数, 分辨率)组合一行dict，detect和track模式的后端记为"-"
+    """
+    rows = []
+    for width, height in sizes:
+        for n in counts:
+            def make_video():
+                return SyntheticVideo(n_frames, width, height, n_objects=n, seed=seed)
+
+            base = dict(objects=n, size=f"{width}x{height}")
+            if "detect" in modes:
+                rows.append(dict(mode="detect", tracker="-", backend="-", **base,
+                                 **bench_detect(make_video(), latency)))
+            for tracker in trackers:
+                if "track" in modes:
+                    rows.append(dict(mode="track", tracker=tracker, backend="-", **base,
+                                     **bench_track(make_video(), tracker)))
+                if "multi" not in modes:
+                    continue
+                for backend in backends:
+                    kwargs = dict(backend=backend, display_mode=display_mode)
+                    if display_mode == "low_latency":
+                        kwargs["interpolator"] = BoxInterpolator(flow=flow)
+                    rows.append(dict(mode="multi", tracker=tracker, backend=backend, **base,
+                                     **bench_multi(make_video(), tracker, latency, fps, **kwargs)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs="+", default=["detect", "track", "multi"],
+                        choices=["detect", "track", "multi"])
+    parser.add_argument("--trackers", nargs="+", default=["kcf", "sort"])
+    parser.add_argument("--counts", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--sizes", nargs="+", default=["640x360"], help="分辨率，格式是宽x高")
+    parser.add_argument("--frames", type=int, default=150)
+    parser.add_argument("--latency", type=float, default=20, help="假检测器每次推理的耗时，单位是ms")
+    parser.add_argument("--fps", type=int, default=30, help="MultiEye喂帧的速度，0表示不限速")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backends", nargs="+", default=["process", "thread", "inline"],
+                        choices=["process", "thread", "inline", "auto"])
+    parser.add_argument("--display-mode", default="latest", choices=["latest", "sync", "low_latency"])
+    parser.add_argument("--flow", action="store_true", help="low_latency模式下用光流修正插值")
+    args = parser.parse_args()
+    sizes = [tuple(int(v) for v in s.lower().split("x")) for s in args.sizes]
+    rows = sweep(args.modes, args.trackers, args.counts, sizes, args.frames, args.latency, args.fps, args.seed,
+                 args.backends, args.display_mode, args.flow)
+    print(f"{'mode':>7} {'tracker':>8} {'backend':>8} {'objects':>8} {'size':>10} {'fps':>8} {'latency(ms)':>12} "
+          f"{'p99(ms)':>8} {'iou':>6}")
+    # multi的延迟是帧发布到结果可用的时间，p99一列是最大值
+    for row in rows:
+        if row["mode"] == "multi":
+            latency, p99 = row["result_latency_ms"], row["result_latency_max_ms"]
+        else:
+            latency, p99 = row["latency_ms"], row["latency_p99_ms"]
+        print(f"{row['mode']:>7} {row['tracker']:>8} {row['backend']:>8} {row['objects']:>8} {row['size']:>10} "
+              f"{row['fps']:>8.1f} {latency:>12.2f} {p99:>8.2f} {row['iou']:>6.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+启动耗时的基准测试：import teot各模块的耗时，以及MultiEye在不同子进程启动方式下的构造耗时、warmup完成的耗时
+和拿到第一个结果的耗时。检测模型是通过LazyModel在子进程里创建的假检测器，创建时sleep load_ms模拟加载模型
+
+    python -m teot.bench.startup --start-methods fork spawn forkserver --backends process thread --load-ms 500 \
+        --budget-ms 3000
+
+设置--budget-ms后，任何一行的first_box_ms超过预算或者没有拿到结果时以非0状态退出，可以放进CI里防止启动变慢
+"""
+import argparse
+import functools
+import statistics
+import subprocess
+import sys
+import time
+from typing import Optional
+from teot.detect import DetectEye
+from teot.track import TrackEye
+from teot.multi import MultiEye
+from teot.utils.model import LazyModel
+from teot.bench.synthetic import SyntheticVideo, FakeDetector
+
+
+def measure_import(module: str = "teot", repeats: int = 3) -> float:
+    """在新的解释器里import module的耗时的中位数，单位是ms，不包含解释器自身的启动"""
+    code = f"import time; s = time.perf_counter(); import {module}; print((time.perf_counter() - s) * 1000)"
+    times = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return statistics.median(times)
+
+
+def make_detector(n_frames: int, width: int, height: int, n_objects: int, latency: float,
+                  load_ms: float) -> FakeDetector:
+    """LazyModel的工厂函数，必须是模块级函数，spawn/forkserver启动的子进程才能pickle它"""
+    time.sleep(load_ms / 1000)
+    return FakeDetector(SyntheticVideo(n_frames, width, height, n_objects=n_objects), latency)
+
+
+def bench_startup(start_method: Optional[str] = None, backend: str = "process", tracker: Optional[str] = "kcf",
+                  load_ms: float = 500, latency: float = 20, n_frames: int = 300, width: int = 640,
+                  height: int = 360, n_objects: int = 5, wait: bool = True, timeout: float = 30) -> dict:
+    """
+    Parameters
+    ----------
+    start_method : Optional[str]. 同MultiEye的start_method
+    backend : str, default "process". 同MultiEye的backend，不是"process"时start_method不起作用
+    tracker : Optional[str], default "kcf". 跟踪器的名字，None则只检测
+    load_ms : float, default 500. 假检测器创建时的耗时，单位是ms
+    wait : bool, default True. 是否先wait_ready再开始喂帧，False时构造完立刻喂帧
+    timeout : float, default 30. 等待warmup和第一个结果的最长时间，单位是秒
+
+    Returns
+    -------
+    dict. init_ms、ready_ms、first_box_ms同MultiEye.startup，拿不到时是None
+    """
+    video = SyntheticVideo(n_frames, width, height, n_objects=n_objects)
+    factory = functools.partial(make_detector, n_frames, width, height, n_objects, latency, load_ms)
+    det_eye = DetectEye(LazyModel(factory, video.num_classes))
+    track_eye = TrackEye(tracker, det_eye.color_boxes) if tracker else None
+    eye = MultiEye(det_eye, track_eye, video_type=video, fps=video.fps, backend=backend, start_method=start_method)
+    try:
+        if wait:
+            eye.wait_ready(timeout)
+        deadline = time.perf_counter() + timeout
+        while eye.startup["first_box_ms"] is None and time.perf_counter() < deadline:
+            frame = eye.next_frame()
+            if frame is None:
+                break
+            eye.predict(frame)
+            time.sleep(1 / video.fps)
+        if not wait:
+            eye.wait_ready(0)
+    finally:
+        eye.close()
+    return dict(eye.startup)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--start-methods", nargs="+", default=["fork", "spawn", "forkserver"],
+                        choices=["fork", "spawn", "forkserver"])
+    parser.add_argument("--backends", nargs="+", default=["process", "thread"],
+                        choices=["process", "thread", "inline"])
+    parser.add_argument("--tracker", default="kcf", help="跟踪器的名字，none表示只检测")
+    parser.add_argument("--load-ms", type=float, default=500, help="假检测器创建时的耗时，单位是ms")
+    parser.add_argument("--latency", type=float, default=20, help="假检测器每次推理的耗时，单位是ms")
+    parser.add_argument("--no-wait", action="store_true", help="构造完立刻喂帧，不等待warmup")
+    parser.add_argument("--budget-ms", type=float, default=None, help="first_box_ms的上限，超过时以非0状态退出")
+    args = parser.parse_args()
+    tracker = None if args.tracker.lower() == "none" else args.tracker
+
+    for module in ("teot", "teot.track", "teot.multi"):
+        print(f"import {module:<12} {measure_import(module):>8.1f}ms")
+    rows = []
+    for backend in args.backends:
+        # 只有进程后端区分启动方式
+        for start_method in (args.start_methods if backend == "process" else [None]):
+            row = bench_startup(start_method, backend, tracker, args.load_ms, args.latency, wait=not args.no_wait)
+            rows.append(dict(backend=backend, start_method=start_method or "-", **row))
+
+    def fmt(v):
+        return f"{v:>13.1f}" if v is not None else f"{'-':>13}"
+
+    print(f"{'backend':>8} {'start':>11} {'init(ms)':>13} {'ready(ms)':>13} {'first_box(ms)':>13}")
+    for row in rows:
+        print(f"{row['backend']:>8} {row['start_method']:>11} {fmt(row['init_ms'])} {fmt(row['ready_ms'])} "
+              f"{fmt(row['first_box_ms'])}")
+    if args.budget_ms is not None:
+        slow = [row for row in rows if row["first_box_ms"] is None or row["first_box_ms"] > args.budget_ms]
+        if slow:
+            print("超出预算:", ", ".join(f"{row['backend']}/{row['start_method']}" for row in slow))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
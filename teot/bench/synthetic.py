@@ -0,0 +1,210 @@
+"""
+确定性的合成视频和假检测器，用于在没有摄像头、模型和GPU的环境下复现流水线的性能和精度
+"""
+import time
+from typing import Optional
+import cv2
+import numpy as np
+from teot.utils.box import as_boxes, iou_matrix, linear_assignment
+from teot.utils.pyramid import as_image
+
+# 帧号按二进制编码在画面左上角的一行小方块里，检测器拿到的即使是别的进程里的一帧也能知道帧号
+CODE_BITS = 32
+CODE_CELL = 4
+
+
+def encode_frame_number(image: np.ndarray, nf: int):
+    """把帧号写进image左上角CODE_BITS个CODE_CELL x CODE_CELL的黑白方块里"""
+    for bit in range(CODE_BITS):
+        x = bit * CODE_CELL
+        image[:CODE_CELL, x:x + CODE_CELL] = 255 if (nf >> bit) & 1 else 0
+
+
+def decode_frame_number(image: np.ndarray) -> int:
+    """读出encode_frame_number写进去的帧号"""
+    c = CODE_CELL // 2
+    samples = image[c, c:CODE_BITS * CODE_CELL:CODE_CELL]
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    return int(sum(1 << bit for bit, v in enumerate(samples) if v > 127))
+
+
+def bounce(p: np.ndarray, length: np.ndarray) -> np.ndarray:
+    """在[0, length]之间来回反弹的位置"""
+    length = np.maximum(length, 1)
+    m = np.mod(p, 2 * length)
+    return length - np.abs(m - length)
+
+
+class SyntheticVideo:
+    """
+    按随机种子生成的合成视频，接口和cv2.VideoCapture一致，可以直接作为Eye的video_type。
+    背景是静止的随机纹理，每个目标是一块自带纹理的矩形，匀速运动并在画面边缘反弹，
+    任意一帧的画面和真值框都可以由帧号直接算出
+
+    Parameters
+    ----------
+    n_frames : int, default 300. 总帧数
+    width : int, default 640. 画面宽度
+    height : int, default 360. 画面高度
+    n_objects : int, default 5. 目标数量
+    num_classes : int, default 3. 目标类别数
+    size : tuple, default (24, 96). 目标边长的范围
+    speed : float, default 4. 目标每帧最大的位移，单位是像素
+    fps : int, default 30. 通过get(cv2.CAP_PROP_FPS)返回的帧率
+    seed : int, default 0. 随机种子
+    """
+
+    def __init__(self, n_frames: int = 300, width: int = 640, height: int = 360, n_objects: int = 5,
+                 num_classes: int = 3, size: tuple = (24, 96), speed: float = 4, fps: int = 30, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.n_frames = n_frames
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.num_classes = num_classes
+        # 背景低对比度，目标高对比度，跟踪器可以稳定地锁住目标
+        background = rng.integers(60, 110, (height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8)
+        self.background = cv2.resize(background, (width, height), interpolation=cv2.INTER_NEAREST)
+        # 目标不进入编码帧号的那一行
+        self.top = CODE_CELL * 2
+        hi = max(size[0] + 1, min(size[1], width // 2, (height - self.top) // 2))
+        wh = rng.integers(size[0], hi, (n_objects, 2))
+        self.wh = wh
+        self.cls = rng.integers(0, num_classes, n_objects)
+        self.origin = rng.uniform(0, 1, (n_objects, 2)) * (np.array([width, height - self.top]) - wh)
+        self.velocity = rng.uniform(-speed, speed, (n_objects, 2))
+        self.patches = [rng.integers(0, 255, (h, w, 3), dtype=np.uint8) for w, h in wh]
+        self.pos = 0
+
+    def __len__(self):
+        return self.n_frames
+
+    def boxes(self, nf: int) -> np.ndarray:
+        """
+        Returns
+        -------
+        np.ndarray. 第nf帧的真值框，shape=(N, 6)，最后一维是cls_type,conf,x1,y1,x2,y2
+        """
+        limit = np.array([self.width, self.height - self.top]) - self.wh
+        xy = bounce(self.origin + self.velocity * nf, limit) + np.array([0, self.top])
+        xy = np.floor(xy)
+        boxes = np.zeros((len(self.wh), 6))
+        boxes[:, 0] = self.cls
+        boxes[:, 1] = 1
+        boxes[:, 2:4] = xy
+        boxes[:, 4:6] = xy + self.wh
+        return boxes
+
+    def render(self, nf: int) -> np.ndarray:
+        image = self.background.copy()
+        for (_, _, x1, y1, x2, y2), patch in zip(self.boxes(nf).astype(int), self.patches):
+            image[y1:y2, x1:x2] = patch
+        encode_frame_number(image, nf)
+        return image
+
+    def read(self):
+        if self.pos >= self.n_frames:
+            return False, None
+        image = self.render(self.pos)
+        self.pos += 1
+        return True, image
+
+    def grab(self) -> bool:
+        if self.pos >= self.n_frames:
+            return False
+        self.pos += 1
+        return True
+
+    def get(self, prop: int) -> float:
+        return {
+            cv2.CAP_PROP_FRAME_WIDTH: self.width,
+            cv2.CAP_PROP_FRAME_HEIGHT: self.height,
+            cv2.CAP_PROP_FPS: self.fps,
+            cv2.CAP_PROP_FRAME_COUNT: self.n_frames,
+            cv2.CAP_PROP_POS_FRAMES: self.pos,
+        }.get(prop, 0)
+
+    def set(self, prop: int, value) -> bool:
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            self.pos = int(value)
+            return True
+        return False
+
+    def isOpened(self) -> bool:
+        return True
+
+    def release(self):
+        self.pos = self.n_frames
+
+
+class FakeDetector:
+    """
+    假的检测模型：从画面里读出帧号，sleep一段时间模拟推理耗时后返回该帧的真值框，可以加上抖动和漏检。
+    输入需要是完整的一帧，不支持DetectEye的rois
+
+    Parameters
+    ----------
+    video : SyntheticVideo. 提供真值框的合成视频
+    latency : float, default 20. 每次推理的耗时，单位是ms
+    batch_latency : Optional[float]. batch推理时每多一张图增加的耗时，单位是ms，None则和单张相同
+    jitter : float, default 0. 框坐标的随机抖动，单位是像素
+    miss_rate : float, default 0. 每个目标被漏检的概率
+    seed : int, default 0. 抖动和漏检的随机种子
+    """
+
+    def __init__(self, video: SyntheticVideo, latency: float = 20, batch_latency: Optional[float] = None,
+                 jitter: float = 0, miss_rate: float = 0, seed: int = 0):
+        self.video = video
+        self.num_classes = video.num_classes
+        self.latency = latency / 1000
+        self.batch_latency = (latency if batch_latency is None else batch_latency) / 1000
+        self.jitter = jitter
+        self.miss_rate = miss_rate
+        self.seed = seed
+        self.calls = 0
+
+    def detect(self, image) -> np.ndarray:
+        nf = decode_frame_number(as_image(image))
+        boxes = self.video.boxes(nf)
+        if self.jitter or self.miss_rate:
+            rng = np.random.default_rng((self.seed, nf))
+            boxes[:, 2:6] += rng.normal(0, self.jitter, (len(boxes), 4)) if self.jitter else 0
+            boxes = boxes[rng.uniform(size=len(boxes)) >= self.miss_rate]
+        self.calls += 1
+        return boxes
+
+    def __call__(self, image) -> np.ndarray:
+        time.sleep(self.latency)
+        return self.detect(image)
+
+    def batch(self, images: list) -> list:
+        time.sleep(self.latency + self.batch_latency * max(len(images) - 1, 0))
+        return [self.detect(image) for image in images]
+
+
+def match_iou(boxes, truth) -> float:
+    """
+    预测框和真值框一一匹配后的平均IoU，没有匹配上的框（漏检和误检）都按0计入
+
+    Parameters
+    ----------
+    boxes : np.ndarray. 预测框，shape=(N, 6)或(N, 7)
+    truth : np.ndarray. 真值框，shape=(M, 6)
+
+    Returns
+    -------
+    float. 两边都没有框时返回1
+    """
+    boxes = as_boxes(boxes)
+    truth = as_boxes(truth)
+    n = max(len(boxes), len(truth))
+    if n == 0:
+        return 1.0
+    if len(boxes) == 0 or len(truth) == 0:
+        return 0.0
+    iou = iou_matrix(boxes[:, 2:6], truth[:, 2:6])
+    # 不同类别的框不能匹配
+    iou[boxes[:, 0][:, None] != truth[:, 0][None, :]] = 0
+    matches = linear_assignment(-iou)
+    return float(sum(iou[r, c] for r, c in matches)) / n
@@ -0,0 +1,69 @@
+"""
+CVTracker线程池的扩展性测试：不同目标数量、不同线程数下每帧跟踪的耗时
+
+    python -m teot.bench.tracker --tracker kcf --counts 10 50 100 --workers 1 2 4
+"""
+import argparse
+import time
+import numpy as np
+from teot.track import CVTracker
+
+
+def textured_frames(n_frames: int, width: int, height: int, seed: int = 0):
+    """生成一段内容整体平移的随机纹理视频，保证跟踪器有可跟踪的特征"""
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    return [np.roll(base, (i * 2, i * 3), axis=(0, 1)) for i in range(n_frames)]
+
+
+def grid_boxes(n: int, width: int, height: int, size: int = 80) -> np.ndarray:
+    """在画面上均匀地摆放n个大小为size的框"""
+    cols = max(1, int(np.ceil(np.sqrt(n * width / height))))
+    boxes = []
+    for i in range(n):
+        x = (i % cols) * (width - size) / cols + 5
+        y = (i // cols) * (height - size) / max(1, (n + cols - 1) // cols) + 20
+        boxes.append((0, 1, x, y, x + size, y + size))
+    return np.array(boxes, dtype=float)
+
+
+def bench_tracker_pool(tracker_type: str = "kcf", counts=(1, 10, 50, 100), workers=(1, 2, 4),
+                       n_frames: int = 30, width: int = 1920, height: int = 1080, scale: float = 0.2):
+    """
+    Returns
+    -------
+    list. 每个(目标数, 线程数)组合的(目标数, 线程数, 初始化耗时ms, 每帧更新耗时ms)
+    """
+    frames = textured_frames(n_frames + 1, width, height)
+    rows = []
+    for n in counts:
+        boxes = grid_boxes(n, width, height)
+        for w in workers:
+            tracker = CVTracker(tracker_type, scale=scale, workers=w)
+            s = time.perf_counter()
+            tracker.track_objs(frames[0], boxes)
+            init_ms = (time.perf_counter() - s) * 1000
+            s = time.perf_counter()
+            for frame in frames[1:]:
+                tracker(frame)
+            update_ms = (time.perf_counter() - s) * 1000 / n_frames
+            rows.append((n, w, init_ms, update_ms))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tracker", default="kcf")
+    parser.add_argument("--counts", type=int, nargs="+", default=[1, 10, 50, 100])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--frames", type=int, default=30)
+    args = parser.parse_args()
+    print(f"{'objects':>8} {'workers':>8} {'init(ms)':>10} {'update(ms)':>11} {'speedup':>8}")
+    base = {}
+    for n, w, init_ms, update_ms in bench_tracker_pool(args.tracker, args.counts, args.workers, args.frames):
+        base.setdefault(n, update_ms)
+        print(f"{n:>8} {w:>8} {init_ms:>10.2f} {update_ms:>11.2f} {base[n] / update_ms:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
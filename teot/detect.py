@@ -1,5 +1,9 @@
-import cv2
+import numpy as np
 from .base import Eye, ncolors
+from .utils.box import as_boxes
+from .utils.roi import nms
+from .utils.pyramid import as_image
+from .utils.render import BoxRenderer
 from typing import Optional, Union
 
 
@@ -11,12 +15,15 @@ class DetectEye(Eye):
     ----------
     model : any. 模型推理的类，要求它已实现了__call__且输入是BGR的图片，
         输出是np.ndarray格式shape=(N, 6)的boxes其中最后一维是cls_type,conf,x1,y1,x2,y2。
-        此外，model.num_classes需要给出可预测的类别总数
+        此外，model.num_classes需要给出可预测的类别总数。如果model.use_pyramid为True，输入会是
+        teot.utils.pyramid.FramePyramid，模型内部的缩放可以通过它复用同一帧已经算好的结果。多路视频流共用一个模型时，
+        可以传入teot.utils.server.InferenceServer创建的客户端
     video_type : Optional[Union[str, int]]. 目前支持摄像头、本地视频和单帧图片三种模型
         * int. 摄像头的序号
         * `other`. 本地视频
         * None. 单帧图片（暂不支持）
     display_name : Optional[str]. 显示窗口的名称，如果是None则不显示窗口
+    prefetch : int, default 0. 后台解码线程的队列长度，0表示在主循环里同步解码
     """
 
     def __init__(self, model,
@@ -25,33 +32,45 @@ class DetectEye(Eye):
                  video_width: int = 1920,
                  video_height: int = 1080,
                  fps: int = 30,
+                 prefetch: int = 0,
                  ):
-        super().__init__(video_type, display_name, video_width, video_height, fps)
+        super().__init__(video_type, display_name, video_width, video_height, fps, prefetch)
         self.model = model
         self.color_boxes = ncolors(model.num_classes)
+        self.renderer = BoxRenderer(self.color_boxes)
         self.show_image = None
         print("Detect-Eye初始化完成!")
 
-    def predict(self, image):
-        boxes = self.model(image)
+    def predict(self, image, rois: Optional[list] = None):
+        """
+        Parameters
+        ----------
+        image : Union[np.ndarray, FramePyramid]. BGR图片，模型声明了use_pyramid时会直接拿到FramePyramid
+        rois : Optional[list]. 只在这些区域上检测，每个区域是(x1, y1, x2, y2)，None则检测全图
+        """
+        if rois is None:
+            boxes = self.model(image if getattr(self.model, "use_pyramid", False) else as_image(image))
+        else:
+            boxes = self.predict_rois(as_image(image), rois)
         if self.display_name:
-            show_image = image.copy()
-            for cls, conf, x1, y1, x2, y2 in boxes.tolist():
-                cls = int(cls)
-                x1 = int(x1)
-                y1 = int(y1)
-                x2 = int(x2)
-                y2 = int(y2)
-                color = self.color_boxes[int(cls)]
-                cv2.rectangle(show_image, (x1, y1), (x2, y2), color, 1)
-                title = f"{cls}:{round(conf, 2)}"
-                title_lt = (x1, y1 - 15)
-                title_rb = (x1 + len(title) * 10, y1)
-                cv2.rectangle(show_image, title_lt, title_rb, color, -1)
-                cv2.putText(show_image, title, (x1, y1), cv2.FONT_ITALIC, 0.5, (255, 255, 255), 1)
-            self.show_image = show_image
+            self.show_image = self.renderer.render(as_image(image), boxes)
         return boxes
 
+    def predict_rois(self, image, rois: list):
+        """把各个区域裁出来一起送进模型，结果映射回全图坐标，再去掉相邻区域重复检出的框"""
+        crops = [np.ascontiguousarray(image[y1:y2, x1:x2]) for x1, y1, x2, y2 in rois]
+        if hasattr(self.model, "batch"):
+            outputs = self.model.batch(crops)
+        else:
+            outputs = [self.model(crop) for crop in crops]
+        all_boxes = [np.zeros((0, 6))]
+        for (x1, y1, _, _), boxes in zip(rois, outputs):
+            boxes = as_boxes(boxes).copy()
+            boxes[:, [2, 4]] += x1
+            boxes[:, [3, 5]] += y1
+            all_boxes.append(boxes[:, :6])
+        return nms(np.concatenate(all_boxes))
+
     @property
     def display_frame(self):
         return self.show_image
@@ -1,12 +1,22 @@
 import time
+from collections import deque
 from typing import Optional, Union
 from .track import Eye
 from .track import TrackEye
 from .detect import DetectEye
 import threading
+import warnings
 from teot.utils.process import DetectProcess, TrackProcess
+from teot.utils.thread import DetectThread, TrackThread, DetectInline, TrackInline
+from teot.utils.backend import BACKENDS, profile_backends, choose_backend
+from teot.utils.transport import DictFrameTransport, SharedFrameRing, SharedResults
+from teot.utils.interpolate import BoxInterpolator
+from teot.utils.render import BoxRenderer
+from teot.utils.schedule import DetectScheduler
+from teot.utils.roi import RoiPlanner
+from teot.utils.metrics import Metrics
 import multiprocessing
-import cv2
+import numpy as np
 
 
 class MultiEye(Eye):
@@ -17,12 +27,49 @@ class MultiEye(Eye):
     ----------
     detect_eye : Optional[DetectEye]
     track_eye : Optional[TrackEye]
-    detect_interval : int, default 30. 检测间隔，单位是ms
+    detect_interval : int, default 30. 画面静止时的检测间隔，单位是ms
     video_type : Optional[Union[str, int]]. 目前支持摄像头、本地视频和单帧图片三种模型
         * int. 摄像头的序号
         * `other`. 本地视频
         * None. 单帧图片（暂不支持）
     display_name : Optional[str]. 显示窗口的名称，如果是None则不显示窗口
+    prefetch : int, default 0. 后台解码线程的队列长度，0表示在主循环里同步解码
+    transport : str, default "shm". 帧在进程间的传输方式
+        * "shm". 通过共享内存环形缓冲区传递，子进程拿到的是视图，不需要pickle
+        * "dict". 通过Manager().dict()传递，每帧都会pickle一次
+    n_slots : int, default 4. 共享内存环形缓冲区的槽位数量。检测和跟踪直接在槽位的视图上推理，一个槽位在n_slots-1帧之后
+        会被覆盖，所以(n_slots-1)/fps需要大于检测耗时，例如30fps、检测150ms时至少需要6个槽位。
+        推理期间槽位被覆盖的结果会被丢掉，之后改为先拷贝帧再推理
+    display_mode : str, default "latest". 结果和帧的对齐方式
+        * "latest". 在当前帧上画最新的结果
+        * "sync". 帧先进入长度为delay_frames的缓冲区，显示时画对应帧号的结果，画面会延迟几帧
+        * "low_latency". 在当前帧上画最新的结果，并用interpolator插值到当前帧
+    delay_frames : int, default 3. "sync"模式下最多延迟的帧数
+    display_size : Optional[tuple]. 显示分辨率(width, height)，设置后先缩放到该分辨率再画框，None则按采集分辨率画
+    scheduler : Optional[DetectScheduler]. 检测调度器，可以设置帧差/跟丢阈值和每秒检测次数的上限，
+        None则使用按detect_interval检测的默认调度器。scheduler.counters()可以查看触发和跳过的检测次数
+    roi : Optional[RoiPlanner]. 设置后两次全图检测之间只在已跟踪目标周围的区域上检测，
+        适合目标稀疏的场景。roi.counters()可以查看送进模型的像素数
+    metrics : Optional[Metrics]. 设置后统计采集、传输、检测、跟踪、绘制和显示各阶段的耗时分布、丢帧数、
+        结果落后的帧数和利用率，通过metrics.snapshot()读取，None则不统计
+    backend : str, default "process". 检测和跟踪的运行方式，三种方式的调度逻辑完全相同
+        * "process". 各自一个子进程，不受GIL限制，帧通过transport传递
+        * "thread". 各自一个线程，帧不需要拷贝，适合推理时释放GIL的模型，例如onnxruntime、OpenCV DNN
+        * "inline". 在主循环里发布帧之后直接检测/跟踪，适合非常快的模型
+        * "auto". 先在第一帧上测量检测和跟踪的耗时以及两者能否在线程里并行，再从上面三种中选择，
+          选择的结果见self.backend和self.profile
+    pool : Optional[teot.supervisor.Supervisor]. 设置后不再创建自己的检测/跟踪进程，而是交给Supervisor的共享进程池处理，
+        此时detect_eye、track_eye和transport都不起作用。一般通过Supervisor.add_stream创建
+    start_method : Optional[str]. "process"后端启动子进程的方式，"fork"、"spawn"或"forkserver"，None则使用默认方式。
+        spawn/forkserver启动的子进程不继承父进程的内存，配合teot.utils.model.LazyModel时模型只在子进程里创建，
+        此时调用MultiEye的脚本需要放在if __name__ == "__main__"里
+    interpolator : Optional[BoxInterpolator]. "low_latency"模式下在两次结果之间插值出每一帧的框，
+        None则使用只按速度外推的BoxInterpolator。设置flow=True时还会用稀疏光流修正，这时可以调大detect_interval和
+        track_interval，让检测和跟踪按较低的频率运行，画面上的框仍然逐帧平滑
+    track_interval : int, default 1. 两次跟踪之间至少间隔的时间，单位是ms，inline后端不起作用
+
+    构造完成时子进程可能还在加载模型，wait_ready()可以等到检测和跟踪都完成warmup，startup记录了构造耗时(init_ms)、
+    从开始构造到wait_ready第一次返回True的耗时(ready_ms)和到第一次拿到结果的耗时(first_box_ms)，单位是ms
     """
     def __init__(self,
                  detect_eye: Optional[DetectEye] = None,
@@ -33,54 +80,262 @@ class MultiEye(Eye):
                  video_width: int = 1920,
                  video_height: int = 1080,
                  fps: int = 30,
+                 prefetch: int = 0,
+                 transport: str = "shm",
+                 n_slots: int = 4,
+                 display_mode: str = "latest",
+                 delay_frames: int = 3,
+                 display_size: Optional[tuple] = None,
+                 scheduler: Optional[DetectScheduler] = None,
+                 roi: Optional[RoiPlanner] = None,
+                 metrics: Optional[Metrics] = None,
+                 backend: str = "process",
+                 pool=None,
+                 start_method: Optional[str] = None,
+                 interpolator: Optional[BoxInterpolator] = None,
+                 track_interval: int = 1,
                  ):
-        super().__init__(video_type, display_name, video_width, video_height, fps)
+        init_start = time.perf_counter()
+        super().__init__(video_type, display_name, video_width, video_height, fps, prefetch)
         if track_eye and not detect_eye:
             raise ValueError("跟踪必须要有检测")
-        assert detect_eye
+        assert detect_eye or pool
+        if display_mode not in ("latest", "sync", "low_latency"):
+            raise ValueError(f"不支持的display_mode: {display_mode}")
+        if backend != "auto" and backend not in BACKENDS:
+            raise ValueError(f"不支持的backend: {backend}")
         self.detect_lock = multiprocessing.Lock() if detect_eye else None
         self.detect_interval = detect_interval / 1000
-        self.mtx_box = multiprocessing.Lock()
-        self.mtx_image = multiprocessing.Lock()
-        m = multiprocessing.Manager()
-        self.data = m.dict({})
-        self.detect_thread = DetectProcess(detect_eye, self.data, self.mtx_box, self.mtx_image, detect_interval)
-        self.track_thread = TrackProcess(track_eye, self.data, self.mtx_box, self.mtx_image) if track_eye else None
+        if metrics is not None:
+            self.set_metrics(metrics)
+        self.pool = pool
+        self.init_start = init_start
+        self.startup = {"init_ms": None, "ready_ms": None, "first_box_ms": None}
+        self.manager = None
+        self.detect_thread = self.track_thread = None
+        # auto模式下用来测量的第一帧，之后作为第一帧正常处理
+        self.pending_frame = None
+        self.profile = None
+        if pool is not None:
+            # 检测和跟踪由进程池完成，结果写在Supervisor为这一路流分配的共享内存里
+            self.scheduler = scheduler if scheduler else DetectScheduler(pool.detect_interval)
+            self.stream_key, self.frames, self.data, self.mtx_box = pool.attach(self, n_slots, self.scheduler, roi)
+            backend = "pool"
+        elif backend == "auto":
+            backend = self.auto_backend(detect_eye, track_eye)
+        self.backend = backend
+        if backend in ("thread", "inline"):
+            # 线程之间直接共享Frame对象，多尺度缓存也随之共享
+            self.mtx_box = threading.Lock()
+            self.mtx_image = threading.Lock()
+            self.data = {}
+            self.frames = DictFrameTransport(self.data, self.mtx_image, threading.Condition(self.mtx_image))
+            self.scheduler = scheduler if scheduler else DetectScheduler(detect_interval)
+            detect_cls, track_cls = (DetectThread, TrackThread) if backend == "thread" else (DetectInline, TrackInline)
+            self.detect_thread = detect_cls(detect_eye, self.data, self.mtx_box, self.mtx_image, detect_interval,
+                                            frames=self.frames, scheduler=self.scheduler, roi=roi,
+                                            metrics=self.metrics)
+            self.track_thread = track_cls(track_eye, self.data, self.mtx_box, self.mtx_image, track_interval,
+                                          frames=self.frames, metrics=self.metrics) if track_eye else None
+        elif backend == "process":
+            # 锁、事件和子进程都从同一个context创建，spawn/forkserver启动的子进程才能继承这些锁
+            ctx = multiprocessing.get_context(start_method)
+            self.mtx_box = ctx.Lock()
+            self.mtx_image = ctx.Lock()
+            self.frames = self.create_transport(transport, n_slots, ctx)
+            self.scheduler = scheduler if scheduler else DetectScheduler(detect_interval)
+            self.detect_thread = DetectProcess(detect_eye, self.data, self.mtx_box, self.mtx_image, detect_interval,
+                                               frames=self.frames, scheduler=self.scheduler, roi=roi,
+                                               metrics=self.metrics, context=ctx)
+            self.track_thread = TrackProcess(track_eye, self.data, self.mtx_box, self.mtx_image, track_interval,
+                                             frames=self.frames, metrics=self.metrics,
+                                             context=ctx) if track_eye else None
 
         if self.detect_thread:
             self.detect_thread.start()
         if self.track_thread:
             self.track_thread.start()
         self.nf = 0
+        self.display_mode = display_mode
+        self.delay_frames = delay_frames
+        self.frame_buffer = deque()
+        self.interpolator = None
+        if display_mode == "low_latency":
+            self.interpolator = interpolator if interpolator else BoxInterpolator()
+        # 最近收到的若干个带帧号的结果
+        self.results = deque(maxlen=max(delay_frames, 1) + 2)
+        self.renderer = BoxRenderer(detect_eye.color_boxes if detect_eye else pool.color_boxes,
+                                    display_size=display_size)
+        self.show_image = None
+        # 最近若干个结果从帧发布到结果可用的延迟，单位是秒
+        self.latency = deque(maxlen=300)
+        # 最近若干帧显示时所画结果的落后程度，(帧数, ms)
+        self.staleness = deque(maxlen=300)
+        # 最近一次显示的帧号、画在上面的框和这一帧发布的时间
+        self.display_nf = -1
+        self.display_boxes = None
+        self.display_time = None
+        self.startup["init_ms"] = (time.perf_counter() - init_start) * 1000
+
+    def auto_backend(self, detect_eye: DetectEye, track_eye: Optional[TrackEye]) -> str:
+        """
+        在第一帧上测量检测和跟踪的耗时，选择最合适的后端。视频源还没有帧时使用随机图片，
+        检测器或跟踪器无法测量时退回到process
+        """
+        self.pending_frame = super().next_frame()
+        image = self.pending_frame
+        if image is None:
+            image = np.random.default_rng(0).integers(0, 255, self.frame_shape, dtype=np.uint8)
+        self.profile = profile_backends(detect_eye, track_eye, image)
+        if self.profile is None:
+            warnings.warn("检测器或跟踪器不能复制，无法测量耗时，退回到process后端")
+            return "process"
+        return choose_backend(self.profile, self.fps)
+
+    def next_frame(self):
+        if self.pending_frame is not None:
+            frame, self.pending_frame = self.pending_frame, None
+            return frame
+        return super().next_frame()
+
+    def create_transport(self, transport: str, n_slots: int, ctx):
+        """创建帧的传输方式和存放结果的self.data，只有退回到dict方式时才需要启动Manager服务进程"""
+        cond = ctx.Condition(self.mtx_image)
+        if transport == "shm":
+            try:
+                self.data = SharedResults()
+                return SharedFrameRing(self.frame_shape, n_slots, lock=self.mtx_image, cond=cond)
+            except OSError as e:
+                warnings.warn(f"共享内存不可用({e})，退回到dict方式传输帧")
+        elif transport != "dict":
+            raise ValueError(f"不支持的transport: {transport}")
+        self.manager = ctx.Manager()
+        self.data = self.manager.dict({})
+        return DictFrameTransport(self.data, self.mtx_image, cond)
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待检测和跟踪完成warmup（例如LazyModel在子进程里创建好模型），超时返回False。
+        在Supervisor的进程池里运行时直接返回True
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        for worker in (self.detect_thread, self.track_thread):
+            if worker is None:
+                continue
+            remaining = None if deadline is None else max(0, deadline - time.perf_counter())
+            if not worker.ready.wait(remaining):
+                return False
+        if self.startup["ready_ms"] is None:
+            self.startup["ready_ms"] = (time.perf_counter() - self.init_start) * 1000
+        return True
+
+    def run(self):
+        try:
+            super().run()
+        finally:
+            self.close()
+
+    def close(self):
+        """停止检测/跟踪子进程（或者从Supervisor的进程池里移除）并释放共享内存，可以重复调用"""
+        if self.closed:
+            return
+        super().close()
+        if self.pool is not None:
+            self.pool.detach(self)
+        for worker in (self.detect_thread, self.track_thread):
+            if worker is not None:
+                worker.stop()
+        self.frames.close()
+        if self.manager is not None:
+            self.manager.shutdown()
 
     def predict(self, image):
-        self.mtx_image.acquire()
-        self.data["image"] = image
-        self.data["nf"] = self.nf
-        self.mtx_image.release()
+        publish_time = time.time()
+        s = time.perf_counter()
+        self.frames.publish(self.nf, image)
+        self.metrics.record("transport", time.perf_counter() - s)
+        if self.backend == "inline":
+            frame = self.frames.latest()
+            self.detect_thread.step(frame)
+            if self.track_thread:
+                self.track_thread.step(frame)
 
         self.mtx_box.acquire()
-        if "boxes" in self.data:
-            boxes = self.data["boxes"].tolist()
-        else:
-            boxes = []
+        result = self.data.get("result")
         self.mtx_box.release()
-        show_image = image.copy()
+        if result is not None and (not self.results or result.number > self.results[-1].number):
+            if self.startup["first_box_ms"] is None:
+                self.startup["first_box_ms"] = (time.perf_counter() - self.init_start) * 1000
+            self.results.append(result)
+            if self.interpolator is not None:
+                self.interpolator.update(result)
+            self.latency.append(time.time() - result.timestamp)
+            # 按结果实际对应的帧号记录
+            self.record(result.number, result.boxes, result.timestamp)
+
+        if self.display_mode == "sync":
+            # 帧先进入延迟缓冲区，等到对应的结果算出来或者缓冲区满了再显示
+            self.frame_buffer.append((self.nf, image, publish_time))
+            nf, image, frame_time = self.frame_buffer[0]
+            if len(self.frame_buffer) <= self.delay_frames and (not self.results or self.results[-1].number < nf):
+                self.nf += 1
+                return
+            self.frame_buffer.popleft()
+            result = self.match_result(nf)
+            boxes = result.boxes if result else []
+        else:
+            nf, frame_time = self.nf, publish_time
+            result = self.results[-1] if self.results else None
+            boxes = result.boxes if result else []
+            if result and self.interpolator is not None:
+                # 用刚发布的那一帧的Frame，光流用到的灰度缩略图和检测/跟踪共用同一份多尺度缓存
+                frame = self.frames.latest()
+                boxes = self.interpolator.predict(nf, frame.pyramid if frame is not None and frame.number == nf
+                                                  else image)
         self.nf += 1
-        for cls, conf, x1, y1, x2, y2 in boxes:
-            cls = int(cls)
-            x1 = int(x1)
-            y1 = int(y1)
-            x2 = int(x2)
-            y2 = int(y2)
-            color = self.detect_thread.eye.color_boxes[int(cls)]
-            cv2.rectangle(show_image, (x1, y1), (x2, y2), color, 1)
-            title = f"{cls}:{round(conf, 2)}"
-            title_lt = (x1, y1 - 15)
-            title_rb = (x1 + len(title) * 10, y1)
-            cv2.rectangle(show_image, title_lt, title_rb, color, -1)
-            cv2.putText(show_image, title, (x1, y1), cv2.FONT_ITALIC, 0.5, (255, 255, 255), 1)
-        self.show_image = show_image
+        self.display_nf, self.display_boxes, self.display_time = nf, boxes, frame_time
+        self.submit_preview(nf, image, boxes, frame_time)
+        if result is not None:
+            self.staleness.append((nf - result.number, (frame_time - result.timestamp) * 1000))
+            self.metrics.staleness(nf - result.number)
+
+        if self.display_name:
+            s = time.perf_counter()
+            self.show_image = self.renderer.render(image, boxes)
+            self.metrics.record("render", time.perf_counter() - s)
+
+    def match_result(self, nf: int):
+        """返回帧号不超过nf的最新结果，没有的话返回最早的结果"""
+        for result in reversed(self.results):
+            if result.number <= nf:
+                return result
+        return self.results[0] if self.results else None
+
+    def show(self):
+        # 同步模式下缓冲区填满之前还没有可以显示的帧
+        if self.show_image is None and self.display_mode == "sync":
+            return
+        super().show()
+
+    def latency_stats(self):
+        """返回最近结果延迟的(平均值, 最大值)，单位是ms，还没有结果时返回None"""
+        if not self.latency:
+            return None
+        return sum(self.latency) / len(self.latency) * 1000, max(self.latency) * 1000
+
+    def staleness_stats(self):
+        """
+        返回最近显示的帧和所画结果之间的差距，还没有结果时返回None
+
+        Returns
+        -------
+        tuple. (平均落后帧数, 最大落后帧数, 平均落后ms, 最大落后ms)
+        """
+        if not self.staleness:
+            return None
+        frames = [f for f, _ in self.staleness]
+        ms = [t for _, t in self.staleness]
+        return sum(frames) / len(frames), max(frames), sum(ms) / len(ms), max(ms)
 
     @property
     def display_frame(self):
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import time
+import multiprocessing
+from typing import Callable, Optional
+import cv2
+import numpy as np
+from .utils.box import as_boxes
+
+
+def split_segments(n_frames: int, segment_frames: int, gop: int = 1, keyframes: Optional[list] = None) -> list:
+    """
+    把[0, n_frames)切成若干段，每段的起点对齐到关键帧上
+
+    Parameters
+    ----------
+    n_frames : int. 视频的总帧数
+    segment_frames : int. 每段大约的帧数
+    gop : int, default 1. 固定的关键帧间隔，段的起点对齐到gop的整数倍，keyframes不为None时忽略。
+        段的起点对齐到关键帧上可以让seek不需要从上一个关键帧解码过来
+    keyframes : Optional[list]. 实际的关键帧帧号，见probe_keyframes，每段的起点取不早于segment_frames整数倍的第一个关键帧，
+        关键帧间隔不固定时也能对齐
+
+    Returns
+    -------
+    list. [(起始帧, 结束帧), ...]，不包含结束帧
+    """
+    if keyframes:
+        starts = [0]
+        keys = np.asarray(sorted(keyframes))
+        for target in range(segment_frames, n_frames, segment_frames):
+            i = int(np.searchsorted(keys, max(target, starts[-1] + 1)))
+            if i < len(keys) and keys[i] < n_frames:
+                starts.append(int(keys[i]))
+        return [(s, e) for s, e in zip(starts, starts[1:] + [n_frames])]
+    segment_frames = max(gop, segment_frames // gop * gop)
+    return [(s, min(s + segment_frames, n_frames)) for s in range(0, n_frames, segment_frames)]
+
+
+def probe_keyframes(path: str) -> Optional[list]:
+    """
+    只解复用不解码地读一遍视频，返回所有关键帧的帧号。需要OpenCV的FFmpeg后端支持读取原始数据包，
+    不支持或者读不出关键帧时返回None
+    """
+    if not hasattr(cv2, "CAP_PROP_LRF_HAS_KEY_FRAME"):
+        return None
+    try:
+        cap = cv2.VideoCapture(path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    except (cv2.error, TypeError):
+        return None
+    if not cap.isOpened():
+        return None
+    keyframes = []
+    nf = 0
+    while cap.grab():
+        if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+            keyframes.append(nf)
+        nf += 1
+    cap.release()
+    return keyframes or None
+
+
+# 每个子进程只创建一次模型
+worker_model = None
+
+
+def init_worker(model_factory: Callable):
+    global worker_model
+    worker_model = model_factory()
+
+
+def process_segment(task) -> dict:
+    """在子进程中处理视频的一段，结果写到一个.npz文件里"""
+    path, start, end, out_path = task
+    model = worker_model
+    cap = cv2.VideoCapture(path)
+    if start > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    frame_no, boxes = [], []
+    decode_time = infer_time = 0
+    nf = start
+    while nf < end:
+        s = time.perf_counter()
+        ret, frame = cap.read()
+        decode_time += time.perf_counter() - s
+        if not ret:
+            break
+        s = time.perf_counter()
+        b = as_boxes(model(frame))[:, :6]
+        infer_time += time.perf_counter() - s
+        frame_no.append(np.full(len(b), nf, dtype=np.int64))
+        boxes.append(b)
+        nf += 1
+    cap.release()
+    boxes = np.concatenate(boxes) if boxes else np.zeros((0, 6))
+    frame_no = np.concatenate(frame_no) if frame_no else np.zeros(0, dtype=np.int64)
+    # 按列存储，读取时可以只加载需要的列
+    np.savez(out_path, frame_no=frame_no, cls=boxes[:, 0].astype(np.int32), conf=boxes[:, 1].astype(np.float32),
+             x1=boxes[:, 2].astype(np.float32), y1=boxes[:, 3].astype(np.float32),
+             x2=boxes[:, 4].astype(np.float32), y2=boxes[:, 5].astype(np.float32))
+    return {"path": path, "start": start, "end": nf, "output": out_path, "frames": nf - start,
+            "decode_time": decode_time, "infer_time": infer_time}
+
+
+class OfflineRunner:
+    """
+    离线批量处理本地视频，不控制帧率也不显示窗口，按解码和推理能达到的最快速度处理。
+    每个视频按帧数切成若干段，所有段交给进程池并行处理，每段的结果单独写成一个.npz文件，
+    列分别是frame_no,cls,conf,x1,y1,x2,y2
+
+    Parameters
+    ----------
+    model_factory : Callable. 无参数的函数，返回同DetectEye要求的模型。模型在每个子进程里各自创建一次，
+        所以model_factory需要能被pickle，例如模块级的函数或functools.partial
+    workers : Optional[int]. 进程数，None则使用CPU核数
+    segment_frames : int, default 900. 每段大约的帧数
+    gop : Optional[int]. 视频的关键帧间隔，段的起点会对齐到关键帧上。None则先用probe_keyframes读出每个视频实际的关键帧，
+        读不出来时退回到逐帧seek
+    """
+
+    def __init__(self, model_factory: Callable, workers: Optional[int] = None,
+                 segment_frames: int = 900, gop: Optional[int] = None):
+        self.model_factory = model_factory
+        self.workers = workers or os.cpu_count() or 1
+        self.segment_frames = segment_frames
+        self.gop = gop
+
+    def tasks(self, paths: list, out_dir: str) -> list:
+        tasks = []
+        for path in paths:
+            cap = cv2.VideoCapture(path)
+            n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            cap.release()
+            # 不同目录下的同名视频用路径的hash区分，输出文件不会互相覆盖
+            digest = hashlib.md5(os.path.abspath(path).encode()).hexdigest()[:8]
+            name = f"{os.path.splitext(os.path.basename(path))[0]}_{digest}"
+            keyframes = probe_keyframes(path) if self.gop is None and n_frames > 0 else None
+            # 拿不到总帧数时整个文件作为一段
+            if n_frames > 0:
+                segments = split_segments(n_frames, self.segment_frames, self.gop or 1, keyframes)
+            else:
+                segments = [(0, 2 ** 62)]
+            for start, end in segments:
+                out_path = os.path.join(out_dir, f"{name}_{start:08d}.npz")
+                tasks.append((path, start, end, out_path))
+        return tasks
+
+    def run(self, paths: list, out_dir: str) -> dict:
+        """
+        Parameters
+        ----------
+        paths : list. 视频文件的路径
+        out_dir : str. 结果的输出目录
+
+        Returns
+        -------
+        dict. 吞吐报告，包括总帧数、总耗时、整体帧率，以及每一段的帧数、解码和推理耗时
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        tasks = self.tasks(paths, out_dir)
+        s = time.perf_counter()
+        with multiprocessing.Pool(min(self.workers, max(len(tasks), 1)), init_worker, (self.model_factory,)) as pool:
+            segments = pool.map(process_segment, tasks, chunksize=1)
+        elapsed = time.perf_counter() - s
+        frames = sum(seg["frames"] for seg in segments)
+        return {
+            "frames": frames,
+            "seconds": elapsed,
+            "fps": frames / elapsed if elapsed else 0,
+            "workers": self.workers,
+            "segments": segments,
+        }
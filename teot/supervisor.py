@@ -0,0 +1,284 @@
+import os
+import threading
+import multiprocessing
+import warnings
+from multiprocessing import resource_tracker
+from typing import Callable, Optional
+from .base import ncolors
+from .multi import MultiEye
+from .utils.transport import SharedFrameRing, SharedResults
+from .utils.pool import DetectWorker, TrackWorker, portable
+from .utils.schedule import DetectScheduler
+from .utils.roi import RoiPlanner
+from .utils.metrics import Metrics, NULL_METRICS
+
+
+def reopenable(video_type) -> bool:
+    """视频源关闭后能否重新打开：路径、摄像头序号或者返回视频源的函数"""
+    if isinstance(video_type, (str, int)):
+        return True
+    return callable(video_type) and not hasattr(video_type, "read")
+
+
+class Supervisor:
+    """
+    在有界的检测进程池和跟踪进程池上同时运行多路视频流，进程数不随流的数量增长
+
+    每一路流是一个使用共享进程池的MultiEye，在Supervisor的线程里采集、发布帧和显示。
+    调度器和跟踪器的状态都不能跨进程迁移，每一路流固定分配给当前负责流最少的检测进程和跟踪进程，
+    每个进程每一轮把它负责的有新帧的流各处理一次，先处理等得最久的一路。检测由每一路流自己的scheduler决定，
+    设置了roi时只检测已跟踪目标周围的区域，检测和跟踪的结果直接写进该路流的共享内存
+
+        with Supervisor(det_factory, num_classes=80, tracker="kcf") as sv:
+            ids = [sv.add_stream(path) for path in paths]
+            ...
+            sv.restart_stream(ids[0])
+
+    Parameters
+    ----------
+    model_factory : Callable. 无参数的函数，返回同DetectEye要求的模型。每个检测进程各自创建一次，
+        所以model_factory需要能被pickle，例如模块级的函数或functools.partial
+    num_classes : int. 模型可预测的类别总数，用于给框配色
+    tracker : Optional[str]. 跟踪器的类型，同TrackEye的model，None则只检测
+    detect_workers : Optional[int]. 检测进程数，None则使用CPU核数的一半
+    track_workers : Optional[int]. 跟踪进程数，None则使用剩下的CPU核数
+    max_streams : int, default 16. 最多同时运行的流数。进程间的锁只能在启动进程时传递，需要提前分配好
+    detect_interval : int, default 100. 没有传入scheduler的流使用按这个间隔检测的默认调度器，单位是ms
+    metrics : Optional[Metrics]. 检测/跟踪进程的统计，所有流合在一起。每个工作进程各写一行，
+        metrics.writers需要大于detect_workers + track_workers
+    watch_interval : float, default 1.0. 检查工作进程是否存活的间隔，单位是秒。异常退出的工作进程会被换成新的进程，
+        它负责的流交给新进程继续处理，restarts记录了重启的次数。只能恢复抛出异常退出的进程，被SIGKILL的进程可能
+        还持有帧缓冲区共用的锁，这时其他进程也会被阻塞
+    """
+
+    def __init__(self, model_factory: Callable, num_classes: int, tracker: Optional[str] = "kcf",
+                 detect_workers: Optional[int] = None, track_workers: Optional[int] = None,
+                 max_streams: int = 16, detect_interval: int = 100, metrics: Optional[Metrics] = None,
+                 watch_interval: float = 1.0):
+        cores = os.cpu_count() or 1
+        detect_workers = detect_workers or max(1, cores // 2)
+        if tracker is None:
+            track_workers = 0
+        elif not track_workers:
+            track_workers = max(1, cores - detect_workers)
+        self.model_factory = model_factory
+        self.tracker = tracker
+        self.color_boxes = ncolors(num_classes)
+        self.max_streams = max_streams
+        self.detect_interval = detect_interval
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+        self.lock = multiprocessing.Lock()
+        self.cond = multiprocessing.Condition(self.lock)
+        # 每个槽位的结果、保护结果的锁和当前的代数，工作进程启动时继承，之后随槽位复用
+        self.data = [SharedResults() for _ in range(max_streams)]
+        self.locks = [multiprocessing.Lock() for _ in range(max_streams)]
+        self.generations = multiprocessing.Array("q", max_streams, lock=False)
+        # 每个槽位的调度器和RoiPlanner的计数器，工作进程里的调度器写，MultiEye里的调度器读
+        self.counters = [(multiprocessing.Array("q", len(DetectScheduler.REASONS), lock=False),
+                          multiprocessing.Array("q", len(RoiPlanner.COUNTERS), lock=False))
+                         for _ in range(max_streams)]
+        self.n_track = track_workers
+        self.detect_workers = [self.create_worker(0, i) for i in range(detect_workers)]
+        self.track_workers = [self.create_worker(1, i) for i in range(track_workers)]
+        self.watch_interval = watch_interval
+        self.watcher = threading.Thread(target=self.watch, daemon=True)
+        self.closing = threading.Event()
+        self.restarts = 0
+        # 保护下面这些只在主进程里使用的状态
+        self.mutex = threading.Lock()
+        self.streams = {}
+        self.threads = {}
+        self.configs = {}
+        # 槽位 -> (负责它的检测进程, 跟踪进程)，不跟踪时跟踪进程是-1
+        self.owners = {}
+        # 槽位 -> (发给检测进程的add命令, 发给跟踪进程的add命令)，工作进程重启后重新发给新进程
+        self.commands = {}
+        self.generation = 0
+        self.started = False
+
+    def create_worker(self, stage: int, i: int):
+        """创建第i个检测（stage=0）或跟踪（stage=1）进程"""
+        shared = (multiprocessing.Queue(), self.data, self.locks, self.generations, self.lock, self.cond)
+        # 多个工作进程会同时记录同一个阶段，每个进程写metrics的不同行，第0行留给主进程
+        if stage == 0:
+            return DetectWorker(self.model_factory, self.counters, *shared, self.metrics.writer(1 + self.n_track + i))
+        return TrackWorker(self.tracker, *shared, self.metrics.writer(1 + i))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        if os.name == "posix":
+            # 工作进程启动时还没有任何共享内存，先启动resource_tracker让工作进程都继承这一个。否则每个工作进程
+            # 映射共享内存时会各自启动一个，其中一个进程退出时它的resource_tracker会把还在使用的共享内存unlink掉
+            resource_tracker.ensure_running()
+        for worker in self.detect_workers + self.track_workers:
+            worker.start()
+        self.watcher.start()
+        self.started = True
+
+    def watch(self):
+        """定期检查工作进程，异常退出的换成新的进程"""
+        while not self.closing.wait(self.watch_interval):
+            self.mutex.acquire()
+            try:
+                for stage, workers in enumerate((self.detect_workers, self.track_workers)):
+                    for i, worker in enumerate(workers):
+                        if not worker.is_alive() and not self.closing.is_set():
+                            self.replace(stage, i)
+            finally:
+                self.mutex.release()
+
+    def replace(self, stage: int, i: int):
+        """重启第i个检测/跟踪进程，把它负责的流重新交给新进程，流的检测/跟踪状态从头开始。调用者需要持有self.mutex"""
+        workers = self.detect_workers if stage == 0 else self.track_workers
+        warnings.warn(f"{'检测' if stage == 0 else '跟踪'}进程{i}异常退出(exitcode={workers[i].exitcode})，重新启动")
+        worker = self.create_worker(stage, i)
+        for slot, owner in self.owners.items():
+            if owner[stage] == i:
+                worker.inbox.put(self.commands[slot][stage])
+        worker.start()
+        workers[i] = worker
+        self.restarts += 1
+
+    def least_loaded(self, stage: int, n_workers: int) -> int:
+        """负责的流最少的进程，stage是0（检测）或1（跟踪）"""
+        loads = [0] * n_workers
+        for owner in self.owners.values():
+            loads[owner[stage]] += 1
+        return loads.index(min(loads))
+
+    def attach(self, eye: MultiEye, n_slots: int, scheduler: DetectScheduler, roi: Optional[RoiPlanner] = None):
+        """
+        由MultiEye在初始化时调用，为它分配槽位、帧缓冲区和存放结果的共享内存，并通知负责它的工作进程。
+        scheduler和roi的计数器会被换成该槽位的计数器
+
+        Returns
+        -------
+        tuple. (key, SharedFrameRing, SharedResults, 结果的锁)，key是(槽位, 代数)
+        """
+        self.mutex.acquire()
+        try:
+            free = [slot for slot in range(self.max_streams) if slot not in self.streams]
+            if not free:
+                raise RuntimeError(f"最多同时运行{self.max_streams}路流")
+            slot = free[0]
+            self.generation += 1
+            key = (slot, self.generation)
+            ring = SharedFrameRing(eye.frame_shape, n_slots, lock=self.lock, cond=self.cond)
+            self.locks[slot].acquire()
+            self.generations[slot] = key[1]
+            for name in SharedResults.KEYS:
+                self.data[slot].pop(name, None)
+            self.locks[slot].release()
+            for counts in self.counters[slot]:
+                counts[:] = [0] * len(counts)
+            scheduler.counts = self.counters[slot][0]
+            if roi is not None:
+                roi.counts = self.counters[slot][1]
+            commands = (("add", key, ring.descriptor(), portable(scheduler), portable(roi)),
+                        ("add", key, ring.descriptor()))
+            detect_owner = self.least_loaded(0, len(self.detect_workers))
+            self.detect_workers[detect_owner].inbox.put(commands[0])
+            track_owner = -1
+            if self.track_workers:
+                track_owner = self.least_loaded(1, len(self.track_workers))
+                self.track_workers[track_owner].inbox.put(commands[1])
+            self.owners[slot] = (detect_owner, track_owner)
+            self.commands[slot] = commands
+            self.streams[slot] = eye
+        finally:
+            self.mutex.release()
+        return key, ring, self.data[slot], self.locks[slot]
+
+    def detach(self, eye: MultiEye):
+        """由MultiEye.close调用，通知各工作进程不再处理这一路流"""
+        slot = eye.stream_key[0]
+        self.mutex.acquire()
+        try:
+            if self.streams.get(slot) is not eye:
+                return
+            del self.streams[slot]
+            # 之后工作进程迟到的结果不再写进这个槽位
+            self.locks[slot].acquire()
+            self.generations[slot] = 0
+            self.locks[slot].release()
+            detect_owner, track_owner = self.owners.pop(slot)
+            self.commands.pop(slot, None)
+            self.detect_workers[detect_owner].inbox.put(("remove", eye.stream_key))
+            if track_owner >= 0:
+                self.track_workers[track_owner].inbox.put(("remove", eye.stream_key))
+        finally:
+            self.mutex.release()
+
+    def add_stream(self, video_type, **kwargs) -> int:
+        """
+        加入一路流并开始处理
+
+        Parameters
+        ----------
+        video_type : Union[str, int, Callable, any]. 同MultiEye，也可以是无参数调用时返回视频源的函数。
+            restart_stream需要重新打开视频源，已经打开的视频源对象（例如cv2.VideoCapture）不能restart，
+            需要restart时请传入路径、摄像头序号或者函数
+        kwargs : 其他传给MultiEye的参数，例如display_mode、prefetch、fps
+
+        Returns
+        -------
+        int. 流的编号，用于stop_stream/restart_stream
+        """
+        if not self.started:
+            raise RuntimeError("需要先调用start")
+        source = video_type() if reopenable(video_type) and callable(video_type) else video_type
+        eye = MultiEye(video_type=source, pool=self, **kwargs)
+        slot = eye.stream_key[0]
+        thread = threading.Thread(target=eye.run, daemon=True)
+        self.mutex.acquire()
+        self.threads[slot] = thread
+        self.configs[slot] = (video_type, kwargs)
+        self.mutex.release()
+        thread.start()
+        return slot
+
+    def stream(self, stream_id: int) -> Optional[MultiEye]:
+        """返回正在运行的一路流，可以查看它的latency_stats()等统计，已经结束时返回None"""
+        self.mutex.acquire()
+        eye = self.streams.get(stream_id)
+        self.mutex.release()
+        return eye
+
+    def stop_stream(self, stream_id: int, timeout: float = 5):
+        """停止一路流并释放它的槽位"""
+        self.mutex.acquire()
+        eye = self.streams.get(stream_id)
+        thread = self.threads.pop(stream_id, None)
+        self.mutex.release()
+        if eye is not None:
+            eye.stop()
+        if thread is not None:
+            thread.join(timeout)
+        if eye is not None:
+            eye.close()
+
+    def restart_stream(self, stream_id: int) -> int:
+        """用相同的参数重新打开一路流，例如摄像头断开之后，返回新的编号"""
+        video_type, kwargs = self.configs[stream_id]
+        if not reopenable(video_type):
+            raise ValueError(f"第{stream_id}路流的视频源{video_type!r}是已经打开的对象，关闭后不能重新打开，"
+                             f"需要restart时请在add_stream时传入路径、摄像头序号或者返回视频源的函数")
+        self.stop_stream(stream_id)
+        return self.add_stream(video_type, **kwargs)
+
+    def close(self, timeout: float = 5):
+        """停止所有流和工作进程"""
+        for stream_id in list(self.threads):
+            self.stop_stream(stream_id, timeout)
+        self.closing.set()
+        if self.watcher.is_alive():
+            self.watcher.join(timeout)
+        for worker in self.detect_workers + self.track_workers:
+            worker.stop(timeout)
+        self.started = False
@@ -1,76 +1,269 @@
 import cv2
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
-from .base import Eye, ncolors
+from .base import Eye
+from .utils.render import BoxRenderer
+from .utils.box import as_boxes, associate
+from .utils.pyramid import as_image, as_pyramid
 from typing import Optional, Union
 
 
+class Track:
+    """CVTracker中的一个跟踪目标"""
+    __slots__ = ("tracker", "cls", "track_id", "box", "misses", "failed")
+
+    def __init__(self, tracker, cls: int, track_id: int, box: tuple):
+        self.tracker = tracker
+        self.cls = cls
+        self.track_id = track_id
+        # 最近一次的位置，x1,y1,x2,y2
+        self.box = box
+        # 连续多少次检测都没有匹配上
+        self.misses = 0
+        # 最近一次更新是否失败
+        self.failed = False
+
+
 class CVTracker:
     """
     使用opencv-contrib-python库自带的一些跟踪方法
+
+    每次有新的检测结果时，先按IoU把检测框和已有的目标匹配：匹配上的目标保留原来的跟踪器和track_id，
+    只有新出现的目标（以及跟丢后又被检测到的目标）才会重新init跟踪器，连续max_age次检测都没匹配上的目标会被删除
+
+    Parameters
+    ----------
+    tracker_type : str. 跟踪方法的名字，见cv2_tracker
+    scale : float, default 0.2. 跟踪前先把图片缩放的比例
+    workers : int, default 1. 并行更新跟踪器的线程数，opencv在更新时会释放GIL，目标多时可以明显加速
+    iou_threshold : float, default 0.3. 检测框和跟踪框匹配的最低IoU
+    max_age : int, default 1. 目标允许连续没有匹配上检测框的次数
     """
+    # 只记录工厂函数的名字，用到时再从cv2.legacy里取，定义类时不需要访问cv2.legacy
     cv2_tracker = {
-        "csrt": cv2.legacy.TrackerCSRT_create,
-        "kcf": cv2.legacy.TrackerKCF_create,
-        "boosting": cv2.legacy.TrackerBoosting_create,
-        "mil": cv2.legacy.TrackerMIL_create,
-        "tld": cv2.legacy.TrackerTLD_create,
-        "medianflow": cv2.legacy.TrackerMedianFlow_create,
-        "mosse": cv2.legacy.TrackerMOSSE_create
+        "csrt": "TrackerCSRT_create",
+        "kcf": "TrackerKCF_create",
+        "boosting": "TrackerBoosting_create",
+        "mil": "TrackerMIL_create",
+        "tld": "TrackerTLD_create",
+        "medianflow": "TrackerMedianFlow_create",
+        "mosse": "TrackerMOSSE_create"
     }
+    # 输入可以是FramePyramid，缩放结果会和同一帧的其他使用者共享
+    use_pyramid = True
 
-    def __init__(self, tracker_type: str, scale=0.2):
-        if tracker_type in self.cv2_tracker:
-            self.tracker_type = self.cv2_tracker[tracker_type]
-        else:
+    def __init__(self, tracker_type: str, scale=0.2, workers: int = 1,
+                 iou_threshold: float = 0.3, max_age: int = 1):
+        if tracker_type not in self.cv2_tracker:
             raise NotImplementedError
-        self.trackers = []
-        self.cls = []
+        self.tracker_name = tracker_type
+        self._factory = None
+        self.tracks = []
         self.scale = scale
+        self.workers = max(1, workers)
+        self.pool = None
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.next_id = 0
+        # 累计init的跟踪器数量和直接沿用的跟踪器数量
+        self.n_init = 0
+        self.n_kept = 0
+
+    def __getstate__(self):
+        # 线程池不能跨进程传递，在子进程里用到时再创建
+        state = self.__dict__.copy()
+        state["pool"] = None
+        state["_factory"] = None
+        return state
+
+    @property
+    def tracker_type(self):
+        """跟踪器的工厂函数，第一次用到时才解析"""
+        if self._factory is None:
+            self._factory = getattr(cv2.legacy, self.cv2_tracker[self.tracker_name])
+        return self._factory
+
+    def map(self, fn, items: list) -> list:
+        """把items切成workers份交给线程池执行，返回值保持items原来的顺序"""
+        if self.workers == 1 or len(items) < 2:
+            return [fn(item) for item in items]
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(self.workers)
+        n = min(self.workers, len(items))
+        step = (len(items) + n - 1) // n
+        shards = [items[i:i + step] for i in range(0, len(items), step)]
+        results = []
+        for shard in self.pool.map(lambda shard: [fn(item) for item in shard], shards):
+            results.extend(shard)
+        return results
 
     def track_objs(self, image, boxes):
         # image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        image = cv2.resize(image, None, fx=self.scale, fy=self.scale)
-        self.trackers = []
-        self.cls = []
-        for b in boxes.astype(int).tolist():
-            self.cls.append(b[0])
+        image = as_pyramid(image).get(self.scale)
+        boxes = as_boxes(boxes)
+        track_boxes = np.array([t.box for t in self.tracks], dtype=np.float64).reshape(-1, 4)
+        matches, new_dets, lost = associate(boxes[:, 2:6], track_boxes, self.iou_threshold)
+
+        to_init = []
+        for d, t in matches:
+            track = self.tracks[t]
+            track.cls = int(boxes[d, 0])
+            track.misses = 0
+            if track.failed:
+                # 跟丢后又被检测到，需要用检测框重新init
+                to_init.append((track, boxes[d]))
+            else:
+                self.n_kept += 1
+        for t in lost:
+            self.tracks[t].misses += 1
+        tracks = [t for t in self.tracks if t.misses <= self.max_age]
+        for d in new_dets:
+            track = Track(None, int(boxes[d, 0]), self.next_id, tuple(boxes[d, 2:6].tolist()))
+            self.next_id += 1
+            tracks.append(track)
+            to_init.append((track, boxes[d]))
+
+        def init(item):
+            track, b = item
+            b = b.astype(int).tolist()
             tracker = self.tracker_type()
             init_box = (b[2], b[3], b[4] - b[2], b[5] - b[3])
             assert init_box[2] > 0 and init_box[3] > 0
             init_box = tuple([b * self.scale for b in init_box])
             tracker.init(image, init_box)
-            self.trackers.append(tracker)
+            track.tracker = tracker
+            track.box = (b[2], b[3], b[4], b[5])
+            track.failed = False
+
+        self.map(init, to_init)
+        self.n_init += len(to_init)
+        self.tracks = tracks
 
     def __call__(self, image):
+        """
+        Returns
+        -------
+        np.ndarray. shape=(N, 7)，最后一维是cls_type,conf,x1,y1,x2,y2,track_id
+        """
         # image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        image = cv2.resize(image, None, fx=self.scale, fy=self.scale)
+        image = as_pyramid(image).get(self.scale)
+        updates = self.map(lambda t: t.tracker.update(image), self.tracks)
         all_boxes = []
-        for trk, c in zip(self.trackers, self.cls):
-            status, box = trk.update(image)
+        for (status, box), t in zip(updates, self.tracks):
             if len(box) != 4 or box[2] == 0 or box[3] == 0:
+                t.failed = True
                 continue
+            t.failed = False
             box = [b / self.scale for b in box]
-            new_box = (c, 1, box[0], box[1], box[0] + box[2], box[1] + box[3])
+            t.box = (box[0], box[1], box[0] + box[2], box[1] + box[3])
+            new_box = (t.cls, 1) + t.box + (t.track_id,)
             all_boxes.append(new_box)
-        all_boxes = np.array(all_boxes)
+        all_boxes = np.array(all_boxes).reshape(-1, 7)
         return all_boxes
 
 
+class SortTracker:
+    """
+    纯NumPy实现的SORT风格运动跟踪器，不看图片内容，只用匀速模型的卡尔曼滤波预测每个目标的位置。
+    所有目标的状态放在一起做批量矩阵运算，单核也能以采集帧率跟踪上百个目标
+
+    状态是[cx, cy, w, h, vx, vy, vw, vh]，观测是[cx, cy, w, h]，速度的单位是每次调用__call__的位移
+
+    Parameters
+    ----------
+    iou_threshold : float, default 0.3. 检测框和预测框匹配的最低IoU
+    max_age : int, default 1. 目标允许连续没有匹配上检测框的次数
+    """
+    F = np.eye(8)
+    F[:4, 4:] = np.eye(4)
+    H = np.eye(4, 8)
+    Q = np.diag([1, 1, 1, 1, 1e-2, 1e-2, 1e-4, 1e-4])
+    R = np.diag([1, 1, 10, 10])
+    P0 = np.diag([10, 10, 10, 10, 1e3, 1e3, 1e3, 1e3])
+    use_pyramid = True
+
+    def __init__(self, iou_threshold: float = 0.3, max_age: int = 1):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.x = np.zeros((0, 8))
+        self.p = np.zeros((0, 8, 8))
+        self.cls = np.zeros(0)
+        self.conf = np.zeros(0)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.misses = np.zeros(0, dtype=np.int64)
+        self.next_id = 0
+
+    @staticmethod
+    def to_state(xyxy: np.ndarray) -> np.ndarray:
+        w = xyxy[:, 2] - xyxy[:, 0]
+        h = xyxy[:, 3] - xyxy[:, 1]
+        return np.stack([xyxy[:, 0] + w / 2, xyxy[:, 1] + h / 2, w, h], axis=1)
+
+    def boxes(self) -> np.ndarray:
+        """当前所有目标的位置，x1,y1,x2,y2"""
+        cx, cy = self.x[:, 0], self.x[:, 1]
+        w, h = np.maximum(self.x[:, 2], 1), np.maximum(self.x[:, 3], 1)
+        return np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+    def track_objs(self, image, boxes):
+        boxes = as_boxes(boxes)
+        matches, new_dets, lost = associate(boxes[:, 2:6], self.boxes(), self.iou_threshold)
+        if matches:
+            d, t = np.array(matches).T
+            z = self.to_state(boxes[d, 2:6])
+            x, p = self.x[t], self.p[t]
+            y = z - x @ self.H.T
+            s = self.H @ p @ self.H.T + self.R
+            # K = P H^T S^-1，S对称，所以用solve算S^-1 H P再转置
+            k = np.linalg.solve(s, self.H @ p).transpose(0, 2, 1)
+            self.x[t] = x + (k @ y[:, :, None])[:, :, 0]
+            self.p[t] = (np.eye(8) - k @ self.H) @ p
+            self.cls[t] = boxes[d, 0]
+            self.conf[t] = boxes[d, 1]
+            self.misses[t] = 0
+        self.misses[lost] += 1
+        keep = self.misses <= self.max_age
+        n_new = len(new_dets)
+        new_x = np.zeros((n_new, 8))
+        new_x[:, :4] = self.to_state(boxes[new_dets, 2:6])
+        self.x = np.concatenate([self.x[keep], new_x])
+        self.p = np.concatenate([self.p[keep], np.repeat(self.P0[None], n_new, axis=0)])
+        self.cls = np.concatenate([self.cls[keep], boxes[new_dets, 0]])
+        self.conf = np.concatenate([self.conf[keep], boxes[new_dets, 1]])
+        self.ids = np.concatenate([self.ids[keep], np.arange(self.next_id, self.next_id + n_new)])
+        self.misses = np.concatenate([self.misses[keep], np.zeros(n_new, dtype=np.int64)])
+        self.next_id += n_new
+
+    def __call__(self, image):
+        """
+        Returns
+        -------
+        np.ndarray. shape=(N, 7)，最后一维是cls_type,conf,x1,y1,x2,y2,track_id
+        """
+        self.x = self.x @ self.F.T
+        self.p = self.F @ self.p @ self.F.T + self.Q
+        return np.concatenate([self.cls[:, None], self.conf[:, None], self.boxes(), self.ids[:, None]], axis=1)
+
+
 class TrackEye(Eye):
     """
     对视频流做目标检测工程化操作
 
     Parameters
     ----------
-    model : any. 模型推理的类，要求它
+    model : any. 模型推理的类，传入字符串时使用内置的跟踪器："sort"是SortTracker，其他见CVTracker.cv2_tracker。
+        自定义的跟踪器要求它
         * 已实现了__call__且输入是BGR的图片，输出是np.ndarray格式shape=(N, 6)的boxes其中最后一维是cls_type,conf,x1,y1,x2,y2。
+          也可以输出shape=(N, 7)的boxes，多出的最后一列是跟踪器分配的track_id
         * 已实现了track_objs方法来设置初始框，输入分别是image和boxes，boxes要求依然是shape=(N, 6)
+        * 如果类属性use_pyramid为True，image会是teot.utils.pyramid.FramePyramid，可以复用同一帧已经算好的缩放结果
     video_type : Optional[Union[str, int]]. 目前支持摄像头、本地视频和单帧图片三种模型
         * int. 摄像头的序号
         * `other`. 本地视频
         * None. 单帧图片（暂不支持）
     display_name : Optional[str]. 显示窗口的名称，如果是None则不显示窗口
+    prefetch : int, default 0. 后台解码线程的队列长度，0表示在主循环里同步解码
     """
 
     def __init__(self, model,
@@ -80,13 +273,18 @@ class TrackEye(Eye):
                  video_width: int = 1920,
                  video_height: int = 1080,
                  fps: int = 30,
+                 prefetch: int = 0,
                  ):
-        super().__init__(video_type, display_name, video_width, video_height, fps)
-        if isinstance(model, str):
+        super().__init__(video_type, display_name, video_width, video_height, fps, prefetch)
+        if model == "sort":
+            self.model = SortTracker()
+        elif isinstance(model, str):
             self.model = CVTracker(model)
         else:
             self.model = model
         self.color_boxes = color_boxes
+        self.renderer = BoxRenderer(color_boxes, show_conf=False)
+        self.show_image = None
         self.has_obj = False
         print("Track-Eye初始化完成!")
 
@@ -95,34 +293,24 @@ class TrackEye(Eye):
 
         Parameters
         ----------
-        image : np.ndarray. 初始框对应的那张图片
+        image : Union[np.ndarray, FramePyramid]. 初始框对应的那张图片
         init_boxes : np.ndarray. 区别于目标检测，跟踪器需要再给出初始框才能执行。
             初始框shape=(N, 6)，最后一维是cls_type,conf,x1,y1,x2,y2
         """
-        self.model.track_objs(image, init_boxes)
+        self.model.track_objs(self.model_input(image), init_boxes)
         self.has_obj = True
 
+    def model_input(self, image):
+        """声明了use_pyramid的跟踪器直接拿到FramePyramid，其他的拿到原图"""
+        return image if getattr(self.model, "use_pyramid", False) else as_image(image)
+
     def predict(self, image):
-        show_image = image.copy()
         if not self.has_obj:
-            self.show_image = show_image if self.display_name else None
+            self.show_image = self.renderer.render(as_image(image), []) if self.display_name else None
             return np.zeros((0, 6))
-        boxes = self.model(show_image)
+        boxes = self.model(self.model_input(image))
         if self.display_name:
-            for cls, conf, x1, y1, x2, y2 in boxes.tolist():
-                cls = int(cls)
-                x1 = int(x1)
-                y1 = int(y1)
-                x2 = int(x2)
-                y2 = int(y2)
-                color = self.color_boxes[int(cls)]
-                cv2.rectangle(show_image, (x1, y1), (x2, y2), color, 1)
-                title = f"{cls}"
-                title_lt = (x1, y1 - 15)
-                title_rb = (x1 + len(title) * 10, y1)
-                cv2.rectangle(show_image, title_lt, title_rb, color, -1)
-                cv2.putText(show_image, title, (x1, y1), cv2.FONT_ITALIC, 0.5, (255, 255, 255), 1)
-            self.show_image = show_image
+            self.show_image = self.renderer.render(as_image(image), boxes)
         return boxes
 
     @property
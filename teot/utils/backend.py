@@ -0,0 +1,87 @@
+import copy
+import threading
+import time
+import numpy as np
+from .box import as_boxes
+
+BACKENDS = ("process", "thread", "inline")
+
+
+def probe_boxes(shape: tuple, n: int = 4, size: int = 64) -> np.ndarray:
+    """检测器在样本帧上没有检出目标时，用画面中间的n个框来测跟踪器的耗时"""
+    h, w = shape[:2]
+    size = min(size, w // (n + 1), h // 2)
+    return np.array([(0, 1, w * (i + 1) // (n + 1) - size // 2, h // 2 - size // 2,
+                      w * (i + 1) // (n + 1) + size // 2, h // 2 + size // 2) for i in range(n)], dtype=float)
+
+
+def profile_backends(detect_eye, track_eye, image: np.ndarray, repeats: int = 5):
+    """
+    在样本帧上分别测量检测和跟踪单独运行的耗时，以及两者在两个线程里同时运行的总耗时。
+    同时运行的总耗时接近两者中较慢的那个，说明推理时释放了GIL，线程可以并行
+
+    检测和跟踪都在关掉显示的副本上测量，不会改变detect_eye和track_eye的状态。teot.utils.model.LazyModel
+    复制时不带已经创建的模型，副本会在当前进程里另外创建一次，测量完就丢掉，原来的detect_eye仍然没有创建模型
+
+    Returns
+    -------
+    Optional[dict]. detect_ms、track_ms为单独运行时每帧的耗时，concurrent_ms为同时运行时每帧的耗时，
+        检测器或跟踪器不能复制、无法测量时返回None
+    """
+    try:
+        detector = copy.deepcopy(detect_eye)
+        tracker = copy.deepcopy(track_eye) if track_eye is not None else None
+    except Exception:
+        return None
+    detector.display_name = None
+
+    def detect():
+        for _ in range(repeats):
+            detector.predict(image)
+
+    boxes = as_boxes(detector.predict(image))[:, :6]
+    if tracker is not None:
+        tracker.display_name = None
+        tracker.tracking(image, boxes if len(boxes) else probe_boxes(image.shape))
+
+    def track():
+        for _ in range(repeats):
+            tracker.predict(image)
+
+    def timed(*targets):
+        threads = [threading.Thread(target=t) for t in targets]
+        s = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return (time.perf_counter() - s) * 1000 / repeats
+
+    detect_ms = timed(detect)
+    track_ms = timed(track) if tracker is not None else 0
+    concurrent_ms = timed(detect, track) if tracker is not None else detect_ms
+    return {"detect_ms": detect_ms, "track_ms": track_ms, "concurrent_ms": concurrent_ms}
+
+
+def choose_backend(profile: dict, fps: float, inline_budget: float = 0.3, gil_tolerance: float = 1.3) -> str:
+    """
+    根据profile_backends的结果选择后端
+
+    * 检测+跟踪的耗时不超过一帧时间的inline_budget，直接在主循环里做，没有任何同步和拷贝的开销
+    * 两者同时运行的耗时不超过较慢者的gil_tolerance倍，说明推理释放了GIL，用线程，帧不需要跨进程传递
+    * 否则用进程
+
+    Parameters
+    ----------
+    profile : dict. profile_backends的返回值
+    fps : float. 视频的帧率
+    inline_budget : float, default 0.3. inline最多占用一帧时间的比例
+    gil_tolerance : float, default 1.3. 判断推理是否释放了GIL的阈值
+    """
+    serial_ms = profile["detect_ms"] + profile["track_ms"]
+    if serial_ms <= 1000 / fps * inline_budget:
+        return "inline"
+    slowest_ms = max(profile["detect_ms"], profile["track_ms"])
+    if profile["concurrent_ms"] <= slowest_ms * gil_tolerance:
+        return "thread"
+    return "process"
@@ -0,0 +1,104 @@
+import numpy as np
+
+
+def as_boxes(boxes) -> np.ndarray:
+    """
+    把模型/跟踪器的输出统一成shape=(N, C)的float数组，C>=6，前6列是cls_type,conf,x1,y1,x2,y2，
+    跟踪器的输出还会多一列track_id
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    if boxes.ndim == 2:
+        return boxes
+    if boxes.size == 0:
+        return np.zeros((0, 6))
+    return boxes.reshape(1, -1)
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    计算两组框两两之间的IoU
+
+    Parameters
+    ----------
+    a : np.ndarray. shape=(N, 4)，最后一维是x1,y1,x2,y2
+    b : np.ndarray. shape=(M, 4)
+
+    Returns
+    -------
+    np.ndarray. shape=(N, M)
+    """
+    a = a[:, None, :]
+    b = b[None, :, :]
+    iw = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    ih = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = iw * ih
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-9)
+
+
+def greedy_match(iou: np.ndarray, threshold: float = 0.3):
+    """
+    按IoU从大到小贪心匹配
+
+    Returns
+    -------
+    list. 匹配上的(行, 列)下标对
+    """
+    if iou.size == 0:
+        return []
+    rows, cols = np.nonzero(iou >= threshold)
+    order = np.argsort(-iou[rows, cols], kind="stable")
+    used_r, used_c = set(), set()
+    matches = []
+    for r, c in zip(rows[order].tolist(), cols[order].tolist()):
+        if r in used_r or c in used_c:
+            continue
+        used_r.add(r)
+        used_c.add(c)
+        matches.append((r, c))
+    return matches
+
+
+def linear_assignment(cost: np.ndarray):
+    """
+    求代价最小的一一匹配，安装了scipy时使用匈牙利算法，否则按代价从小到大贪心匹配
+
+    Returns
+    -------
+    list. 匹配上的(行, 列)下标对
+    """
+    if cost.size == 0:
+        return []
+    try:
+        from scipy.optimize import linear_sum_assignment
+    except ImportError:
+        return greedy_match(-cost, -np.inf)
+    rows, cols = linear_sum_assignment(cost)
+    return list(zip(rows.tolist(), cols.tolist()))
+
+
+def associate(dets: np.ndarray, tracks: np.ndarray, iou_threshold: float = 0.3):
+    """
+    按IoU把检测框和已有的跟踪框一一匹配
+
+    Parameters
+    ----------
+    dets : np.ndarray. shape=(N, 4)，最后一维是x1,y1,x2,y2
+    tracks : np.ndarray. shape=(M, 4)
+    iou_threshold : float, default 0.3. IoU低于该值的匹配会被拒绝
+
+    Returns
+    -------
+    tuple. (匹配上的(检测下标, 跟踪下标)列表, 没匹配上的检测下标, 没匹配上的跟踪下标)
+    """
+    if len(dets) == 0 or len(tracks) == 0:
+        return [], list(range(len(dets))), list(range(len(tracks)))
+    iou = iou_matrix(dets, tracks)
+    matches = [(d, t) for d, t in linear_assignment(-iou) if iou[d, t] >= iou_threshold]
+    matched_d = {d for d, _ in matches}
+    matched_t = {t for _, t in matches}
+    unmatched_d = [d for d in range(len(dets)) if d not in matched_d]
+    unmatched_t = [t for t in range(len(tracks)) if t not in matched_t]
+    return matches, unmatched_d, unmatched_t
+
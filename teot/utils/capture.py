@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import deque
+from typing import Optional
+import cv2
+import numpy as np
+
+
+class FrameReader(threading.Thread):
+    """
+    在后台线程里解码视频，解码好的帧放进有界队列，主循环取帧时不会被解码的抖动卡住
+
+    翻转和缩放不在后台线程里做，而是在read时才做，被丢掉的帧不会付出这部分开销
+
+    Parameters
+    ----------
+    cap : cv2.VideoCapture. 已经打开的视频源
+    queue_size : int, default 4. 队列长度
+    policy : str, default "drop". 队列满时的处理方式
+        * "drop". 丢掉最旧的帧，适合摄像头。如果连续两次遇到队列满，说明下游持续跟不上，
+          之后只grab不retrieve，直接跳过这一帧的解码
+        * "block". 等待下游取走帧，适合本地视频，不会丢帧
+    flip : bool, default False. 是否左右翻转
+    size : Optional[tuple]. 输出的分辨率(width, height)，None则保持原分辨率
+    """
+
+    def __init__(self, cap, queue_size: int = 4, policy: str = "drop",
+                 flip: bool = False, size: Optional[tuple] = None):
+        super().__init__(daemon=True)
+        if policy not in ("drop", "block"):
+            raise ValueError(f"不支持的policy: {policy}")
+        self.cap = cap
+        self.queue_size = queue_size
+        self.policy = policy
+        self.flip = flip
+        self.size = size
+        self.frames = deque()
+        self.cond = threading.Condition()
+        self.finished = False
+        self.stopped = False
+        # 最近若干帧的解码耗时，单位是秒
+        self.decode_times = deque(maxlen=300)
+        self.dropped = 0
+        self.skipped = 0
+
+    def run(self) -> None:
+        behind = False
+        while not self.stopped:
+            self.cond.acquire()
+            if self.policy == "block":
+                while len(self.frames) >= self.queue_size and not self.stopped:
+                    self.cond.wait()
+            full = len(self.frames) >= self.queue_size
+            self.cond.release()
+            if full and behind:
+                # 下游持续跟不上，只grab不解码
+                if not self.cap.grab():
+                    break
+                self.skipped += 1
+                behind = False
+                continue
+            s = time.perf_counter()
+            ret, frame = self.cap.read()
+            self.decode_times.append(time.perf_counter() - s)
+            if not ret:
+                break
+            self.cond.acquire()
+            behind = len(self.frames) >= self.queue_size
+            if behind:
+                self.frames.popleft()
+                self.dropped += 1
+            self.frames.append(frame)
+            self.cond.notify_all()
+            self.cond.release()
+        self.cond.acquire()
+        self.finished = True
+        self.cond.notify_all()
+        self.cond.release()
+
+    def read(self, timeout: Optional[float] = None, out: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        """
+        取出最旧的一帧，队列为空时阻塞等待，视频结束时返回None
+
+        Parameters
+        ----------
+        timeout : Optional[float]. 最长等待时间，单位是秒，超时返回None
+        out : Optional[np.ndarray]. 翻转/缩放的结果写到这块缓冲区里，None则新分配
+        """
+        self.cond.acquire()
+        self.cond.wait_for(lambda: self.frames or self.finished, timeout)
+        frame = self.frames.popleft() if self.frames else None
+        self.cond.notify_all()
+        self.cond.release()
+        if frame is None:
+            return None
+        if self.size is not None and (frame.shape[1], frame.shape[0]) != tuple(self.size):
+            frame = cv2.resize(frame, tuple(self.size), dst=None if self.flip else out)
+        if self.flip:
+            frame = cv2.flip(frame, 1, dst=out)
+        return frame
+
+    def stop(self):
+        self.cond.acquire()
+        self.stopped = True
+        self.cond.notify_all()
+        self.cond.release()
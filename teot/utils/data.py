@@ -1,4 +1,48 @@
+from .pyramid import FramePyramid
+
+
 class Frame:
-    def __init__(self, number, image):
+    def __init__(self, number, image, timestamp=None):
         self.number = number
-        self.image = image
\ No newline at end of file
+        self.image = image
+        # 帧被发布时的时间戳(time.time())，用于统计从帧到结果的延迟
+        self.timestamp = timestamp
+        self._pyramid = None
+
+    @property
+    def pyramid(self) -> FramePyramid:
+        """这一帧的多尺度缓存，同一个Frame对象的所有使用者共享"""
+        if self._pyramid is None:
+            self._pyramid = FramePyramid(self.image, self.number)
+        return self._pyramid
+
+    def release(self):
+        """释放多尺度缓存，帧所在的位置被新帧覆盖时调用"""
+        if self._pyramid is not None:
+            self._pyramid.release()
+            self._pyramid = None
+
+    def __getstate__(self):
+        # 缓存的缩放结果不跨进程传递
+        state = self.__dict__.copy()
+        state["_pyramid"] = None
+        return state
+
+
+class Result:
+    """
+    带帧号的检测/跟踪结果
+
+    Parameters
+    ----------
+    number : int. 结果是基于哪一帧算出来的
+    boxes : np.ndarray. shape=(N, 6)，最后一维是cls_type,conf,x1,y1,x2,y2
+    timestamp : Optional[float]. 对应帧被发布时的时间戳
+    source : str. 结果来源，"detect"或者"track"
+    """
+
+    def __init__(self, number, boxes, timestamp=None, source="detect"):
+        self.number = number
+        self.boxes = boxes
+        self.timestamp = timestamp
+        self.source = source
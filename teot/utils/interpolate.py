@@ -0,0 +1,163 @@
+from collections import deque
+import cv2
+import numpy as np
+from .box import as_boxes, associate
+from .data import Result
+from .pyramid import as_pyramid
+
+
+class BoxInterpolator:
+    """
+    在两次检测/跟踪结果之间插值出每一帧的框，检测和跟踪可以按远低于采集帧率的频率运行，显示的框仍然逐帧平滑
+
+    每来一个结果，按track_id（没有时按IoU）把框和之前的目标关联起来，用每个目标最近history次结果的位置对帧号做
+    最小二乘拟合出速度，之后每一帧只需要把速度乘上相隔的帧数，几乎没有开销。设置flow=True时，还会在每个框里取
+    flow_points*flow_points个网格点，用金字塔LK光流算出相邻两帧之间的位移中值，光流可靠的框以光流为准，
+    不可靠的（有效点太少）从上一帧的位置按速度前进一步。新结果到来时光流累积的位置被丢弃，不会一直漂移
+
+    Parameters
+    ----------
+    history : int, default 4. 估计速度时使用的最近结果数
+    max_gap : int, default 30. 最多外推的帧数，结果迟迟不来时框停在外推max_gap帧的位置
+    iou_threshold : float, default 0.3. 没有track_id时关联前后两次结果的最低IoU
+    flow : bool, default False. 是否用稀疏光流修正
+    flow_points : int, default 3. 每个框上每个方向取的点数
+    flow_scale : float, default 0.5. 先把图片缩放这个比例再算光流
+    win_size : tuple, default (15, 15). LK光流的窗口大小
+    """
+
+    def __init__(self, history: int = 4, max_gap: int = 30, iou_threshold: float = 0.3, flow: bool = False,
+                 flow_points: int = 3, flow_scale: float = 0.5, win_size: tuple = (15, 15)):
+        self.history = max(2, history)
+        self.max_gap = max_gap
+        self.iou_threshold = iou_threshold
+        self.flow = flow
+        self.flow_points = flow_points
+        self.flow_scale = flow_scale
+        self.win_size = tuple(win_size)
+        self.min_points = min(3, flow_points * flow_points)
+        # 用光流修正的框数和光流不可靠、按速度前进的框数
+        self.n_flow = 0
+        self.n_velocity = 0
+        self.reset()
+
+    def reset(self):
+        # 最新结果的帧号和框，每个框对应的最近若干次位置(帧号, x1, y1, x2, y2)以及拟合出的每帧速度
+        self.number = -1
+        self.boxes = np.zeros((0, 6))
+        self.histories = []
+        self.velocity = np.zeros((0, 4))
+        # 光流的上一帧灰度图，以及那一帧上的框
+        self.prev_gray = None
+        self.flow_boxes = None
+        self.flow_nf = -1
+
+    def update(self, result: Result):
+        """收到新的结果，比已有结果旧的直接忽略"""
+        if result.number <= self.number:
+            return
+        boxes = as_boxes(result.boxes).copy()
+        histories = [None] * len(boxes)
+        if len(self.boxes) and len(boxes):
+            used = set()
+            if boxes.shape[1] > 6 and self.boxes.shape[1] > 6:
+                # 有track_id时按id关联
+                ids = {tid: j for j, tid in enumerate(self.boxes[:, 6].tolist())}
+                for i, tid in enumerate(boxes[:, 6].tolist()):
+                    j = ids.get(tid)
+                    if j is not None and j not in used:
+                        histories[i] = self.histories[j]
+                        used.add(j)
+            # 剩下的（例如检测结果没有track_id）和外推到这一帧的旧框按IoU关联
+            new = [i for i in range(len(boxes)) if histories[i] is None]
+            old = [j for j in range(len(self.boxes)) if j not in used]
+            if new and old:
+                predicted = self.extrapolate(result.number)[old, 2:6]
+                matches, _, _ = associate(boxes[new, 2:6], predicted, self.iou_threshold)
+                for d, t in matches:
+                    histories[new[d]] = self.histories[old[t]]
+        for i in range(len(boxes)):
+            if histories[i] is None:
+                histories[i] = deque(maxlen=self.history)
+            histories[i].append((result.number, *boxes[i, 2:6].tolist()))
+        self.number = result.number
+        self.boxes = boxes
+        self.histories = histories
+        self.velocity = np.array([self.fit(h) for h in histories]).reshape(-1, 4)
+        self.flow_boxes = None
+
+    @staticmethod
+    def fit(history: deque) -> np.ndarray:
+        """最小二乘拟合出每帧的位移，只有一次位置时速度是0"""
+        if len(history) < 2:
+            return np.zeros(4)
+        data = np.asarray(history, dtype=np.float64)
+        t = data[:, 0] - data[:, 0].mean()
+        denom = (t * t).sum()
+        if denom == 0:
+            return np.zeros(4)
+        return (t[:, None] * (data[:, 1:] - data[:, 1:].mean(axis=0))).sum(axis=0) / denom
+
+    def extrapolate(self, nf: int) -> np.ndarray:
+        """按速度把最新结果的框外推到第nf帧"""
+        boxes = self.boxes.copy()
+        gap = min(max(nf - self.number, 0), self.max_gap)
+        boxes[:, 2:6] += self.velocity * gap
+        return boxes
+
+    def predict(self, nf: int, image=None) -> np.ndarray:
+        """
+        Parameters
+        ----------
+        nf : int. 当前帧号
+        image : Optional[Union[np.ndarray, FramePyramid]]. 当前帧，只有flow=True时才用到，需要按帧号顺序传入。
+            传入FramePyramid时灰度缩略图会和同一帧的其他使用者共享
+
+        Returns
+        -------
+        np.ndarray. 第nf帧上的框，列和最新结果相同
+        """
+        boxes = self.extrapolate(nf)
+        if not self.flow or image is None:
+            return boxes
+        gray = as_pyramid(image).get(self.flow_scale, gray=True)
+        prev_gray, self.prev_gray = self.prev_gray, gray
+        if len(boxes) == 0:
+            return boxes
+        if self.flow_boxes is not None and prev_gray is not None and prev_gray.shape == gray.shape \
+                and nf > self.flow_nf:
+            shifts, ok = self.flow_shift(prev_gray, gray, self.flow_boxes[:, 2:6])
+            boxes[ok, 2:6] = self.flow_boxes[ok, 2:6] + shifts[ok]
+            # 光流不可靠的框从光流跟到的位置继续按速度前进，而不是跳回从结果外推的位置
+            boxes[~ok, 2:6] = self.flow_boxes[~ok, 2:6] + self.velocity[~ok] * (nf - self.flow_nf)
+            self.n_flow += int(ok.sum())
+            self.n_velocity += int(len(ok) - ok.sum())
+        self.flow_boxes, self.flow_nf = boxes.copy(), nf
+        return boxes
+
+    def flow_shift(self, prev_gray: np.ndarray, gray: np.ndarray, boxes: np.ndarray):
+        """
+        Returns
+        -------
+        tuple. (shape=(N, 4)的位移，原图坐标, shape=(N,)的bool数组，光流是否可靠)
+        """
+        k, s = self.flow_points, self.flow_scale
+        # 点取在框中间60%的区域里，避开边缘的背景
+        f = (np.arange(k) + 0.5) / k * 0.6 + 0.2
+        x1, y1, x2, y2 = (boxes * s).T
+        xs = x1[:, None] + (x2 - x1)[:, None] * f[None]
+        ys = y1[:, None] + (y2 - y1)[:, None] * f[None]
+        xs, ys = np.broadcast_arrays(xs[:, None, :], ys[:, :, None])
+        points = np.stack([xs, ys], axis=-1).reshape(-1, 1, 2).astype(np.float32)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None, winSize=self.win_size,
+                                                    maxLevel=2)
+        delta = ((moved - points) / s).reshape(len(boxes), k * k, 2)
+        good = status.reshape(len(boxes), k * k).astype(bool)
+        ok = good.sum(axis=1) >= self.min_points
+        shifts = np.zeros((len(boxes), 4))
+        for i in np.nonzero(ok)[0]:
+            shifts[i] = np.tile(np.median(delta[i][good[i]], axis=0), 2)
+        return shifts, ok
+
+    def counters(self) -> dict:
+        return {"flow": self.n_flow, "velocity": self.n_velocity}
@@ -0,0 +1,160 @@
+import time
+import warnings
+from .data import Result
+from .schedule import DetectScheduler
+from .metrics import NULL_METRICS
+
+
+class WorkerLoop:
+    """
+    检测/跟踪工作循环的公共部分。进程、线程和inline三种后端只是运行方式不同，每一帧的处理都在step里，
+    保证三种后端的调度语义完全一致：进程和线程在自己的循环里等待新帧再调用step，inline由MultiEye在主循环里直接调用step
+    """
+
+    def setup(self, eye, data, mutex_box, frames, interval: int, wait_timeout: float, metrics, stopped, ready):
+        self.eye = eye
+        self.data = data
+        self.mtx_box = mutex_box
+        self.frames = frames
+        self.interval = interval / 1000
+        self.wait_timeout = wait_timeout
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+        self.stopped = stopped
+        # warmup完成后set，MultiEye.wait_ready据此等待
+        self.ready = ready
+        self.latest_time = time.time()
+        self.latest_nf = -1
+        # 推理比共享内存的槽位被覆盖还慢时，改为先把帧拷贝出来再推理
+        self.copy_frames = False
+
+    def latest_result(self):
+        self.mtx_box.acquire()
+        result = self.data.get("result")
+        self.mtx_box.release()
+        return result
+
+    def publish(self, result: Result, key: str):
+        self.mtx_box.acquire()
+        self.data["result"] = result
+        self.data[key] = result
+        self.mtx_box.release()
+        self.latest_time = time.time()
+
+    def throttle(self):
+        pass
+
+    def hold(self, frame):
+        """需要时把帧从共享内存里拷贝出来，拷贝期间帧被覆盖则返回None"""
+        return self.frames.copy(frame) if self.copy_frames else frame
+
+    def check(self, view, frame, stage: str) -> bool:
+        """
+        推理直接用的是共享内存的视图时，检查推理期间槽位有没有被覆盖。被覆盖过的结果丢掉，记为stage的一次丢帧，
+        之后的帧都先拷贝再推理
+        """
+        if frame is not view or self.frames.intact(view):
+            return True
+        if not self.copy_frames:
+            warnings.warn(f"{stage}比帧缓冲区的槽位被覆盖还慢，之后先拷贝帧再推理，可以调大n_slots避免拷贝")
+            self.copy_frames = True
+        self.metrics.drop(stage, 1)
+        return False
+
+    def warmup(self):
+        """
+        在处理第一帧之前让模型完成初始化，例如teot.utils.model.LazyModel在这里创建模型，
+        避免第一帧的结果因为加载模型被拖慢。模型没有warmup方法时什么都不做
+        """
+        warmup = getattr(getattr(self.eye, "model", None), "warmup", None)
+        if callable(warmup):
+            warmup()
+        self.ready.set()
+
+    def run(self) -> None:
+        self.warmup()
+        while not self.stopped.is_set():
+            self.throttle()
+            # 阻塞等待新帧发布，没有新帧时不占用CPU
+            frame = self.frames.wait(self.latest_nf, self.wait_timeout)
+            if frame is not None:
+                self.step(frame)
+
+    def step(self, frame):
+        raise NotImplementedError
+
+
+class DetectLoop(WorkerLoop):
+    """每来一帧问一次调度器要不要检测，需要时在全图或roi给出的区域上检测，结果写进data的result和result_det"""
+
+    def setup_detect(self, scheduler, roi, interval: int):
+        # 决定哪些帧需要检测，默认画面静止时按interval检测
+        self.scheduler = scheduler if scheduler else DetectScheduler(interval)
+        # 设置后两次全图检测之间只检测已跟踪目标周围的区域
+        self.roi = roi
+        self.detected = 0
+
+    def predict(self):
+        self.latest_time = time.time()
+
+    def step(self, frame):
+        if self.latest_nf >= 0:
+            # 检测比出帧慢时中间的帧被新帧覆盖
+            self.metrics.drop("detect", frame.number - self.latest_nf - 1)
+        self.latest_nf = frame.number
+        result = self.latest_result()
+        tracked = len(result.boxes) if result is not None and result.source == "track" else self.detected
+        if not self.scheduler.should_detect(time.time(), frame.pyramid, tracked, self.detected):
+            return
+        view, frame = frame, self.hold(frame)
+        if frame is None:
+            self.metrics.drop("detect", 1)
+            return
+        s = time.perf_counter()
+        rois = None
+        if self.roi is not None:
+            rois = self.roi.plan(time.time(), result.boxes if result is not None else None, frame.image.shape)
+        if rois is None:
+            boxes = self.eye.predict(frame.pyramid)
+        else:
+            boxes = self.eye.predict(frame.pyramid, rois)
+        self.metrics.record("detect", time.perf_counter() - s)
+        if not self.check(view, frame, "detect"):
+            return
+        self.publish(Result(frame.number, boxes.copy(), frame.timestamp, "detect"), "result_det")
+        self.detected = len(boxes)
+
+
+class TrackLoop(WorkerLoop):
+    """每来一帧跟踪一次，新的检测结果在检测所用的那一帧上初始化跟踪器，结果写进data的result和result_track"""
+
+    def throttle(self):
+        delay = self.latest_time + self.interval - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def step(self, frame):
+        if self.latest_nf >= 0:
+            self.metrics.drop("track", frame.number - self.latest_nf - 1)
+        self.latest_nf = frame.number
+        if "result_det" in self.data:
+            self.mtx_box.acquire()
+            det = self.data.pop("result_det", None)
+            self.mtx_box.release()
+            if det is not None:
+                # 在检测所用的那一帧上初始化跟踪器，如果那一帧已经被覆盖则退回到当前帧
+                init_frame = self.frames.get(det.number) or frame
+                self.eye.tracking(init_frame.pyramid, det.boxes)
+                if init_frame is frame:
+                    return
+        if not self.eye.has_obj:
+            return
+        view, frame = frame, self.hold(frame)
+        if frame is None:
+            self.metrics.drop("track", 1)
+            return
+        s = time.perf_counter()
+        boxes = self.eye.predict(frame.pyramid)
+        self.metrics.record("track", time.perf_counter() - s)
+        if not self.check(view, frame, "track"):
+            return
+        self.publish(Result(frame.number, boxes.copy(), frame.timestamp, "track"), "result_track")
@@ -0,0 +1,188 @@
+import copy
+import json
+import math
+import multiprocessing
+import threading
+import time
+from typing import Callable, Union
+
+
+class NullMetrics:
+    """关闭统计时使用，所有方法都是空操作"""
+    enabled = False
+
+    def record(self, stage: str, seconds: float):
+        pass
+
+    def drop(self, stage: str, n: int = 1):
+        pass
+
+    def staleness(self, frames: int):
+        pass
+
+    def snapshot(self) -> dict:
+        return {}
+
+    def writer(self, row: int):
+        return self
+
+
+NULL_METRICS = NullMetrics()
+
+
+class Metrics:
+    """
+    流水线各阶段的统计：耗时直方图（p50/p95/p99）、丢帧数、结果落后的帧数以及各阶段的利用率
+
+    所有计数器都放在共享内存里，在主进程创建后传给检测/跟踪子进程，各进程直接累加，主进程随时可以读取。
+    直方图的桶按对数间隔划分，记录一次只需要一次对数运算和一次加法
+
+    累加不加锁，每个写者有自己的一行计数器，snapshot时再把所有行加起来。多个进程会同时记录同一个阶段时
+    （例如Supervisor的多个检测进程），各自通过writer(k)取得写第k行的Metrics，否则会丢失计数
+
+    Parameters
+    ----------
+    stages : tuple. 阶段的名字
+    min_ms : float, default 0.01. 第一个桶的上界，单位是ms
+    ratio : float, default 1.2. 相邻两个桶上界的比例
+    n_buckets : int, default 96. 桶的数量，默认覆盖到大约400s
+    max_staleness : int, default 64. 结果落后帧数的直方图的上限
+    writers : int, default 64. 计数器的行数，即最多可以同时写同一阶段的写者数
+    """
+    enabled = True
+    STAGES = ("capture", "transport", "detect", "track", "render", "display")
+
+    def __init__(self, stages: tuple = STAGES, min_ms: float = 0.01, ratio: float = 1.2,
+                 n_buckets: int = 96, max_staleness: int = 64, writers: int = 64):
+        self.stages = tuple(stages)
+        self.index = {name: i for i, name in enumerate(self.stages)}
+        self.min_ms = min_ms
+        self.log_ratio = math.log(ratio)
+        self.ratio = ratio
+        self.n_buckets = n_buckets
+        self.max_staleness = max_staleness
+        self.writers = writers
+        n = len(self.stages)
+        self.hist = multiprocessing.Array("q", writers * n * n_buckets, lock=False)
+        self.busy = multiprocessing.Array("d", writers * n, lock=False)
+        self.drops = multiprocessing.Array("q", writers * n, lock=False)
+        self.stale = multiprocessing.Array("q", writers * (max_staleness + 1), lock=False)
+        self.start_time = time.time()
+        # 这个对象写的是第几行
+        self.row = 0
+
+    def writer(self, row: int) -> "Metrics":
+        """返回共享同一块计数器、但只写第row行的Metrics，传给会同时记录同一阶段的各个写者"""
+        if not 0 <= row < self.writers:
+            raise ValueError(f"row需要在[0, {self.writers})之间，请调大Metrics的writers")
+        metrics = copy.copy(self)
+        metrics.row = row
+        return metrics
+
+    def bucket(self, seconds: float) -> int:
+        ms = seconds * 1000
+        if ms <= self.min_ms:
+            return 0
+        return min(int(math.log(ms / self.min_ms) / self.log_ratio) + 1, self.n_buckets - 1)
+
+    def record(self, stage: str, seconds: float):
+        """记录某个阶段处理一帧的耗时，单位是秒"""
+        i = self.row * len(self.stages) + self.index[stage]
+        self.hist[i * self.n_buckets + self.bucket(seconds)] += 1
+        self.busy[i] += seconds
+
+    def drop(self, stage: str, n: int = 1):
+        """记录某个阶段丢掉的帧数"""
+        if n > 0:
+            self.drops[self.row * len(self.stages) + self.index[stage]] += n
+
+    def staleness(self, frames: int):
+        """记录显示的帧和所画结果之间相差的帧数"""
+        self.stale[self.row * (self.max_staleness + 1) + min(max(frames, 0), self.max_staleness)] += 1
+
+    def merge(self, values, width: int) -> list:
+        """把每一行长度为width的计数器逐个位置加起来"""
+        values = list(values)
+        return [sum(col) for col in zip(*[values[r * width:(r + 1) * width] for r in range(self.writers)])]
+
+    def upper_ms(self, bucket: int) -> float:
+        return self.min_ms * self.ratio ** bucket
+
+    def percentiles(self, counts: list, upper: Callable, qs=(50, 95, 99)) -> dict:
+        total = sum(counts)
+        out = {}
+        for q in qs:
+            target = total * q / 100
+            acc = 0
+            value = 0
+            for b, c in enumerate(counts):
+                acc += c
+                if c and acc >= target:
+                    value = upper(b)
+                    break
+            out[f"p{q}"] = value
+        return out
+
+    def snapshot(self) -> dict:
+        """
+        Returns
+        -------
+        dict. 每个阶段的次数、p50/p95/p99耗时(ms，取所在桶的上界)、丢帧数和利用率(忙碌时间/总时间)，
+            以及结果落后帧数的p50/p95/p99
+        """
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        n = len(self.stages)
+        hist = self.merge(self.hist, n * self.n_buckets)
+        busy = self.merge(self.busy, n)
+        drops = self.merge(self.drops, n)
+        stages = {}
+        for name, i in self.index.items():
+            counts = hist[i * self.n_buckets:(i + 1) * self.n_buckets]
+            stage = {"count": sum(counts), "drops": drops[i], "utilisation": busy[i] / elapsed}
+            stage.update(self.percentiles(counts, self.upper_ms))
+            stages[name] = stage
+        stale = self.merge(self.stale, self.max_staleness + 1)
+        return {
+            "time": time.time(),
+            "elapsed": elapsed,
+            "stages": stages,
+            "staleness": dict(count=sum(stale), **self.percentiles(stale, lambda b: b)),
+        }
+
+
+class MetricsDumper(threading.Thread):
+    """
+    定期把Metrics的快照输出出去
+
+    Parameters
+    ----------
+    metrics : Metrics
+    interval : float, default 10. 输出的间隔，单位是秒
+    output : Union[str, Callable, None]. 字符串表示追加写到该文件，每行一个json；
+        可调用对象则以快照为参数调用；None则print
+    """
+
+    def __init__(self, metrics: Metrics, interval: float = 10, output: Union[str, Callable, None] = None):
+        super().__init__(daemon=True)
+        self.metrics = metrics
+        self.interval = interval
+        self.output = output
+        self.stopped = threading.Event()
+
+    def dump(self):
+        snapshot = self.metrics.snapshot()
+        if callable(self.output):
+            self.output(snapshot)
+        elif self.output:
+            with open(self.output, "a") as f:
+                f.write(json.dumps(snapshot) + "\n")
+        else:
+            print(json.dumps(snapshot))
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.dump()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
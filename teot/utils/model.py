@@ -0,0 +1,62 @@
+from typing import Callable, Optional
+import numpy as np
+from .pyramid import FramePyramid
+
+
+class LazyModel:
+    """
+    延迟创建的模型，可以直接传给DetectEye。只保存创建模型的工厂函数，第一次推理（或warmup）时才调用它，
+    pickle时也只传递工厂函数，所以MultiEye的检测子进程不需要把整个模型pickle过去，模型直接在子进程里创建，
+    主进程里也不会加载模型。使用spawn/forkserver启动子进程时，factory必须是模块级的函数或functools.partial
+
+        model = LazyModel(functools.partial(load_yolo, "yolo.onnx"), num_classes=80)
+        eye = MultiEye(DetectEye(model), ..., start_method="spawn")
+        eye.wait_ready()
+
+    Parameters
+    ----------
+    factory : Callable. 无参数调用时返回真正的模型，要求同DetectEye的model
+    num_classes : int. 可预测的类别总数，创建模型之前就需要用来分配颜色
+    use_pyramid : bool, default False. 同DetectEye的model.use_pyramid
+    warmup_shape : Optional[tuple]. warmup时在这个shape的全黑图片上推理一次，让模型完成懒加载和内存分配，
+        None则warmup只创建模型
+    """
+
+    def __init__(self, factory: Callable, num_classes: int, use_pyramid: bool = False,
+                 warmup_shape: Optional[tuple] = None):
+        self.factory = factory
+        self.num_classes = num_classes
+        self.use_pyramid = use_pyramid
+        self.warmup_shape = warmup_shape
+        self.model = None
+
+    def __getstate__(self):
+        # 已经创建的模型不跨进程传递，在子进程里重新创建
+        state = self.__dict__.copy()
+        state["model"] = None
+        return state
+
+    @property
+    def built(self) -> bool:
+        return self.model is not None
+
+    def build(self):
+        if self.model is None:
+            self.model = self.factory()
+        return self.model
+
+    def warmup(self):
+        """创建模型，设置了warmup_shape时再推理一次"""
+        model = self.build()
+        if self.warmup_shape is not None:
+            image = np.zeros(self.warmup_shape, dtype=np.uint8)
+            model(FramePyramid(image) if self.use_pyramid else image)
+
+    def __call__(self, image):
+        return self.build()(image)
+
+    def batch(self, images: list) -> list:
+        model = self.build()
+        if hasattr(model, "batch"):
+            return model.batch(images)
+        return [model(image) for image in images]
@@ -0,0 +1,211 @@
+import copy
+import multiprocessing
+import queue
+import warnings
+from typing import Callable
+from .transport import SharedFrameRing
+from .metrics import NULL_METRICS
+from .process import stop_worker
+from .loop import DetectLoop, TrackLoop
+from ..detect import DetectEye
+from ..track import TrackEye
+
+
+def portable(obj):
+    """
+    去掉obj（DetectScheduler或RoiPlanner）的共享计数器，得到可以通过队列发给已经在运行的工作进程的副本。
+    计数器只能在启动进程时传递，工作进程收到后换成Supervisor为该槽位预先分配的计数器
+    """
+    if obj is None:
+        return None
+    obj = copy.copy(obj)
+    obj.counts = None
+    return obj
+
+
+class StreamResults:
+    """
+    一路流在Supervisor里的结果，包装该槽位的SharedResults。槽位被分给新的流之后（代数变了），
+    旧的流的读写都不再生效，迟到的旧结果据此丢弃。和SharedResults一样，由调用者在读写前后加该槽位的锁
+
+    Parameters
+    ----------
+    data : SharedResults. 槽位的结果
+    generations : multiprocessing.Array. 每个槽位当前的代数
+    stream_key : tuple. (槽位, 代数)
+    """
+
+    def __init__(self, data, generations, stream_key: tuple):
+        self.data = data
+        self.generations = generations
+        self.stream_key = stream_key
+
+    def current(self) -> bool:
+        return self.generations[self.stream_key[0]] == self.stream_key[1]
+
+    def __contains__(self, key) -> bool:
+        return self.current() and key in self.data
+
+    def get(self, key: str, default=None):
+        return self.data.get(key, default) if self.current() else default
+
+    def pop(self, key: str, default=None):
+        return self.data.pop(key, default) if self.current() else default
+
+    def __setitem__(self, key: str, result):
+        if self.current():
+            self.data[key] = result
+
+
+class PoolWorker(multiprocessing.Process):
+    """
+    Supervisor进程池中工作进程的公共部分
+
+    进程启动后通过inbox接收命令：("add", key, descriptor, ...)加入一路流，("remove", key)移除一路流。
+    key是(槽位, 代数)，槽位被复用时代数会变化，迟到的旧结果据此丢弃。每一路流各有一个DetectLoop/TrackLoop，
+    每一帧的处理和MultiEye的其他后端完全相同。所有流的帧缓冲区共用同一个条件变量，任何一路发布新帧都会唤醒等待者，
+    每一轮把所有有新帧的流各处理一次，先处理帧最旧的那一路，这样流之间是公平的
+
+    Parameters
+    ----------
+    inbox : multiprocessing.Queue. 该进程专用的命令队列
+    data : list. 每个槽位的SharedResults
+    locks : list. 每个槽位的结果的锁
+    generations : multiprocessing.Array. 每个槽位当前的代数，受对应槽位的锁保护
+    lock : multiprocessing.Lock. 所有帧缓冲区共用的锁
+    cond : multiprocessing.Condition. 基于lock的条件变量
+    metrics : Metrics. 各阶段的统计
+    poll : float, default 0.05. 没有新帧时最长的等待时间，单位是秒，决定了处理命令的延迟
+    """
+
+    def __init__(self, inbox, data, locks, generations, lock, cond, metrics=NULL_METRICS, poll: float = 0.05):
+        super().__init__(daemon=True)
+        self.inbox = inbox
+        self.data = data
+        self.locks = locks
+        self.generations = generations
+        self.lock = lock
+        self.cond = cond
+        self.metrics = metrics
+        self.poll = poll
+        self.stopped = multiprocessing.Event()
+        # 槽位 -> (key, DetectLoop/TrackLoop)，帧缓冲区是loop.frames
+        self.loops = {}
+
+    def handle_commands(self):
+        while True:
+            try:
+                command = self.inbox.get_nowait()
+            except queue.Empty:
+                return
+            self.handle(*command)
+
+    def handle(self, op: str, key: tuple, *args):
+        slot = key[0]
+        if op == "add":
+            self.remove(slot)
+            try:
+                ring = SharedFrameRing.attach(args[0], self.lock, self.cond)
+            except (FileNotFoundError, ValueError) as e:
+                # 命令还在队列里时这一路流已经关闭，帧缓冲区被unlink了
+                warnings.warn(f"无法映射第{slot}路流的帧缓冲区({e})，跳过这一路流")
+                return
+            self.loops[slot] = (key, self.create_loop(key, ring, *args[1:]))
+        elif op == "remove":
+            if slot in self.loops and self.loops[slot][0] == key:
+                self.remove(slot)
+
+    def create_loop(self, key: tuple, ring: SharedFrameRing, *args):
+        raise NotImplementedError
+
+    def setup_loop(self, loop, key: tuple, ring: SharedFrameRing, eye):
+        """工作循环由进程池驱动，不使用它自己的run、节流和warmup"""
+        results = StreamResults(self.data[key[0]], self.generations, key)
+        loop.setup(eye, results, self.locks[key[0]], ring, 0, self.poll, self.metrics, self.stopped, None)
+        return loop
+
+    def remove(self, slot: int):
+        if slot in self.loops:
+            self.loops.pop(slot)[1].frames.close()
+
+    def ready(self) -> list:
+        return [slot for slot, (_, loop) in self.loops.items() if loop.frames._latest_nf() > loop.latest_nf]
+
+    def collect(self) -> list:
+        """等待任意一路流发布新帧，返回有新帧的各路流的(loop, 最新帧)，帧最旧的排在前面"""
+        self.cond.acquire()
+        try:
+            self.cond.wait_for(self.ready, self.poll)
+            jobs = [(self.loops[slot][1], self.loops[slot][1].frames._read()) for slot in self.ready()]
+        finally:
+            self.cond.release()
+        return sorted(jobs, key=lambda job: job[1].timestamp)
+
+    def setup_worker(self):
+        """在子进程里、处理第一个命令之前调用"""
+        pass
+
+    def run(self) -> None:
+        self.setup_worker()
+        while not self.stopped.is_set():
+            self.handle_commands()
+            for loop, frame in self.collect():
+                loop.step(frame)
+        self.close()
+
+    def close(self):
+        for slot in list(self.loops):
+            self.remove(slot)
+
+    def stop(self, timeout: float = 2.0):
+        stop_worker(self, timeout)
+
+
+class DetectWorker(PoolWorker):
+    """
+    检测进程池中的一个进程，所有流共用进程里的一个模型。调度器的状态不能跨进程迁移，每一路流固定由一个检测进程负责，
+    各自按自己的DetectScheduler决定哪些帧需要检测，设置了RoiPlanner时只检测已跟踪目标周围的区域
+
+    Parameters
+    ----------
+    model_factory : Callable. 无参数的函数，返回同DetectEye要求的模型，在子进程里调用
+    counters : list. 每个槽位的(调度器的计数器, RoiPlanner的计数器)，替换收到的调度器和RoiPlanner的计数器，
+        主进程通过它们读到计数
+    """
+
+    def __init__(self, model_factory: Callable, counters: list, inbox, data, locks, generations, lock, cond,
+                 metrics=NULL_METRICS, poll: float = 0.05):
+        super().__init__(inbox, data, locks, generations, lock, cond, metrics, poll)
+        self.model_factory = model_factory
+        self.counters = counters
+        self.eye = None
+
+    def setup_worker(self):
+        self.eye = DetectEye(self.model_factory())
+
+    def create_loop(self, key: tuple, ring: SharedFrameRing, scheduler, roi):
+        scheduler.counts, roi_counts = self.counters[key[0]]
+        if roi is not None:
+            roi.counts = roi_counts
+        loop = self.setup_loop(DetectLoop(), key, ring, self.eye)
+        loop.setup_detect(scheduler, roi, 0)
+        return loop
+
+
+class TrackWorker(PoolWorker):
+    """
+    跟踪进程池中的一个进程。跟踪器的状态不能跨进程迁移，所以每一路流固定由一个跟踪进程负责，
+    检测结果通过该槽位的SharedResults传过来
+
+    Parameters
+    ----------
+    tracker : str. 跟踪器的类型，同TrackEye的model
+    """
+
+    def __init__(self, tracker: str, inbox, data, locks, generations, lock, cond, metrics=NULL_METRICS,
+                 poll: float = 0.05):
+        super().__init__(inbox, data, locks, generations, lock, cond, metrics, poll)
+        self.tracker = tracker
+
+    def create_loop(self, key: tuple, ring: SharedFrameRing):
+        return self.setup_loop(TrackLoop(), key, ring, TrackEye(self.tracker, []))
@@ -0,0 +1,126 @@
+import threading
+import time
+from typing import Callable, Optional
+import cv2
+import numpy as np
+from .box import as_boxes
+from .render import BoxRenderer
+
+
+class PreviewSink(threading.Thread):
+    """
+    低分辨率的JPEG预览，代替全分辨率的cv2.imshow，适合没有显示器的设备
+
+    帧循环里调用submit时，如果距离上一张预览还不到1/fps，直接返回，几乎没有开销；否则只把帧缩小到预览分辨率，
+    画框和JPEG编码都在后台线程里做。后台线程只处理最新的一帧，还没来得及编码的旧帧会被新帧覆盖，
+    所以预览占用的CPU大致固定，也不会拖慢推理
+
+    Parameters
+    ----------
+    color_boxes : list. 每个类别的BGR颜色，一般使用DetectEye.color_boxes
+    size : tuple, default (640, 360). 预览分辨率(width, height)
+    fps : float, default 5. 预览的最高帧率
+    quality : int, default 70. JPEG质量，0~100
+    output : Optional[Callable]. 每编码好一张就以(jpeg, frame_no, timestamp)调用一次，jpeg是bytes，
+        在后台线程里调用，不能阻塞太久。None则只能通过latest/wait获取
+    """
+
+    def __init__(self, color_boxes: list, size: tuple = (640, 360), fps: float = 5, quality: int = 70,
+                 output: Optional[Callable] = None):
+        super().__init__(daemon=True)
+        self.renderer = BoxRenderer(color_boxes)
+        self.size = tuple(size)
+        self.interval = 1 / fps
+        self.quality = quality
+        self.output = output
+        self.cond = threading.Condition()
+        self.pending = None
+        self.latest_submit = 0
+        self.jpeg = None
+        self.jpeg_nf = -1
+        self.jpeg_time = None
+        self.stopped = False
+        # 提交过的帧数、因为帧率上限被跳过的帧数、没来得及编码就被覆盖的帧数、编码的帧数
+        self.submitted = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.encoded = 0
+        self.start()
+
+    def submit(self, image: np.ndarray, boxes, nf: int, timestamp: Optional[float] = None):
+        """
+        Parameters
+        ----------
+        image : np.ndarray. 原始分辨率的BGR图片，返回后调用者可以继续修改它
+        boxes : np.ndarray. image上的框，shape=(N, 6)或(N, 7)
+        nf : int. 帧号
+        timestamp : Optional[float]. 帧的时间戳，None则使用当前时间
+        """
+        self.submitted += 1
+        now = time.time()
+        if now - self.latest_submit < self.interval:
+            self.skipped += 1
+            return
+        self.latest_submit = now
+        # 在调用者线程里只做缩放，之后image就可以被覆盖
+        small = cv2.resize(image, self.size, interpolation=cv2.INTER_AREA)
+        boxes = as_boxes(boxes).copy()
+        boxes[:, [2, 4]] *= self.size[0] / image.shape[1]
+        boxes[:, [3, 5]] *= self.size[1] / image.shape[0]
+        self.cond.acquire()
+        if self.pending is not None:
+            self.dropped += 1
+        self.pending = (small, boxes, nf, now if timestamp is None else timestamp)
+        self.cond.notify_all()
+        self.cond.release()
+
+    def run(self) -> None:
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        while True:
+            self.cond.acquire()
+            self.cond.wait_for(lambda: self.pending is not None or self.stopped)
+            item, self.pending = self.pending, None
+            self.cond.release()
+            if item is None:
+                break
+            small, boxes, nf, timestamp = item
+            self.renderer.render(small, boxes, inplace=True)
+            ok, buf = cv2.imencode(".jpg", small, params)
+            if not ok:
+                continue
+            jpeg = buf.tobytes()
+            self.cond.acquire()
+            self.jpeg, self.jpeg_nf, self.jpeg_time = jpeg, nf, timestamp
+            self.encoded += 1
+            self.cond.notify_all()
+            self.cond.release()
+            if self.output is not None:
+                self.output(jpeg, nf, timestamp)
+
+    def latest(self) -> tuple:
+        """返回最新的(jpeg, frame_no, timestamp)，还没有预览时jpeg是None"""
+        self.cond.acquire()
+        try:
+            return self.jpeg, self.jpeg_nf, self.jpeg_time
+        finally:
+            self.cond.release()
+
+    def wait(self, after_nf: int = -1, timeout: Optional[float] = None) -> tuple:
+        """阻塞直到有帧号大于after_nf的预览，返回同latest，例如MJPEG推流时每个客户端各自调用"""
+        self.cond.acquire()
+        try:
+            self.cond.wait_for(lambda: self.jpeg_nf > after_nf or self.stopped, timeout)
+            return self.jpeg, self.jpeg_nf, self.jpeg_time
+        finally:
+            self.cond.release()
+
+    def stats(self) -> dict:
+        return {"submitted": self.submitted, "skipped": self.skipped, "dropped": self.dropped,
+                "encoded": self.encoded}
+
+    def stop(self, timeout: Optional[float] = None):
+        self.cond.acquire()
+        self.stopped = True
+        self.cond.notify_all()
+        self.cond.release()
+        self.join(timeout)
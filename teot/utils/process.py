@@ -1,81 +1,76 @@
-from typing import Union, Optional
-import time
+from typing import Optional
 import multiprocessing
-import cv2
+from .transport import DictFrameTransport
+from .schedule import DetectScheduler
+from .roi import RoiPlanner
+from .metrics import NULL_METRICS
+from .loop import DetectLoop, TrackLoop
 
 
-class DetectProcess(multiprocessing.Process):
-    def __init__(self, eye, data,
-                 mutex_box: Optional[multiprocessing.Lock] = None,
-                 mutex_img: Optional[multiprocessing.Lock] = None, interval: int = 100):
-        super().__init__()
-        self.eye = eye
-        self.mtx_box = mutex_box if mutex_box else multiprocessing.Lock()
-        self.mtx_img = mutex_img if mutex_img else multiprocessing.Lock()
-        self.fast_detect = True
-        self.data = data
-        self.latest_time = time.time()
-        self.interval = interval / 1000
+def stop_worker(worker: multiprocessing.Process, timeout: float = 2.0):
+    """通知子进程退出循环，等待timeout秒，还没退出（例如卡在模型推理里）就强制结束"""
+    worker.stopped.set()
+    if worker.is_alive():
+        worker.join(timeout)
+    if worker.is_alive():
+        worker.terminate()
+        worker.join()
 
-    def predict(self):
-        self.latest_time = time.time()
 
-    def run(self) -> None:
-        while True:
-            cur_time = time.time()
-            self.mtx_box.acquire()
-            self.fast_detect = self.fast_detect or "boxes" not in self.data or len(self.data["boxes"])
-            self.mtx_box.release()
-            if self.fast_detect or (cur_time - self.latest_time) > self.interval:
-                self.mtx_img.acquire()
-                if "image" not in self.data:
-                    self.mtx_img.release()
-                    continue
-                image = self.data["image"]
-                self.mtx_img.release()
-                boxes = self.eye.predict(image)
-                self.mtx_box.acquire()
-                self.data["boxes"] = boxes.copy()
-                self.data["boxes_det"] = boxes.copy()
-                self.mtx_box.release()
-                self.fast_detect = False
-                self.latest_time = time.time()
+class ProcessWorker:
+    """
+    在子进程里运行工作循环。子进程由context.Process(target=self.run)创建，按context的启动方式(fork/spawn/forkserver)
+    使用对应的进程类；spawn/forkserver启动时pickle的是这个对象本身，不包括子进程对象
+    """
 
+    def init_process(self, context=None):
+        """创建子进程，返回用来创建锁和事件的context。锁和事件必须和子进程来自同一个context，否则子进程无法继承它们"""
+        ctx = context if context else multiprocessing.get_context()
+        self.process = ctx.Process(target=self.run, daemon=True)
+        return ctx
 
-class TrackProcess(multiprocessing.Process):
-    def __init__(self, eye, data, mutex_box: Optional[multiprocessing.Lock] = None,
-                 mutex_img: Optional[multiprocessing.Lock] = None, interval: int = 1):
-        super().__init__()
-        self.eye = eye
-        self.mtx_box = mutex_box if mutex_box else multiprocessing.Lock()
-        self.mtx_img = mutex_img if mutex_img else multiprocessing.Lock()
-        self.data = data
-        self.latest_time = time.time()
-        self.interval = interval / 1000
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("process", None)
+        return state
+
+    def start(self):
+        self.process.start()
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def join(self, timeout: Optional[float] = None):
+        self.process.join(timeout)
+
+    def terminate(self):
+        self.process.terminate()
 
-    def run(self) -> None:
-        while True:
-            cur_time = time.time()
-            if (cur_time - self.latest_time) > self.interval:
-                self.mtx_img.acquire()
-                if "image" not in self.data:
-                    self.mtx_img.release()
-                    continue
-                image = self.data["image"]
-                self.mtx_img.release()
-                if "boxes_det" in self.data:
-                    self.mtx_box.acquire()
-                    self.eye.tracking(image, self.data["boxes_det"])
-                    del self.data["boxes_det"]
-                    self.mtx_box.release()
-                    continue
-                if not self.eye.has_obj:
-                    continue
-                nf = self.data['nf']
-                s = time.time()
-                boxes = self.eye.predict(self.data["image"])
-                self.mtx_box.acquire()
-                self.data["boxes"] = boxes.copy()
-                self.data["boxes_track"] = boxes.copy()
-                self.mtx_box.release()
-                self.latest_time = time.time()
+    def stop(self, timeout: float = 2.0):
+        stop_worker(self, timeout)
+
+
+class DetectProcess(DetectLoop, ProcessWorker):
+    def __init__(self, eye, data,
+                 mutex_box: Optional[multiprocessing.Lock] = None,
+                 mutex_img: Optional[multiprocessing.Lock] = None, interval: int = 100,
+                 frames=None, wait_timeout: float = 1.0, scheduler: Optional[DetectScheduler] = None,
+                 roi: Optional[RoiPlanner] = None, metrics=NULL_METRICS, context=None):
+        ctx = self.init_process(context)
+        self.mtx_img = mutex_img if mutex_img else ctx.Lock()
+        # 帧的传输方式，默认沿用通过data传递的方式
+        frames = frames if frames else DictFrameTransport(data, self.mtx_img, ctx.Condition(self.mtx_img))
+        self.setup(eye, data, mutex_box if mutex_box else ctx.Lock(), frames, interval, wait_timeout,
+                   metrics, ctx.Event(), ctx.Event())
+        self.setup_detect(scheduler, roi, interval)
+
+
+class TrackProcess(TrackLoop, ProcessWorker):
+    def __init__(self, eye, data, mutex_box: Optional[multiprocessing.Lock] = None,
+                 mutex_img: Optional[multiprocessing.Lock] = None, interval: int = 1,
+                 frames=None, wait_timeout: float = 1.0, metrics=NULL_METRICS, context=None):
+        ctx = self.init_process(context)
+        self.mtx_img = mutex_img if mutex_img else ctx.Lock()
+        frames = frames if frames else DictFrameTransport(data, self.mtx_img, ctx.Condition(self.mtx_img))
+        self.setup(eye, data, mutex_box if mutex_box else ctx.Lock(), frames, interval, wait_timeout,
+                   metrics, ctx.Event(), ctx.Event())
@@ -0,0 +1,67 @@
+from typing import Optional
+import cv2
+import numpy as np
+
+
+class FramePyramid:
+    """
+    一帧图片的多尺度/灰度缓存，同一帧的同一种缩放或颜色转换只计算一次，之后的使用者直接复用。
+    跟着帧在流水线里传递，帧被替换后随之释放
+
+    Parameters
+    ----------
+    image : np.ndarray. 原始的BGR图片
+    number : Optional[int]. 帧号
+    """
+
+    def __init__(self, image: np.ndarray, number: Optional[int] = None):
+        self.image = image
+        self.number = number
+        self.cache = {}
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    def get(self, scale: float = 1.0, gray: bool = False, size: Optional[tuple] = None,
+            interpolation: int = cv2.INTER_LINEAR) -> np.ndarray:
+        """
+        Parameters
+        ----------
+        scale : float, default 1.0. 缩放比例，size不为None时忽略
+        gray : bool, default False. 是否转为灰度图
+        size : Optional[tuple]. 缩放到的分辨率(width, height)
+        interpolation : int, default cv2.INTER_LINEAR. 缩放的插值方式
+        """
+        if size is None and scale == 1:
+            key = (None, gray, None)
+        else:
+            key = (tuple(size) if size is not None else scale, gray, interpolation)
+        level = self.cache.get(key)
+        if level is not None:
+            return level
+        if gray:
+            # 先缩放再转灰度，缩放的结果也会被缓存下来
+            level = self.get(scale, False, size, interpolation)
+            level = cv2.cvtColor(level, cv2.COLOR_BGR2GRAY) if level.ndim == 3 else level
+        elif key[0] is None:
+            level = self.image
+        elif size is not None:
+            level = cv2.resize(self.image, tuple(size), interpolation=interpolation)
+        else:
+            level = cv2.resize(self.image, None, fx=scale, fy=scale, interpolation=interpolation)
+        self.cache[key] = level
+        return level
+
+    def release(self):
+        self.cache.clear()
+
+
+def as_pyramid(image) -> FramePyramid:
+    """np.ndarray包装成FramePyramid，FramePyramid原样返回"""
+    return image if isinstance(image, FramePyramid) else FramePyramid(image)
+
+
+def as_image(image) -> np.ndarray:
+    """FramePyramid取出原图，np.ndarray原样返回"""
+    return image.image if isinstance(image, FramePyramid) else image
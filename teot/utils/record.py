@@ -0,0 +1,185 @@
+import os
+import queue
+import threading
+import time
+from typing import Optional
+import numpy as np
+from .box import as_boxes
+
+# 每一列单独存成一个定长的二进制文件
+COLUMNS = (
+    ("frame_no", np.int64),
+    ("timestamp", np.float64),
+    ("track_id", np.int64),
+    ("cls", np.int32),
+    ("conf", np.float32),
+    ("x1", np.float32),
+    ("y1", np.float32),
+    ("x2", np.float32),
+    ("y2", np.float32),
+)
+# 每秒一条索引：(秒, 这一秒第一条记录的行号)
+INDEX_DTYPE = np.int64
+
+
+class ResultWriter(threading.Thread):
+    """
+    把检测/跟踪结果追加写到按列存储的二进制日志里，写文件在后台线程中进行，不会阻塞帧循环
+
+    日志是一个目录，每一列是一个定长记录的.bin文件，另外index.bin记录每一秒第一条记录的行号，
+    用ResultReader可以内存映射后按时间段或track_id查询
+
+    Parameters
+    ----------
+    path : str. 日志目录，不存在时会创建，已存在时接着往后写
+    queue_size : int, default 1024. 待写入的帧数上限，写入跟不上时新来的结果会被丢弃并计数
+    flush_interval : float, default 1. 刷新到磁盘的间隔，单位是秒
+    """
+
+    def __init__(self, path: str, queue_size: int = 1024, flush_interval: float = 1):
+        super().__init__(daemon=True)
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.queue = queue.Queue(queue_size)
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.files = {name: open(os.path.join(path, f"{name}.bin"), "ab") for name, _ in COLUMNS}
+        self.index_file = open(os.path.join(path, "index.bin"), "ab")
+        self.rows = os.path.getsize(os.path.join(path, "frame_no.bin")) // np.dtype(np.int64).itemsize
+        # 接着已有的日志写时，和最后一条记录在同一秒的记录不能再写一条索引，否则按时间查询会漏掉这一秒前面的记录
+        index = ResultReader(path).index
+        self.latest_second = int(index[-1, 0]) if len(index) else None
+        self.start()
+
+    def write(self, frame_no: int, boxes, timestamp: Optional[float] = None):
+        """
+        Parameters
+        ----------
+        frame_no : int. 结果对应的帧号
+        boxes : np.ndarray. shape=(N, 6)或者(N, 7)，第7列是track_id，没有时记为-1
+        timestamp : Optional[float]. 结果对应帧的时间戳，None则使用当前时间
+        """
+        try:
+            self.queue.put_nowait((frame_no, time.time() if timestamp is None else timestamp, boxes))
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self) -> None:
+        latest_flush = time.time()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = False
+            if item is None:
+                break
+            if item:
+                self.append(*item)
+            if time.time() - latest_flush >= self.flush_interval:
+                self.flush()
+                latest_flush = time.time()
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        self.index_file.close()
+
+    def append(self, frame_no: int, timestamp: float, boxes):
+        boxes = as_boxes(boxes)
+        n = len(boxes)
+        if n == 0:
+            return
+        second = int(timestamp)
+        if second != self.latest_second:
+            self.index_file.write(np.array([second, self.rows], dtype=INDEX_DTYPE).tobytes())
+            self.latest_second = second
+        columns = {
+            "frame_no": np.full(n, frame_no),
+            "timestamp": np.full(n, timestamp),
+            "track_id": boxes[:, 6] if boxes.shape[1] > 6 else np.full(n, -1),
+            "cls": boxes[:, 0],
+            "conf": boxes[:, 1],
+            "x1": boxes[:, 2],
+            "y1": boxes[:, 3],
+            "x2": boxes[:, 4],
+            "y2": boxes[:, 5],
+        }
+        for name, dtype in COLUMNS:
+            self.files[name].write(columns[name].astype(dtype).tobytes())
+        self.rows += n
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+        self.index_file.flush()
+
+    def close(self, timeout: Optional[float] = None):
+        """写完队列里剩下的结果后关闭文件"""
+        self.queue.put(None)
+        self.join(timeout)
+
+
+class ResultReader:
+    """
+    内存映射ResultWriter写出的日志，查询时只读取需要的行和列，不需要把整个日志加载进内存
+
+    Parameters
+    ----------
+    path : str. 日志目录
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.columns = {name: self.map(f"{name}.bin", dtype) for name, dtype in COLUMNS}
+        # 写端可能正在写，以最短的列为准
+        self.rows = min(len(c) for c in self.columns.values())
+        index = self.map("index.bin", INDEX_DTYPE)
+        self.index = index[:len(index) // 2 * 2].reshape(-1, 2)
+
+    def map(self, name: str, dtype) -> np.ndarray:
+        file = os.path.join(self.path, name)
+        if not os.path.exists(file) or os.path.getsize(file) < np.dtype(dtype).itemsize:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(file, dtype=dtype, mode="r")
+
+    def __len__(self):
+        return self.rows
+
+    def rows_between(self, start: Optional[float] = None, end: Optional[float] = None) -> slice:
+        """
+        返回时间戳在[start, end)之间的行，先用每秒的索引缩小范围，再在范围内二分查找。
+        start和end为None时对应的一侧不限制
+        """
+        row_lo, row_hi = 0, self.rows
+        seconds = self.index[:, 0]
+        if start is not None:
+            lo = np.searchsorted(seconds, int(start), side="right") - 1
+            row_lo = int(self.index[lo, 1]) if lo >= 0 else 0
+        if end is not None:
+            hi = np.searchsorted(seconds, int(end), side="right")
+            row_hi = min(int(self.index[hi, 1]), self.rows) if hi < len(self.index) else self.rows
+        timestamp = self.columns["timestamp"][row_lo:row_hi]
+        first = row_lo + int(np.searchsorted(timestamp, start, side="left")) if start is not None else row_lo
+        last = row_lo + int(np.searchsorted(timestamp, end, side="left")) if end is not None else row_hi
+        return slice(first, last)
+
+    def query_time(self, start: float, end: float, columns: Optional[list] = None) -> dict:
+        """
+        Parameters
+        ----------
+        start : float. 开始时间戳
+        end : float. 结束时间戳（不包含）
+        columns : Optional[list]. 需要的列，None则返回所有列
+
+        Returns
+        -------
+        dict. 列名到np.ndarray的映射
+        """
+        rows = self.rows_between(start, end)
+        return {name: np.asarray(self.columns[name][rows]) for name in columns or self.columns}
+
+    def query_track(self, track_id: int, start: Optional[float] = None, end: Optional[float] = None,
+                    columns: Optional[list] = None) -> dict:
+        """返回某个track_id在[start, end)之间的所有记录，start和end为None时不限制"""
+        rows = self.rows_between(start, end)
+        hit = np.nonzero(self.columns["track_id"][rows] == track_id)[0] + rows.start
+        return {name: np.asarray(self.columns[name][hit]) for name in columns or self.columns}
@@ -0,0 +1,129 @@
+from typing import Optional
+import cv2
+import numpy as np
+from .box import as_boxes
+
+
+class BoxRenderer:
+    """
+    把shape=(N, 6)的boxes画到图片上，DetectEye、TrackEye和MultiEye共用
+
+    * 每个类别+置信度（保留两位小数）的标签只会光栅化一次，之后直接拷贝到图片上。track_id不进缓存，
+      由每个类别一条光栅化好的"#-0123456789"字符条按位拼出来，id再多也不会让缓存失效
+    * 输出画在一块复用的缓冲区里，不会每帧都分配新的图片
+    * 坐标一次性批量转换成整数
+    * 可以先把图片缩放到显示分辨率再画，此时框的坐标会同步缩放
+
+    注意返回的图片是内部缓冲区，下一次render时会被覆盖
+
+    Parameters
+    ----------
+    color_boxes : list. 每个类别的BGR颜色
+    show_conf : bool, default True. 标签中是否显示置信度
+    display_size : Optional[tuple]. 显示分辨率(width, height)，None则按原图分辨率画
+    max_glyphs : int, default 4096. 缓存的标签数量上限，超出后清空重新缓存
+    """
+    font = cv2.FONT_ITALIC
+    font_scale = 0.5
+    label_height = 15
+    char_width = 10
+    digits = "#-0123456789"
+
+    def __init__(self, color_boxes: list, show_conf: bool = True,
+                 display_size: Optional[tuple] = None, max_glyphs: int = 4096):
+        self.color_boxes = color_boxes
+        self.show_conf = show_conf
+        self.display_size = display_size
+        self.max_glyphs = max_glyphs
+        self.glyphs = {}
+        # 类别 -> 该类别底色上的digits字符条
+        self.strips = {}
+        self.buffer = None
+
+    def title(self, cls: int, conf: float) -> str:
+        return f"{cls}:{round(conf, 2)}" if self.show_conf else f"{cls}"
+
+    def glyph(self, cls: int, conf: float, track_id: Optional[int] = None) -> np.ndarray:
+        """返回标签的图片，包括类别颜色的底色和白色的文字，有track_id时在后面拼上#id"""
+        key = (cls, round(conf, 2) if self.show_conf else None)
+        glyph = self.glyphs.get(key)
+        if glyph is None:
+            if len(self.glyphs) >= self.max_glyphs:
+                self.glyphs.clear()
+            title = self.title(cls, conf)
+            glyph = np.empty((self.label_height + 1, len(title) * self.char_width + 1, 3), dtype=np.uint8)
+            glyph[:] = self.color_boxes[cls]
+            cv2.putText(glyph, title, (0, self.label_height), self.font, self.font_scale, (255, 255, 255), 1)
+            self.glyphs[key] = glyph
+        if track_id is None:
+            return glyph
+        return np.concatenate([glyph, self.id_glyph(cls, track_id)], axis=1)
+
+    def strip(self, cls: int) -> np.ndarray:
+        """该类别底色上的digits字符条，每个字符占char_width宽"""
+        strip = self.strips.get(cls)
+        if strip is None:
+            strip = np.empty((self.label_height + 1, len(self.digits) * self.char_width, 3), dtype=np.uint8)
+            strip[:] = self.color_boxes[cls]
+            for i, ch in enumerate(self.digits):
+                cv2.putText(strip, ch, (i * self.char_width, self.label_height), self.font, self.font_scale,
+                            (255, 255, 255), 1)
+            self.strips[cls] = strip
+        return strip
+
+    def id_glyph(self, cls: int, track_id: int) -> np.ndarray:
+        """从字符条里按位取出"#id"的每个字符拼起来"""
+        strip = self.strip(cls)
+        cw = self.char_width
+        cells = [strip[:, i * cw:(i + 1) * cw] for i in map(self.digits.index, f"#{track_id}")]
+        return np.concatenate(cells, axis=1)
+
+    def prepare(self, image: np.ndarray) -> np.ndarray:
+        """把image拷贝（或缩放）到复用的输出缓冲区中"""
+        if self.display_size:
+            shape = (self.display_size[1], self.display_size[0], image.shape[2])
+        else:
+            shape = image.shape
+        if self.buffer is None or self.buffer.shape != shape or self.buffer.dtype != image.dtype:
+            self.buffer = np.empty(shape, dtype=image.dtype)
+        if self.display_size:
+            cv2.resize(image, self.display_size, dst=self.buffer, interpolation=cv2.INTER_LINEAR)
+        else:
+            np.copyto(self.buffer, image)
+        return self.buffer
+
+    def render(self, image: np.ndarray, boxes, inplace: bool = False) -> np.ndarray:
+        """
+        Parameters
+        ----------
+        image : np.ndarray. 原始分辨率的BGR图片
+        boxes : np.ndarray. shape=(N, 6)，最后一维是cls_type,conf,x1,y1,x2,y2，如果有第7列track_id也会画在标签里
+        inplace : bool, default False. 直接画在image上，不使用缓冲区，此时忽略display_size
+
+        Returns
+        -------
+        np.ndarray. 画好框的图片
+        """
+        out = image if inplace else self.prepare(image)
+        boxes = as_boxes(boxes)
+        if len(boxes) == 0:
+            return out
+        sx = out.shape[1] / image.shape[1]
+        sy = out.shape[0] / image.shape[0]
+        xyxy = np.rint(boxes[:, 2:6] * (sx, sy, sx, sy)).astype(np.int32).tolist()
+        cls = boxes[:, 0].astype(np.int32).tolist()
+        conf = boxes[:, 1].tolist()
+        ids = boxes[:, 6].astype(np.int64).tolist() if boxes.shape[1] > 6 else [None] * len(boxes)
+        h, w = out.shape[:2]
+        for c, p, tid, (x1, y1, x2, y2) in zip(cls, conf, ids, xyxy):
+            cv2.rectangle(out, (x1, y1), (x2, y2), self.color_boxes[c], 1)
+            glyph = self.glyph(c, p, tid)
+            # 标签贴在框的左上角上方，超出图片的部分裁掉
+            top, left = y1 - self.label_height, x1
+            gy1, gx1 = max(0, -top), max(0, -left)
+            gy2 = min(glyph.shape[0], h - top)
+            gx2 = min(glyph.shape[1], w - left)
+            if gy1 >= gy2 or gx1 >= gx2:
+                continue
+            out[top + gy1:top + gy2, left + gx1:left + gx2] = glyph[gy1:gy2, gx1:gx2]
+        return out
@@ -0,0 +1,114 @@
+import multiprocessing
+from typing import Optional
+import numpy as np
+from .box import as_boxes, iou_matrix
+
+
+def merge_rects(rects: list) -> list:
+    """把有重叠的矩形合并成它们的外接矩形，直到两两不再重叠"""
+    rects = [list(r) for r in rects]
+    merged = True
+    while merged:
+        merged = False
+        out = []
+        for r in rects:
+            for o in out:
+                if r[0] < o[2] and o[0] < r[2] and r[1] < o[3] and o[1] < r[3]:
+                    o[0], o[1] = min(o[0], r[0]), min(o[1], r[1])
+                    o[2], o[3] = max(o[2], r[2]), max(o[3], r[3])
+                    merged = True
+                    break
+            else:
+                out.append(r)
+        rects = out
+    return [tuple(r) for r in rects]
+
+
+def nms(boxes: np.ndarray, iou_threshold: float = 0.5) -> np.ndarray:
+    """同类别的框按置信度做非极大值抑制，用于去掉相邻区域重复检出的目标"""
+    boxes = as_boxes(boxes)
+    if len(boxes) < 2:
+        return boxes
+    boxes = boxes[np.argsort(-boxes[:, 1], kind="stable")]
+    iou = iou_matrix(boxes[:, 2:6], boxes[:, 2:6])
+    same_cls = boxes[:, 0][:, None] == boxes[:, 0][None, :]
+    suppressed = np.triu((iou > iou_threshold) & same_cls, k=1)
+    keep = np.ones(len(boxes), dtype=bool)
+    for i in range(len(boxes)):
+        if keep[i]:
+            keep[suppressed[i]] = False
+    return boxes[keep]
+
+
+class RoiPlanner:
+    """
+    决定一次检测是跑全图，还是只跑已跟踪目标周围的区域
+
+    两次全图检测之间，只在已跟踪目标外扩pad后的区域上检测，重叠的区域会合并，
+    每隔refresh跑一次全图以发现新出现的目标。目标区域加起来超过全图的max_area_ratio时直接跑全图。
+    送进模型的像素数累计在共享内存里，主进程也能读到
+
+    Parameters
+    ----------
+    refresh : int, default 1000. 全图检测的间隔，单位是ms
+    pad : float, default 0.5. 区域在每个方向上外扩目标宽高的比例
+    min_size : int, default 64. 区域的最小边长
+    max_area_ratio : float, default 0.5. 区域总面积占全图的比例超过该值时跑全图
+    """
+    COUNTERS = ("full_pixels", "roi_pixels", "full", "roi")
+
+    def __init__(self, refresh: int = 1000, pad: float = 0.5, min_size: int = 64,
+                 max_area_ratio: float = 0.5):
+        self.refresh = refresh / 1000
+        self.pad = pad
+        self.min_size = min_size
+        self.max_area_ratio = max_area_ratio
+        self.latest_full = 0
+        # [全图检测的像素数, 区域检测的像素数, 全图检测次数, 区域检测次数]
+        self.counts = multiprocessing.Array("q", len(self.COUNTERS), lock=False)
+
+    def rois(self, boxes, frame_shape: tuple) -> list:
+        """返回目标外扩并合并后的区域，每个区域是(x1, y1, x2, y2)的整数坐标"""
+        h, w = frame_shape[:2]
+        boxes = as_boxes(boxes)
+        rects = []
+        for x1, y1, x2, y2 in boxes[:, 2:6].tolist():
+            px = max((x2 - x1) * self.pad, (self.min_size - (x2 - x1)) / 2, 0)
+            py = max((y2 - y1) * self.pad, (self.min_size - (y2 - y1)) / 2, 0)
+            rx1, ry1 = max(0, int(x1 - px)), max(0, int(y1 - py))
+            rx2, ry2 = min(w, int(x2 + px + 1)), min(h, int(y2 + py + 1))
+            if rx2 > rx1 and ry2 > ry1:
+                rects.append((rx1, ry1, rx2, ry2))
+        return merge_rects(rects)
+
+    def plan(self, now: float, boxes, frame_shape: tuple) -> Optional[list]:
+        """
+        Parameters
+        ----------
+        now : float. 当前时间
+        boxes : np.ndarray. 跟踪器当前的目标框
+        frame_shape : tuple. 帧的shape
+
+        Returns
+        -------
+        Optional[list]. 本次要检测的区域，None表示跑全图
+        """
+        h, w = frame_shape[:2]
+        if boxes is None or len(boxes) == 0 or now - self.latest_full >= self.refresh:
+            return self.full(now, h * w)
+        rois = self.rois(boxes, frame_shape)
+        area = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in rois)
+        if not rois or area > self.max_area_ratio * h * w:
+            return self.full(now, h * w)
+        self.counts[1] += area
+        self.counts[3] += 1
+        return rois
+
+    def full(self, now: float, pixels: int):
+        self.latest_full = now
+        self.counts[0] += pixels
+        self.counts[2] += 1
+        return None
+
+    def counters(self) -> dict:
+        return dict(zip(self.COUNTERS, list(self.counts)))
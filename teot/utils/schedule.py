@@ -0,0 +1,96 @@
+import multiprocessing
+from typing import Optional
+import cv2
+import numpy as np
+from .pyramid import as_pyramid
+
+
+class DetectScheduler:
+    """
+    自适应的检测调度器，决定每一帧要不要跑检测模型
+
+    * 和上一帧相比，帧差能量超过motion_threshold时，只要距离上次检测已经过了interval就检测，并把间隔恢复到interval。
+      持续运动或者镜头平移时，检测频率和按interval固定检测相同，不会每一帧都检测
+    * 跟踪器跟丢的目标比例超过failure_threshold时立即检测
+    * 画面静止时按interval检测，并且每次都把间隔翻倍，直到max_interval
+    * 任何情况下每秒检测的次数都不超过budget
+
+    计数器放在共享内存里，调度器在子进程中运行时主进程也能读到
+
+    Parameters
+    ----------
+    interval : int, default 100. 画面静止时的初始检测间隔，单位是ms
+    max_interval : int, default 1000. 画面静止时最长的检测间隔，单位是ms
+    budget : Optional[float], default 30. 每秒最多检测的次数，None表示不限制
+    motion_threshold : float, default 4. 帧差能量的阈值，是缩小后的灰度图逐像素差的绝对值的平均值
+    failure_threshold : float, default 0.2. 跟丢目标比例的阈值
+    motion_size : tuple, default (64, 36). 计算帧差前把图片缩小到的分辨率(width, height)
+    """
+    REASONS = ("first", "motion", "failure", "interval", "skipped")
+
+    def __init__(self, interval: int = 100, max_interval: int = 1000, budget: Optional[float] = 30,
+                 motion_threshold: float = 4, failure_threshold: float = 0.2,
+                 motion_size: tuple = (64, 36)):
+        self.interval = interval / 1000
+        self.max_interval = max(interval, max_interval) / 1000
+        self.min_interval = 1 / budget if budget else 0
+        self.motion_threshold = motion_threshold
+        self.failure_threshold = failure_threshold
+        self.motion_size = motion_size
+        self.current_interval = self.interval
+        # 上一次调用时的缩略图，帧差总是和上一帧比较
+        self.previous = None
+        self.latest_time = 0
+        self.counts = multiprocessing.Array("q", len(self.REASONS), lock=False)
+
+    def thumbnail(self, image) -> np.ndarray:
+        return as_pyramid(image).get(size=self.motion_size, gray=True, interpolation=cv2.INTER_AREA)
+
+    def motion_energy(self, thumbnail: np.ndarray) -> float:
+        if self.previous is None:
+            return float("inf")
+        return float(cv2.absdiff(thumbnail, self.previous).mean())
+
+    def should_detect(self, now: float, image, tracked: int = 0, detected: int = 0) -> bool:
+        """
+        Parameters
+        ----------
+        now : float. 当前时间
+        image : Union[np.ndarray, FramePyramid]. 当前帧
+        tracked : int. 跟踪器当前还在跟的目标数
+        detected : int. 上一次检测出的目标数
+        """
+        elapsed = now - self.latest_time
+        if elapsed < self.min_interval:
+            self.counts[self.REASONS.index("skipped")] += 1
+            return False
+        thumbnail = self.thumbnail(image)
+        failure = 1 - tracked / detected if detected else 0
+        first = self.previous is None
+        energy = self.motion_energy(thumbnail)
+        self.previous = thumbnail
+        if first:
+            reason = "first"
+        elif energy > self.motion_threshold and elapsed >= self.interval:
+            reason = "motion"
+        elif failure > self.failure_threshold:
+            reason = "failure"
+        elif elapsed >= self.current_interval:
+            reason = "interval"
+        else:
+            self.counts[self.REASONS.index("skipped")] += 1
+            return False
+        if reason == "interval":
+            # 画面没有变化，逐步放宽检测间隔
+            self.current_interval = min(self.current_interval * 2, self.max_interval)
+        else:
+            self.current_interval = self.interval
+        self.counts[self.REASONS.index(reason)] += 1
+        self.latest_time = now
+        return True
+
+    def counters(self) -> dict:
+        """返回各原因触发的检测次数以及跳过的帧数"""
+        counts = dict(zip(self.REASONS, list(self.counts)))
+        counts["triggered"] = sum(counts[r] for r in self.REASONS if r != "skipped")
+        return counts
@@ -0,0 +1,227 @@
+import multiprocessing
+import queue
+import time
+import traceback
+from typing import Optional
+import cv2
+import numpy as np
+from .box import as_boxes
+from .transport import SharedFrameRing
+
+
+class InferenceClient:
+    """
+    InferenceServer的客户端，用法和普通的检测模型一样，可以直接传给DetectEye。
+    调用时把图片拷贝到自己的共享内存里，再把请求发给服务进程，等待这张图片的结果。
+    共享内存的shape在创建客户端时就固定了，__call__只接受这个shape的图片；DetectEye按区域检测时调用的batch
+    会把大小不一的区域补齐到这个shape
+
+    Parameters
+    ----------
+    stream_id : int. 在服务进程里的编号
+    num_classes : int. 可预测的类别总数
+    frames : SharedFrameRing. 和服务进程共享的帧缓冲区
+    requests : multiprocessing.Queue. 所有客户端共用的请求队列
+    results : multiprocessing.Queue. 该客户端专用的结果队列
+    timeout : float, default 10. 等待结果的最长时间，单位是秒
+    """
+
+    def __init__(self, stream_id: int, num_classes: int, frames: SharedFrameRing,
+                 requests, results, timeout: float = 10):
+        self.stream_id = stream_id
+        self.num_classes = num_classes
+        self.frames = frames
+        self.requests = requests
+        self.results = results
+        self.timeout = timeout
+        self.nf = 0
+
+    def __call__(self, image):
+        self.nf += 1
+        self.frames.publish(self.nf, image)
+        self.requests.put((self.stream_id, self.nf, time.time()))
+        while True:
+            nf, boxes = self.results.get(timeout=self.timeout)
+            # 之前超时的请求的结果直接丢掉
+            if nf == self.nf:
+                if isinstance(boxes, Exception):
+                    # 服务进程里推理出错
+                    raise boxes
+                return boxes
+
+    def fit(self, image: np.ndarray):
+        """
+        把image放到注册的shape的左上角，其余部分补0，比注册的shape大时先等比例缩小
+
+        Returns
+        -------
+        tuple. (补齐后的图片, 缩放比例)
+        """
+        shape = self.frames.shape
+        scale = min(1.0, shape[0] / image.shape[0], shape[1] / image.shape[1])
+        if scale < 1:
+            size = (max(1, int(image.shape[1] * scale)), max(1, int(image.shape[0] * scale)))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        canvas = np.zeros(shape, dtype=self.frames.dtype)
+        canvas[:image.shape[0], :image.shape[1]] = image.reshape(image.shape[:2] + shape[2:])
+        return canvas, scale
+
+    def batch(self, images: list) -> list:
+        """逐张补齐到注册的shape再推理，框映射回各自图片的坐标"""
+        outputs = []
+        for image in images:
+            canvas, scale = self.fit(image)
+            boxes = as_boxes(self(canvas)).copy()
+            if scale < 1:
+                boxes[:, 2:6] /= scale
+            outputs.append(boxes)
+        return outputs
+
+
+class InferenceServer(multiprocessing.Process):
+    """
+    多路视频流共享的推理服务进程，所有流共用一份模型，请求会被动态地凑成batch再推理
+
+    使用时先为每一路流调用client()创建客户端，再start服务进程，然后把客户端当作模型传给DetectEye：
+
+        server = InferenceServer(det, max_batch_size=8, max_wait=10)
+        clients = [server.client((720, 1280, 3)) for _ in range(16)]
+        server.start()
+        eyes = [MultiEye(DetectEye(c), ...) for c in clients]
+
+    Parameters
+    ----------
+    model : any. 同DetectEye的model。如果还实现了batch方法，输入是图片的list，输出是每张图片对应的boxes的list，
+        服务进程会调用它做成批推理，否则逐张调用__call__
+    max_batch_size : int, default 8. 每个batch最多的图片数
+    max_wait : int, default 10. 收到第一个请求后，凑batch最多等待的时间，单位是ms
+    stats_size : int, default 4096. 统计延迟分位数时保留的最近请求数
+    """
+
+    def __init__(self, model, max_batch_size: int = 8, max_wait: int = 10, stats_size: int = 4096):
+        super().__init__(daemon=True)
+        self.model = model
+        self.num_classes = model.num_classes
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait / 1000
+        self.requests = multiprocessing.Queue()
+        self.clients = []
+        self.stats_size = stats_size
+        # 只有服务进程会写这些统计量，不需要加锁
+        self.latency = multiprocessing.Array("d", stats_size, lock=False)
+        # [已处理的帧数, batch数, 推理占用的CPU时间, 服务开始的时间]
+        self.counters = multiprocessing.Array("d", 4, lock=False)
+        self.stream_frames = None
+
+    def client(self, shape: tuple, timeout: float = 10) -> InferenceClient:
+        """
+        为一路视频流创建客户端，必须在start之前调用
+
+        Parameters
+        ----------
+        shape : tuple. 这一路送进模型的图片的shape，一般是Eye.frame_shape，例如(720, 1280, 3)
+        timeout : float, default 10. 同InferenceClient的timeout
+        """
+        if self.stream_frames is not None:
+            raise RuntimeError("InferenceServer已经启动，不能再创建client")
+        c = InferenceClient(len(self.clients), self.num_classes, SharedFrameRing(shape, n_slots=2),
+                            self.requests, multiprocessing.Queue(), timeout)
+        self.clients.append(c)
+        return c
+
+    def start(self) -> None:
+        self.stream_frames = multiprocessing.Array("q", max(len(self.clients), 1), lock=False)
+        self.counters[3] = time.time()
+        super().start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self.requests.put(None)
+        self.join(timeout)
+        for c in self.clients:
+            c.frames.close()
+
+    def next_batch(self):
+        """阻塞直到收到第一个请求，然后在max_wait内尽量凑满batch，收到结束信号时返回None"""
+        req = self.requests.get()
+        if req is None:
+            return None
+        batch = [req]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                req = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if req is None:
+                # 把结束信号放回去，处理完这个batch再退出
+                self.requests.put(None)
+                break
+            batch.append(req)
+        return batch
+
+    def infer(self, images):
+        if hasattr(self.model, "batch"):
+            return self.model.batch(images)
+        return [self.model(image) for image in images]
+
+    def run(self) -> None:
+        n = 0
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                break
+            reqs, images = [], []
+            for stream_id, nf, submit_time in batch:
+                frame = self.clients[stream_id].frames.get(nf)
+                if frame is not None:
+                    reqs.append((stream_id, nf, submit_time))
+                    images.append(frame.image)
+            if not images:
+                # 这个batch里的帧都已经被新帧覆盖了
+                continue
+            cpu = time.process_time()
+            try:
+                outputs = self.infer(images)
+            except Exception as e:
+                # 推理出错时不能让服务进程退出，把错误发给这个batch里的客户端，其他请求照常处理
+                error = RuntimeError(f"InferenceServer推理出错: {e!r}\n{traceback.format_exc()}")
+                for stream_id, nf, _ in reqs:
+                    self.clients[stream_id].results.put((nf, error))
+                continue
+            self.counters[2] += time.process_time() - cpu
+            done = time.time()
+            for (stream_id, nf, submit_time), boxes in zip(reqs, outputs):
+                self.clients[stream_id].results.put((nf, boxes))
+                self.latency[n % self.stats_size] = done - submit_time
+                self.stream_frames[stream_id] += 1
+                n += 1
+            self.counters[0] = n
+            self.counters[1] += 1
+
+    def report(self) -> dict:
+        """
+        返回服务进程的吞吐和延迟统计
+
+        Returns
+        -------
+        dict. 包含处理的总帧数、每一路流的帧数、平均batch大小、总吞吐(帧/s)、
+            每个CPU核心的吞吐(帧/CPU秒)以及延迟的p50/p99(ms)
+        """
+        n = int(self.counters[0])
+        batches = int(self.counters[1])
+        cpu_time = self.counters[2]
+        elapsed = time.time() - self.counters[3] if self.counters[3] else 0
+        latency = np.array(self.latency[:min(n, self.stats_size)]) * 1000
+        return {
+            "streams": len(self.clients),
+            "frames": n,
+            "stream_frames": list(self.stream_frames) if self.stream_frames is not None else [],
+            "mean_batch_size": n / batches if batches else 0,
+            "fps": n / elapsed if elapsed else 0,
+            "fps_per_core": n / cpu_time if cpu_time else 0,
+            "p50_ms": float(np.percentile(latency, 50)) if len(latency) else 0,
+            "p99_ms": float(np.percentile(latency, 99)) if len(latency) else 0,
+        }
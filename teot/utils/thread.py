@@ -1,81 +1,87 @@
-from typing import Union, Optional
-import time
+from typing import Optional
 import threading
+from .transport import DictFrameTransport
+from .schedule import DetectScheduler
+from .roi import RoiPlanner
+from .metrics import NULL_METRICS
+from .loop import DetectLoop, TrackLoop
 
 
-class DetectThread(threading.Thread):
+def default_frames(data, mutex_img, frames):
+    return frames if frames else DictFrameTransport(data, mutex_img, threading.Condition(mutex_img))
+
+
+class DetectThread(DetectLoop, threading.Thread):
+    def __init__(self, eye, data,
+                 mutex_box: Optional[threading.Lock] = None,
+                 mutex_img: Optional[threading.Lock] = None,
+                 interval: int = 100,
+                 frames=None, wait_timeout: float = 1.0, scheduler: Optional[DetectScheduler] = None,
+                 roi: Optional[RoiPlanner] = None, metrics=NULL_METRICS):
+        threading.Thread.__init__(self, daemon=True)
+        self.mtx_img = mutex_img if mutex_img else threading.Lock()
+        self.setup(eye, data, mutex_box if mutex_box else threading.Lock(), default_frames(data, self.mtx_img, frames),
+                   interval, wait_timeout, metrics, threading.Event(), threading.Event())
+        self.setup_detect(scheduler, roi, interval)
+
+    def stop(self, timeout: float = 2.0):
+        self.stopped.set()
+        if self.is_alive():
+            self.join(timeout)
+
+
+class TrackThread(TrackLoop, threading.Thread):
+    def __init__(self, eye, data,
+                 mutex_box: Optional[threading.Lock] = None,
+                 mutex_img: Optional[threading.Lock] = None,
+                 interval: int = 1,
+                 frames=None, wait_timeout: float = 1.0, metrics=NULL_METRICS):
+        threading.Thread.__init__(self, daemon=True)
+        self.mtx_img = mutex_img if mutex_img else threading.Lock()
+        self.setup(eye, data, mutex_box if mutex_box else threading.Lock(), default_frames(data, self.mtx_img, frames),
+                   interval, wait_timeout, metrics, threading.Event(), threading.Event())
+
+    def stop(self, timeout: float = 2.0):
+        self.stopped.set()
+        if self.is_alive():
+            self.join(timeout)
+
+
+class DetectInline(DetectLoop):
+    """不启动线程，由MultiEye在主循环里发布帧之后直接调用step，适合很快的模型，没有任何同步和拷贝的开销"""
+
     def __init__(self, eye, data,
                  mutex_box: Optional[threading.Lock] = None,
                  mutex_img: Optional[threading.Lock] = None,
-                 interval: int = 100):
-        threading.Thread.__init__(self)
-        self.eye = eye
-        self.mtx_box = mutex_box if mutex_box else threading.Lock()
+                 interval: int = 100,
+                 frames=None, wait_timeout: float = 1.0, scheduler: Optional[DetectScheduler] = None,
+                 roi: Optional[RoiPlanner] = None, metrics=NULL_METRICS):
         self.mtx_img = mutex_img if mutex_img else threading.Lock()
-        self.fast_detect = True
-        self.data = data
-        self.latest_time = time.time()
-        self.interval = interval / 1000
-
-    def predict(self):
-        self.latest_time = time.time()
-
-    def run(self) -> None:
-        while True:
-            cur_time = time.time()
-            self.mtx_box.acquire()
-            self.fast_detect = self.fast_detect or "boxes" not in self.data or len(self.data["boxes"])
-            self.mtx_box.release()
-            if self.fast_detect and (cur_time - self.latest_time) > self.interval:
-                self.mtx_img.acquire()
-                if "image" not in self.data:
-                    self.mtx_img.release()
-                    continue
-                image = self.data["image"]
-                self.mtx_img.release()
-                boxes = self.eye.predict(image)
-                self.mtx_box.acquire()
-                self.data["boxes"] = boxes.copy()
-                self.data["boxes_det"] = boxes.copy()
-                self.mtx_box.release()
-                self.fast_detect = False
-                self.latest_time = time.time()
-
-
-class TrackThread(threading.Thread):
+        self.setup(eye, data, mutex_box if mutex_box else threading.Lock(), default_frames(data, self.mtx_img, frames),
+                   interval, wait_timeout, metrics, threading.Event(), threading.Event())
+        self.setup_detect(scheduler, roi, interval)
+
+    def start(self):
+        self.warmup()
+
+    def stop(self, timeout: float = 2.0):
+        self.stopped.set()
+
+
+class TrackInline(TrackLoop):
+    """同DetectInline，每一帧都跟踪，不按interval等待"""
+
     def __init__(self, eye, data,
                  mutex_box: Optional[threading.Lock] = None,
                  mutex_img: Optional[threading.Lock] = None,
-                 interval: int = 30):
-        threading.Thread.__init__(self)
-        self.eye = eye
-        self.mtx_box = mutex_box if mutex_box else threading.Lock()
+                 interval: int = 1,
+                 frames=None, wait_timeout: float = 1.0, metrics=NULL_METRICS):
         self.mtx_img = mutex_img if mutex_img else threading.Lock()
-        self.data = data
-        self.latest_time = time.time()
-        self.interval = interval / 1000
-
-    def run(self) -> None:
-        while True:
-            cur_time = time.time()
-            if (cur_time - self.latest_time) > self.interval:
-                self.mtx_img.acquire()
-                if "image" not in self.data:
-                    self.mtx_img.release()
-                    continue
-                image = self.data["image"]
-                self.mtx_img.release()
-                if "boxes_det" in self.data:
-                    self.mtx_box.acquire()
-                    self.eye.tracking(image, self.data["boxes_det"])
-                    del self.data["boxes_det"]
-                    self.mtx_box.release()
-                    continue
-                if not self.eye.has_obj:
-                    continue
-                boxes = self.eye.predict(self.data["image"])
-                self.mtx_box.acquire()
-                self.data["boxes"] = boxes.copy()
-                self.data["boxes_track"] = boxes.copy()
-                self.mtx_box.release()
-                self.latest_time = time.time()
+        self.setup(eye, data, mutex_box if mutex_box else threading.Lock(), default_frames(data, self.mtx_img, frames),
+                   interval, wait_timeout, metrics, threading.Event(), threading.Event())
+
+    def start(self):
+        self.warmup()
+
+    def stop(self, timeout: float = 2.0):
+        self.stopped.set()
@@ -0,0 +1,355 @@
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+from typing import Optional
+import numpy as np
+from .data import Frame, Result
+from .box import as_boxes
+
+
+class FrameTransport:
+    """
+    帧传输方式的公共部分。写端发布新帧后会notify所有等待者，读端可以阻塞等待新帧而不是轮询
+    """
+
+    def __init__(self, lock=None, cond=None):
+        self.lock = lock if lock else multiprocessing.Lock()
+        self.cond = cond if cond else multiprocessing.Condition(self.lock)
+
+    def publish(self, nf: int, image: np.ndarray):
+        self.cond.acquire()
+        try:
+            self._write(nf, image, time.time())
+            self.cond.notify_all()
+        finally:
+            self.cond.release()
+
+    def latest(self) -> Optional[Frame]:
+        """返回最新的一帧，还没有帧时返回None"""
+        self.cond.acquire()
+        try:
+            return self._read()
+        finally:
+            self.cond.release()
+
+    def wait(self, after_nf: int = -1, timeout: Optional[float] = None) -> Optional[Frame]:
+        """
+        阻塞直到有帧号大于after_nf的帧发布，返回最新的一帧，超时返回None
+
+        Parameters
+        ----------
+        after_nf : int. 上一次处理过的帧号
+        timeout : Optional[float]. 最长等待时间，单位是秒
+        """
+        self.cond.acquire()
+        try:
+            self.cond.wait_for(lambda: self._latest_nf() > after_nf, timeout)
+            frame = self._read()
+        finally:
+            self.cond.release()
+        if frame is None or frame.number <= after_nf:
+            return None
+        return frame
+
+    def get(self, nf: int) -> Optional[Frame]:
+        """返回帧号为nf的帧，如果它已经被覆盖则返回None"""
+        self.cond.acquire()
+        try:
+            frame = self._read_number(nf)
+        finally:
+            self.cond.release()
+        return frame
+
+    def intact(self, frame: Frame) -> bool:
+        """读出frame之后，它所在的位置还没有开始被新帧覆盖。通过字典传递的帧是各自独立的对象，总是完整的"""
+        return True
+
+    def copy(self, frame: Frame) -> Optional[Frame]:
+        """把frame拷贝成独立的一帧，拷贝期间它被覆盖时返回None"""
+        image = frame.image.copy()
+        if not self.intact(frame):
+            return None
+        return Frame(frame.number, image, frame.timestamp)
+
+    def close(self):
+        pass
+
+    def _read_number(self, nf: int) -> Optional[Frame]:
+        frame = self._read()
+        if frame is None or frame.number != nf:
+            return None
+        return frame
+
+    def _latest_nf(self) -> int:
+        raise NotImplementedError
+
+    def _write(self, nf: int, image: np.ndarray, timestamp: float):
+        raise NotImplementedError
+
+    def _read(self) -> Optional[Frame]:
+        raise NotImplementedError
+
+
+class DictFrameTransport(FrameTransport):
+    """
+    通过字典（一般是Manager().dict()）在进程间传递帧，每一帧都会经过pickle。
+    当共享内存不可用时作为后备方案
+
+    Parameters
+    ----------
+    data : dict. 用于存放帧的字典，"frame"是Frame对象，"nf"是它的帧号。在线程中使用普通的dict时，
+        所有读端拿到的是同一个Frame对象，共享它的多尺度缓存
+    lock : Optional[multiprocessing.Lock]. 保护"image"和"nf"的锁
+    cond : Optional[multiprocessing.Condition]. 基于lock的条件变量，线程中使用时需要传入threading.Condition
+    """
+
+    def __init__(self, data, lock=None, cond=None):
+        super().__init__(lock, cond)
+        self.data = data
+
+    def _latest_nf(self):
+        return self.data.get("nf", -1)
+
+    def _write(self, nf, image, timestamp):
+        self.data["frame"] = Frame(nf, image, timestamp)
+        self.data["nf"] = nf
+
+    def _read(self):
+        return self.data.get("frame")
+
+
+class SharedFrameRing(FrameTransport):
+    """
+    基于multiprocessing.shared_memory的定长帧环形缓冲区，帧在进程间传递时不再经过pickle，
+    读端拿到的是直接指向共享内存的np.ndarray视图。
+
+    共享内存的开头是一个int64的头部：[最新帧号, 最新帧所在槽位]，然后是每个槽位存放的帧号和发布时间，
+    后面紧跟着n_slots个帧槽位。写端总是写到下一个槽位，所以读端拿到的视图在之后的n_slots-1帧内
+    都不会被覆盖，如果需要更久地持有某一帧，请用copy拷贝出来。在视图上做完推理之后可以用intact检查
+    推理期间槽位有没有被覆盖，被覆盖过的话推理用到的是新旧两帧混在一起的画面，结果不可信
+
+    Parameters
+    ----------
+    shape : tuple. 帧的shape，例如(1080, 1920, 3)
+    n_slots : int, default 4. 槽位数量
+    dtype : default np.uint8. 帧的数据类型
+    lock : Optional[multiprocessing.Lock]. 保护头部的锁
+    cond : Optional[multiprocessing.Condition]. 基于lock的条件变量，多个缓冲区可以共用一个，
+        这样等待者可以同时等待多路视频流的新帧
+    """
+    HEADER_SIZE = 2
+
+    def __init__(self, shape: tuple, n_slots: int = 4, dtype=np.uint8, lock=None, cond=None):
+        if n_slots < 2:
+            raise ValueError("n_slots至少为2")
+        super().__init__(lock, cond)
+        self.shape = tuple(shape)
+        self.n_slots = n_slots
+        self.dtype = np.dtype(dtype)
+        self.owner = True
+        self.shm = shared_memory.SharedMemory(create=True, size=self._nbytes())
+        try:
+            self._attach()
+            self._header[:] = -1
+        except BaseException:
+            # 映射失败时共享内存已经分配，不释放的话会一直留在/dev/shm里
+            self._frames = None
+            self.shm.close()
+            self.shm.unlink()
+            raise
+
+    def _nbytes(self):
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        return (self.HEADER_SIZE + 2 * self.n_slots) * 8 + frame_bytes * self.n_slots
+
+    def _attach(self):
+        # 每个槽位最近一次读出的Frame，同一进程里读同一帧的使用者共享它的多尺度缓存，槽位被覆盖后随之释放
+        self._cache = [None] * self.n_slots
+        buf = self.shm.buf
+        self._header = np.ndarray((self.HEADER_SIZE + self.n_slots,), dtype=np.int64, buffer=buf)
+        self._slot_nf = self._header[self.HEADER_SIZE:]
+        self._times = np.ndarray((self.n_slots,), dtype=np.float64, buffer=buf,
+                                 offset=(self.HEADER_SIZE + self.n_slots) * 8)
+        self._frames = np.ndarray((self.n_slots,) + self.shape, dtype=self.dtype,
+                                  buffer=buf, offset=(self.HEADER_SIZE + 2 * self.n_slots) * 8)
+
+    def descriptor(self) -> dict:
+        """
+        共享内存的名字和布局，不包含锁。锁只能在启动子进程时传递，已经在运行的进程可以拿着descriptor和
+        启动时继承的锁调用attach映射同一块缓冲区
+        """
+        return {
+            "name": self.shm.name,
+            "shape": self.shape,
+            "n_slots": self.n_slots,
+            "dtype": self.dtype.str,
+        }
+
+    @classmethod
+    def attach(cls, descriptor: dict, lock, cond) -> "SharedFrameRing":
+        ring = cls.__new__(cls)
+        ring.__setstate__(dict(descriptor, lock=lock, cond=cond))
+        return ring
+
+    def __getstate__(self):
+        # 以spawn/forkserver方式启动子进程时只传递共享内存的名字，子进程里再重新映射
+        return dict(self.descriptor(), lock=self.lock, cond=self.cond)
+
+    def __setstate__(self, state):
+        self.shape = state["shape"]
+        self.n_slots = state["n_slots"]
+        self.dtype = np.dtype(state["dtype"])
+        self.lock = state["lock"]
+        self.cond = state["cond"]
+        self.owner = False
+        self.shm = shared_memory.SharedMemory(name=state["name"])
+        self._attach()
+
+    def publish(self, nf: int, image: np.ndarray):
+        """把image拷贝到下一个槽位中，再更新头部并通知等待的读端"""
+        if image.shape != self.shape:
+            raise ValueError(f"帧的shape{image.shape}和共享内存的shape{self.shape}不一致")
+        # 只有写端会修改槽位，拷贝可以放在锁外面
+        slot = (int(self._header[1]) + 1) % self.n_slots
+        self._slot_nf[slot] = -1
+        np.copyto(self._frames[slot], image)
+        self._times[slot] = time.time()
+        self.cond.acquire()
+        try:
+            self._slot_nf[slot] = nf
+            self._header[0] = nf
+            self._header[1] = slot
+            self.cond.notify_all()
+        finally:
+            self.cond.release()
+
+    def _latest_nf(self):
+        return int(self._header[0])
+
+    def _read(self):
+        nf, slot = int(self._header[0]), int(self._header[1])
+        if nf < 0:
+            return None
+        return self._frame(slot, nf)
+
+    def _frame(self, slot, nf):
+        frame = self._cache[slot]
+        if frame is None or frame.number != nf:
+            if frame is not None:
+                # 槽位里已经是新的一帧，旧帧的缩放结果不会再被用到
+                frame.release()
+            frame = Frame(nf, self._frames[slot], float(self._times[slot]))
+            self._cache[slot] = frame
+        return frame
+
+    def intact(self, frame):
+        # 写端开始覆盖槽位时先把它的帧号改成-1，之后帧号不会再变回来
+        return self._slot_nf is not None and bool(np.any(self._slot_nf == frame.number))
+
+    def _read_number(self, nf):
+        # 环形缓冲区里还保留着最近的n_slots-1帧
+        hit = np.nonzero(self._slot_nf == nf)[0]
+        if nf < 0 or len(hit) == 0:
+            return None
+        return self._frame(int(hit[0]), nf)
+
+    def close(self):
+        if self._frames is None:
+            return
+        for frame in self._cache:
+            if frame is not None:
+                frame.release()
+        self._cache = None
+        self._header = None
+        self._slot_nf = None
+        self._times = None
+        self._frames = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                # 已经被别的进程（例如异常退出的进程的resource_tracker）unlink了
+                pass
+
+
+class SharedResults:
+    """
+    存放检测/跟踪结果的共享内存，在进程后端里代替Manager().dict()作为MultiEye的data：不需要启动Manager服务进程，
+    每次读写也不再经过一次socket往返。只支持KEYS中的几个键，值是Result，每个结果最多保存max_boxes个框，
+    多出的框会被丢掉。和Manager().dict()一样，由调用者在读写前后加锁
+
+    Parameters
+    ----------
+    max_boxes : int, default 512. 每个结果最多保存的框数
+    columns : int, default 7. 每个框最多保存的列数
+    """
+    KEYS = ("result", "result_det", "result_track")
+    SOURCES = ("detect", "track")
+    # 每个键的头部：[是否有值, 帧号, 时间戳, 来源, 框数, 列数]
+    HEADER_SIZE = 6
+
+    def __init__(self, max_boxes: int = 512, columns: int = 7):
+        self.max_boxes = max_boxes
+        self.columns = columns
+        self.header = multiprocessing.Array("d", len(self.KEYS) * self.HEADER_SIZE, lock=False)
+        self.values = multiprocessing.Array("d", len(self.KEYS) * max_boxes * columns, lock=False)
+        self._attach()
+
+    def _attach(self):
+        self._header = np.frombuffer(self.header, dtype=np.float64).reshape(len(self.KEYS), self.HEADER_SIZE)
+        self._boxes = np.frombuffer(self.values, dtype=np.float64).reshape(len(self.KEYS), self.max_boxes,
+                                                                           self.columns)
+
+    def __getstate__(self):
+        # numpy视图在子进程里重新创建
+        return {"max_boxes": self.max_boxes, "columns": self.columns, "header": self.header, "values": self.values}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._attach()
+
+    def _index(self, key: str) -> int:
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return self.KEYS.index(key)
+
+    def __contains__(self, key) -> bool:
+        return key in self.KEYS and self._header[self.KEYS.index(key), 0] > 0
+
+    def get(self, key: str, default=None) -> Optional[Result]:
+        i = self._index(key)
+        header = self._header[i]
+        if header[0] <= 0:
+            return default
+        n, c = int(header[4]), int(header[5])
+        boxes = self._boxes[i, :n, :c].copy()
+        timestamp = None if np.isnan(header[2]) else float(header[2])
+        return Result(int(header[1]), boxes, timestamp, self.SOURCES[int(header[3])])
+
+    def __getitem__(self, key: str) -> Result:
+        result = self.get(key)
+        if result is None:
+            raise KeyError(key)
+        return result
+
+    def __setitem__(self, key: str, result: Result):
+        i = self._index(key)
+        boxes = as_boxes(result.boxes)
+        n = min(len(boxes), self.max_boxes)
+        c = min(boxes.shape[1], self.columns)
+        self._boxes[i, :n, :c] = boxes[:n, :c]
+        timestamp = np.nan if result.timestamp is None else result.timestamp
+        self._header[i, 1:] = (result.number, timestamp, self.SOURCES.index(result.source), n, c)
+        self._header[i, 0] = 1
+
+    def pop(self, key: str, default=None) -> Optional[Result]:
+        result = self.get(key)
+        if result is None:
+            return default
+        self._header[self._index(key), 0] = 0
+        return result
+
+    def __delitem__(self, key: str):
+        if self.pop(key) is None:
+            raise KeyError(key)
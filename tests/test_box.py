@@ -0,0 +1,75 @@
+import sys
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from teot.utils.box import iou_matrix, greedy_match, linear_assignment, associate
+
+
+@pytest.fixture(params=["scipy", "greedy"])
+def solver(request, monkeypatch):
+    """linear_assignment在有scipy时用匈牙利算法，没有时退回到贪心匹配，两种情况都要测"""
+    if request.param == "scipy":
+        pytest.importorskip("scipy.optimize")
+    else:
+        monkeypatch.setitem(sys.modules, "scipy.optimize", None)
+    return request.param
+
+
+def test_iou_matrix():
+    a = np.array([[0, 0, 10, 10], [20, 20, 30, 30]], dtype=float)
+    b = np.array([[0, 0, 10, 10], [5, 0, 15, 10], [100, 100, 110, 110]], dtype=float)
+    np.testing.assert_allclose(iou_matrix(a, b), [[1, 1 / 3, 0], [0, 0, 0]])
+    assert iou_matrix(a, np.zeros((0, 4))).shape == (2, 0)
+
+
+def test_greedy_match():
+    iou = np.array([[0.9, 0.5, 0.0],
+                    [0.8, 0.6, 0.0],
+                    [0.0, 0.0, 0.2]])
+    # 先匹配IoU最大的(0, 0)，第1行只能退而求其次匹配第1列，(2, 2)低于阈值
+    assert greedy_match(iou, 0.3) == [(0, 0), (1, 1)]
+    assert greedy_match(iou, 0.1) == [(0, 0), (1, 1), (2, 2)]
+    assert greedy_match(np.zeros((0, 3))) == []
+
+
+def test_linear_assignment(solver):
+    # 贪心先拿走代价最小的(0, 0)，剩下的(1, 1)代价很大；匈牙利算法找到总代价最小的交叉匹配
+    cost = np.array([[1.0, 2.0],
+                     [2.0, 100.0]])
+    matches = sorted(linear_assignment(cost))
+    if solver == "scipy":
+        assert matches == [(0, 1), (1, 0)]
+    else:
+        assert matches == [(0, 0), (1, 1)]
+    assert linear_assignment(np.zeros((0, 2))) == []
+    # 行列数不同时只匹配较少的一边
+    assert len(linear_assignment(np.array([[1.0, 2.0, 3.0]]))) == 1
+
+
+def test_associate(solver):
+    dets = np.array([[0, 0, 10, 10],
+                     [50, 50, 60, 60],
+                     [100, 0, 110, 10]], dtype=float)
+    tracks = np.array([[51, 51, 61, 61],
+                       [1, 0, 11, 10],
+                       [200, 200, 210, 210]], dtype=float)
+    matches, unmatched_dets, unmatched_tracks = associate(dets, tracks, 0.3)
+    assert sorted(matches) == [(0, 1), (1, 0)]
+    assert unmatched_dets == [2]
+    assert unmatched_tracks == [2]
+
+
+def test_associate_threshold(solver):
+    dets = np.array([[0, 0, 10, 10]], dtype=float)
+    tracks = np.array([[5, 0, 15, 10]], dtype=float)
+    # IoU是1/3
+    assert associate(dets, tracks, 0.3)[0] == [(0, 0)]
+    matches, unmatched_dets, unmatched_tracks = associate(dets, tracks, 0.5)
+    assert matches == [] and unmatched_dets == [0] and unmatched_tracks == [0]
+
+
+def test_associate_empty(solver):
+    tracks = np.array([[0, 0, 10, 10]], dtype=float)
+    assert associate(np.zeros((0, 4)), tracks) == ([], [], [0])
+    assert associate(tracks, np.zeros((0, 4))) == ([], [0], [])
@@ -0,0 +1,66 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from teot.utils.record import ResultWriter, ResultReader
+
+
+def boxes(n, track_ids=None):
+    out = np.zeros((n, 7 if track_ids is not None else 6))
+    out[:, 0] = np.arange(n) % 3
+    out[:, 1] = 0.5
+    out[:, 2:6] = np.arange(n)[:, None] * 10 + np.array([0, 0, 5, 5])
+    if track_ids is not None:
+        out[:, 6] = track_ids
+    return out
+
+
+def write(path, items):
+    writer = ResultWriter(str(path))
+    for frame_no, b, timestamp in items:
+        writer.write(frame_no, b, timestamp)
+    writer.close()
+    assert writer.dropped == 0
+
+
+def test_round_trip(tmp_path):
+    write(tmp_path, [(0, boxes(2, [1, 2]), 100.2), (1, boxes(0), 100.5), (2, boxes(3, [1, 2, 3]), 101.7)])
+    reader = ResultReader(str(tmp_path))
+    assert len(reader) == 5
+    everything = reader.query_time(0, 1e9)
+    np.testing.assert_array_equal(everything["frame_no"], [0, 0, 2, 2, 2])
+    np.testing.assert_array_equal(everything["track_id"], [1, 2, 1, 2, 3])
+    np.testing.assert_allclose(everything["x2"], [5, 15, 5, 15, 25])
+    # 没有track_id的框记为-1
+    write(tmp_path, [(3, boxes(1), 102.0)])
+    assert ResultReader(str(tmp_path)).query_time(102, 103)["track_id"].tolist() == [-1]
+
+
+def test_query_time(tmp_path):
+    write(tmp_path, [(nf, boxes(2, [1, 2]), 100 + nf * 0.4) for nf in range(10)])
+    reader = ResultReader(str(tmp_path))
+    # [101.0, 102.0)里是第3、4帧（101.2、101.6）
+    assert reader.query_time(101, 102, ["frame_no"])["frame_no"].tolist() == [3, 3, 4, 4]
+    assert reader.query_time(100.4, 100.8)["frame_no"].tolist() == [1, 1]
+    assert len(reader.query_time(200, 300)["frame_no"]) == 0
+    assert set(reader.query_time(100, 101, ["x1", "y1"])) == {"x1", "y1"}
+
+
+def test_query_track(tmp_path):
+    write(tmp_path, [(nf, boxes(2, [7, 8 + nf % 2]), 100 + nf * 0.5) for nf in range(6)])
+    reader = ResultReader(str(tmp_path))
+    assert reader.query_track(7)["frame_no"].tolist() == [0, 1, 2, 3, 4, 5]
+    assert reader.query_track(9)["frame_no"].tolist() == [1, 3, 5]
+    assert reader.query_track(9, 101, 102)["frame_no"].tolist() == [3]
+    assert len(reader.query_track(42)["frame_no"]) == 0
+
+
+def test_append_after_reopen(tmp_path):
+    # 重新打开后接着往后写，同一秒内的记录在重新打开前后都要能查到
+    write(tmp_path, [(0, boxes(2, [1, 2]), 100.1), (1, boxes(2, [1, 2]), 100.3)])
+    write(tmp_path, [(2, boxes(2, [1, 2]), 100.6), (3, boxes(2, [1, 2]), 101.2)])
+    reader = ResultReader(str(tmp_path))
+    assert len(reader) == 8
+    assert reader.query_time(100, 101, ["frame_no"])["frame_no"].tolist() == [0, 0, 1, 1, 2, 2]
+    assert reader.query_time(100.2, 100.7, ["frame_no"])["frame_no"].tolist() == [1, 1, 2, 2]
+    assert reader.query_track(2, 100, 102)["frame_no"].tolist() == [0, 1, 2, 3]
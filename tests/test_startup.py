@@ -0,0 +1,36 @@
+import multiprocessing
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+
+from teot.bench.startup import bench_startup, measure_import
+
+# 假检测器加载50ms、推理5ms，其余都是启动本身的开销
+LOAD_MS = 50
+LATENCY_MS = 5
+# spawn/forkserver的子进程需要重新import numpy和cv2，预算按最慢的启动方式给
+BUDGET_MS = 5000
+START_METHODS = [m for m in ("fork", "spawn", "forkserver") if m in multiprocessing.get_all_start_methods()]
+
+
+@pytest.mark.parametrize("start_method", START_METHODS)
+def test_process_startup(start_method):
+    row = bench_startup(start_method, "process", "kcf", load_ms=LOAD_MS, latency=LATENCY_MS, n_frames=150,
+                        timeout=BUDGET_MS / 1000)
+    assert row["ready_ms"] is not None and row["ready_ms"] < BUDGET_MS
+    assert row["first_box_ms"] is not None and row["first_box_ms"] < BUDGET_MS
+    assert row["init_ms"] <= row["ready_ms"] <= row["first_box_ms"]
+
+
+@pytest.mark.parametrize("backend", ["thread", "inline"])
+def test_in_process_startup(backend):
+    row = bench_startup(None, backend, "kcf", load_ms=LOAD_MS, latency=LATENCY_MS, n_frames=150,
+                        timeout=BUDGET_MS / 1000)
+    assert row["ready_ms"] is not None and row["ready_ms"] < BUDGET_MS
+    assert row["first_box_ms"] is not None and row["first_box_ms"] < BUDGET_MS
+
+
+def test_import_is_lazy():
+    # import teot不会加载cv2和模型，只是PEP 562的名字表
+    assert measure_import("teot", repeats=1) < 500
@@ -0,0 +1,132 @@
+import threading
+from multiprocessing import shared_memory
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+
+from teot.utils.data import Frame, Result
+from teot.utils.transport import SharedFrameRing, SharedResults
+
+SHAPE = (8, 12, 3)
+
+
+def image(nf):
+    return np.full(SHAPE, nf, dtype=np.uint8)
+
+
+@pytest.fixture
+def ring():
+    ring = SharedFrameRing(SHAPE, n_slots=3)
+    yield ring
+    ring.close()
+
+
+def test_publish_and_read(ring):
+    assert ring.latest() is None
+    for nf in range(5):
+        ring.publish(nf, image(nf))
+    frame = ring.latest()
+    assert frame.number == 4 and frame.timestamp is not None
+    np.testing.assert_array_equal(frame.image, image(4))
+    # 环形缓冲区里还保留着最近的n_slots帧
+    assert [ring.get(nf).number for nf in (2, 3, 4)] == [2, 3, 4]
+    np.testing.assert_array_equal(ring.get(2).image, image(2))
+    assert ring.get(1) is None
+    assert ring.get(7) is None
+
+
+def test_publish_checks_shape(ring):
+    with pytest.raises(ValueError):
+        ring.publish(0, np.zeros((4, 4, 3), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        SharedFrameRing(SHAPE, n_slots=1)
+
+
+def test_wait(ring):
+    assert ring.wait(-1, timeout=0.01) is None
+    timer = threading.Timer(0.05, ring.publish, (0, image(0)))
+    timer.start()
+    frame = ring.wait(-1, timeout=5)
+    timer.join()
+    assert frame is not None and frame.number == 0
+    # 没有比after_nf更新的帧时超时
+    assert ring.wait(0, timeout=0.01) is None
+
+
+def test_intact_after_overwrite(ring):
+    ring.publish(0, image(0))
+    frame = ring.latest()
+    ring.publish(1, image(1))
+    ring.publish(2, image(2))
+    assert ring.intact(frame)
+    # 第3帧写回第0帧的槽位
+    ring.publish(3, image(3))
+    assert not ring.intact(frame)
+    np.testing.assert_array_equal(frame.image, image(3))
+
+
+def test_copy(ring):
+    ring.publish(0, image(0))
+    frame = ring.latest()
+    copied = ring.copy(frame)
+    assert copied is not frame and copied.number == 0
+    for nf in range(1, 4):
+        ring.publish(nf, image(nf))
+    # 拷贝出来的帧不受覆盖影响，槽位已经被覆盖的帧拷贝不出来
+    np.testing.assert_array_equal(copied.image, image(0))
+    assert ring.copy(frame) is None
+
+
+def test_overwrite_releases_pyramid(ring):
+    ring.publish(0, image(0))
+    frame = ring.latest()
+    assert frame.pyramid.get(0.5).shape == (4, 6, 3)
+    # 同一帧的读端共享一个Frame，也就共享它的多尺度缓存
+    assert ring.get(0) is frame
+    for nf in range(1, 4):
+        ring.publish(nf, image(nf))
+    assert ring.latest() is not frame
+    assert frame._pyramid is None
+
+
+def test_attach(ring):
+    other = SharedFrameRing.attach(ring.descriptor(), ring.lock, ring.cond)
+    ring.publish(0, image(0))
+    np.testing.assert_array_equal(other.latest().image, image(0))
+    # 映射方关闭时不会unlink，写端仍然可以继续用
+    other.close()
+    ring.publish(1, image(1))
+    assert ring.latest().number == 1
+
+
+def test_attach_after_unlink():
+    ring = SharedFrameRing(SHAPE, n_slots=2)
+    descriptor = ring.descriptor()
+    ring.close()
+    with pytest.raises(FileNotFoundError):
+        SharedFrameRing.attach(descriptor, ring.lock, ring.cond)
+
+
+def test_close_is_tolerant():
+    ring = SharedFrameRing(SHAPE, n_slots=2)
+    # 共享内存已经被别的进程unlink掉时close不会出错，可以重复调用
+    shared_memory.SharedMemory(name=ring.descriptor()["name"]).unlink()
+    ring.close()
+    ring.close()
+    assert not ring.intact(Frame(0, None))
+
+
+def test_shared_results():
+    data = SharedResults(max_boxes=2)
+    assert "result" not in data and data.get("result") is None
+    boxes = np.arange(3 * 7, dtype=np.float64).reshape(3, 7)
+    data["result"] = Result(5, boxes, 1.5, "track")
+    result = data["result"]
+    assert (result.number, result.timestamp, result.source) == (5, 1.5, "track")
+    # 超出max_boxes的框被丢掉
+    np.testing.assert_array_equal(result.boxes, boxes[:2])
+    assert data.pop("result").number == 5
+    assert data.pop("result") is None and "result" not in data
+    with pytest.raises(KeyError):
+        data.get("frame")